@@ -0,0 +1,132 @@
+# encoding=utf-8
+# File name: Benchmark.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+"""
+Headless benchmark support for py-universe.py. A benchmark run renders
+a fixed number of frames of a named scenario with a fixed time delta
+and reports the results as JSON.
+"""
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from OpenGL.GL import glGetString, GL_RENDERER, GL_VERSION
+
+import json
+import platform
+import resource
+import sys
+import time
+
+# scenario name => (PythonicUniverse keyword arguments, name of the
+# argument which can be overridden by "name:N")
+SCENARIOS = {
+    "default": ({}, None),
+    "empty": ({"shipCount": 0, "windowCount": 0}, None),
+    "ships": ({"shipCount": 64}, "shipCount"),
+    "heavy-ui": ({"windowCount": 256}, "windowCount"),
+}
+
+def scenarioArguments(spec):
+    """
+    Return the PythonicUniverse keyword arguments for the scenario
+    *spec*, which is a scenario name, optionally followed by ``:N`` to
+    scale it (e.g. ``ships:128``).
+    """
+    name, _, count = spec.partition(":")
+    try:
+        kwargs, scaleArg = SCENARIOS[name]
+    except KeyError:
+        raise ValueError("Unknown benchmark scenario: {0} (known: {1})".format(
+            name, ", ".join(sorted(SCENARIOS))))
+    kwargs = dict(kwargs)
+    if count:
+        if scaleArg is None:
+            raise ValueError("Scenario {0} cannot be scaled".format(name))
+        kwargs[scaleArg] = int(count)
+    return kwargs
+
+def peakRSS():
+    """
+    Peak resident set size of this process in bytes.
+    """
+    # ru_maxrss is in kilobytes on Linux, but in bytes on OS X
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss
+    return maxrss * 1024
+
+def runBenchmark(app, scenario, frameCount, startupTime,
+        importTimer=None):
+    """
+    Run *app* for *frameCount* frames and return the benchmark result
+    as dict. The app must have been created with phase timing enabled.
+    If an :class:`ImportTimer` is given, the slowest imports of the
+    startup are included.
+    """
+    app._eventLoop.setFrameCount(frameCount)
+    start = time.time()
+    app.run()
+    wallTime = time.time() - start
+
+    timings = dict(
+        (label, {"frames": timer.frameCount, "phases": timer.summary()})
+        for label, timer in app.frameTimings().items())
+    frameTime = timings.get("cpu", {}).get("phases", {}).get("frame", {})
+    return {
+        "scenario": scenario,
+        "frames": frameCount,
+        "timeDelta": app.fixedTimeDelta,
+        "wallTime": wallTime,
+        "fps": frameCount / wallTime if wallTime > 0 else None,
+        "frameTime": frameTime,
+        "timings": timings,
+        "startupTime": startupTime,
+        "imports": (importTimer.report(top=50)
+                    if importTimer is not None else None),
+        "shaderCache": (app.programCache.stats()
+                        if app.programCache is not None else None),
+        "shaderCompiles": list(app.shaderPermutations.events),
+        "vfsCache": (app.vfs.cacheStats()
+                     if hasattr(app.vfs, "cacheStats") else None),
+        "peakRSS": peakRSS(),
+        "frameStats": app.frameStats.asDict(),
+        "memory": (app.memoryStats.report()
+                   if app.memoryStats is not None else None),
+        "platform": {
+            "python": platform.python_implementation() + " " +
+                      platform.python_version(),
+            "machine": platform.machine(),
+            "renderer": glGetString(GL_RENDERER).decode("utf-8"),
+            "glVersion": glGetString(GL_VERSION).decode("utf-8"),
+        },
+    }
+
+def writeResult(result, filename=None):
+    if filename is None:
+        json.dump(result, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(filename, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
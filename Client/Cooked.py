@@ -0,0 +1,382 @@
+# encoding=utf-8
+# File name: Cooked.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+"""
+Cooked textures and style sheets, as written by utils/cook/cook.py.
+Cooked meshes are in :mod:`Client.Mesh`.
+
+A cooked texture (``.tex``) holds a complete mip chain of straight
+(not premultiplied) RGBA8 texels: a :data:`TEXTURE_HEADER` followed by
+the levels, largest first, each ``max(1, width >> i)`` by
+``max(1, height >> i)`` texels with rows tightly packed.
+
+A cooked style sheet (``.rules``) is the result of the engine's CSS
+loader for the style sheet of the same base name, as JSON. Objects are
+stored as their class name and attributes; only classes of the engine's
+CSS modules (:data:`RULES_PACKAGES`) which are already imported can be
+read back, so a file cannot make the client import or call anything
+else. The file records a fingerprint of the sources of those modules,
+so rules cooked with another version of the engine are recognized as
+stale (see :func:`writeRules`).
+
+Cooked files are named like their source with the extension replaced
+and may be placed next to it. They are looked up and read through the
+VFS, so they are found in packs and overrides like any resource.
+"""
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from OpenGL.GL import *
+
+import base64
+import hashlib
+import json
+import os
+import struct
+import sys
+import numpy as np
+
+TEXTURE_MAGIC = b"PUTX"
+TEXTURE_VERSION = 1
+# magic, version, width, height, level count
+TEXTURE_HEADER = b"<4sIIII"
+
+RULES_MAGIC = "PURL"
+RULES_VERSION = 2
+# the only modules whose classes may appear in cooked rules
+RULES_PACKAGES = ("Engine.UI.CSS", "Engine.Resources.CSSLoader")
+
+def levelSizes(width, height):
+    sizes = [(width, height)]
+    while width > 1 or height > 1:
+        width, height = max(1, width // 2), max(1, height // 2)
+        sizes.append((width, height))
+    return sizes
+
+def buildMipChain(rgba):
+    """
+    Return the list of mip levels of the ``(h, w, 4)`` uint8 array
+    *rgba*, each downsampled from the previous one with a box filter.
+    """
+    levels = [rgba]
+    h, w = rgba.shape[:2]
+    for w, h in levelSizes(w, h)[1:]:
+        previous = levels[-1].astype(np.uint32)
+        ph, pw = previous.shape[:2]
+        # odd sizes: repeat the last row / column
+        if ph % 2 and ph > 1:
+            previous = np.concatenate((previous, previous[-1:]), axis=0)
+        if pw % 2 and pw > 1:
+            previous = np.concatenate((previous, previous[:, -1:]), axis=1)
+        if ph == 1:
+            previous = np.concatenate((previous, previous), axis=0)
+        if pw == 1:
+            previous = np.concatenate((previous, previous), axis=1)
+        level = (previous[0::2, 0::2] + previous[1::2, 0::2] +
+                 previous[0::2, 1::2] + previous[1::2, 1::2] + 2) // 4
+        levels.append(level[:h, :w].astype(np.uint8))
+    return levels
+
+def writeTexture(f, rgba):
+    """
+    Write the ``(h, w, 4)`` uint8 array *rgba* with its mip chain to the
+    binary file object *f*.
+    """
+    levels = buildMipChain(np.ascontiguousarray(rgba, dtype=np.uint8))
+    h, w = rgba.shape[:2]
+    f.write(struct.pack(TEXTURE_HEADER, TEXTURE_MAGIC, TEXTURE_VERSION,
+                        w, h, len(levels)))
+    for level in levels:
+        f.write(np.ascontiguousarray(level).tobytes())
+
+def _contents(f):
+    # files opened from pack mounts hand out their data without a copy
+    getbuffer = getattr(f, "getbuffer", None)
+    if getbuffer is not None:
+        return getbuffer()
+    return f.read()
+
+def readTexture(f, copy=False):
+    """
+    Return ``(width, height, levels)`` of the cooked texture read from
+    the binary file object *f*, with the levels as uint8 arrays. Unless
+    *copy* is set, they may be views of the data of *f* which must not
+    be used after closing it.
+    """
+    data = _contents(f)
+    magic, version, width, height, count = struct.unpack_from(
+        TEXTURE_HEADER, data, 0)
+    if magic != TEXTURE_MAGIC or version != TEXTURE_VERSION:
+        raise ValueError("{0} is not a cooked texture of version {1}".format(
+            getattr(f, "name", f), TEXTURE_VERSION))
+    levels = []
+    offset = struct.calcsize(TEXTURE_HEADER)
+    for w, h in levelSizes(width, height)[:count]:
+        size = w * h * 4
+        level = np.frombuffer(data, dtype=np.uint8, count=size,
+                              offset=offset)
+        levels.append(np.array(level) if copy else level)
+        offset += size
+    return width, height, levels
+
+def loadTexture(f, textureType):
+    """
+    Create a *textureType* (i.e. Texture2D) from the cooked texture read
+    from *f*, with all mip levels uploaded.
+    """
+    return createTexture(textureType, *readTexture(f))
+
+def createTexture(textureType, width, height, levels):
+    """
+    Create a *textureType* from the result of :func:`readTexture`. This
+    is the part of loading which has to happen on the main thread.
+    """
+    texture = textureType(width, height, format=GL_RGBA,
+        data=(GL_RGBA, GL_UNSIGNED_BYTE, levels[0]))
+    texture.bind()
+    for i, level in enumerate(levels[1:], 1):
+        w, h = levelSizes(width, height)[i]
+        glTexImage2D(GL_TEXTURE_2D, i, GL_RGBA, w, h, 0, GL_RGBA,
+                     GL_UNSIGNED_BYTE, level)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER,
+                    GL_LINEAR_MIPMAP_LINEAR)
+    textureType.unbind()
+    return texture
+
+def cookedPath(vfs, name, extension):
+    """
+    Return the VFS path of the cooked form of the resource *name*, i.e.
+    with its extension replaced by *extension*, if *vfs* has it, else
+    None. Relative names are taken to be below ``/data``.
+    """
+    if not name.startswith("/"):
+        name = "/data/" + name
+    path = os.path.splitext(name)[0] + extension
+    return path if vfs.fileReadable(path) else None
+
+def _allowedModule(name):
+    return any(name == package or name.startswith(package + ".")
+               for package in RULES_PACKAGES)
+
+def _className(cls):
+    return "{0}:{1}".format(cls.__module__, cls.__name__)
+
+def ruleClasses():
+    """
+    Return the classes cooked rules may contain, keyed like in the file:
+    those defined in the already imported modules of
+    :data:`RULES_PACKAGES`. Nothing is imported here; the CSS loader has
+    to be imported before rules can be read.
+    """
+    classes = {}
+    for name, module in list(sys.modules.items()):
+        if module is None or not _allowedModule(name):
+            continue
+        for value in list(vars(module).values()):
+            if isinstance(value, type) and value.__module__ == name:
+                classes[_className(value)] = value
+    return classes
+
+def _sourceHash(module):
+    path = getattr(module, "__file__", None)
+    if path is None:
+        return "builtin"
+    if path.endswith((".pyc", ".pyo")) and os.path.isfile(path[:-1]):
+        path = path[:-1]
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def rulesFingerprint(classes):
+    """
+    Return the SHA-1 over the sources of the modules defining the
+    *classes* (an iterable of classes), so rules are recognized as stale
+    when any of them changes.
+    """
+    h = hashlib.sha1(str(RULES_VERSION).encode("ascii"))
+    for name in sorted(set(cls.__module__ for cls in classes)):
+        h.update(name.encode("utf-8"))
+        h.update(_sourceHash(sys.modules[name]).encode("ascii"))
+    return h.hexdigest()
+
+# int and long on Python 2
+_integerTypes = tuple(set((type(0), type(2**64))))
+_plainTypes = (bool, float, type("")) + _integerTypes
+# builtin types engine classes may derive from, in order of precedence
+_valueTypes = (bool, int, float, type(""), bytes, tuple, frozenset)
+
+class _RulesEncoder(object):
+    """
+    Turns rules into JSON compatible data. Instances of the classes of
+    :data:`RULES_PACKAGES` are written as their attributes; an instance
+    met again is written as a reference, so shared objects stay shared.
+    """
+
+    def __init__(self, **kwargs):
+        super(_RulesEncoder, self).__init__(**kwargs)
+        self.classes = set()
+        self._objects = {}
+
+    def encode(self, value):
+        if value is None or type(value) in _plainTypes:
+            return value
+        if type(value) is bytes:
+            return {"__bytes__":
+                    base64.b64encode(value).decode("ascii")}
+        if type(value) is list:
+            return [self.encode(item) for item in value]
+        if type(value) is tuple:
+            return {"__tuple__": [self.encode(item) for item in value]}
+        if type(value) in (set, frozenset):
+            return {"__" + type(value).__name__ + "__":
+                    [self.encode(item) for item in value]}
+        if type(value) is dict:
+            return {"__dict__": [[self.encode(k), self.encode(v)]
+                                 for k, v in value.items()]}
+        return self._encodeObject(value)
+
+    def _encodeObject(self, obj):
+        cls = type(obj)
+        if not _allowedModule(cls.__module__):
+            raise TypeError("Cannot cook {0} into rules".format(
+                _className(cls)))
+        if id(obj) in self._objects:
+            return {"__ref__": self._objects[id(obj)][0]}
+        self.classes.add(cls)
+        data = {"__object__": _className(cls)}
+        # instances of builtin types are created with their value
+        for base in _valueTypes:
+            if isinstance(obj, base):
+                data["value"] = self.encode(base(obj))
+                break
+        self._objects[id(obj)] = (len(self._objects), obj)
+        state = dict(getattr(obj, "__dict__", {}))
+        for klass in cls.__mro__:
+            for slot in getattr(klass, "__slots__", ()):
+                if slot not in ("__dict__", "__weakref__") and \
+                        hasattr(obj, slot):
+                    state[slot] = getattr(obj, slot)
+        data["state"] = [[name, self.encode(value)]
+                         for name, value in sorted(state.items())]
+        return data
+
+class _RulesDecoder(object):
+    def __init__(self, classes, **kwargs):
+        super(_RulesDecoder, self).__init__(**kwargs)
+        self.classes = classes
+        self._objects = []
+
+    def decode(self, data):
+        if isinstance(data, list):
+            return [self.decode(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+        if "__tuple__" in data:
+            return tuple(self.decode(item) for item in data["__tuple__"])
+        if "__set__" in data:
+            return set(self.decode(item) for item in data["__set__"])
+        if "__frozenset__" in data:
+            return frozenset(self.decode(item)
+                             for item in data["__frozenset__"])
+        if "__dict__" in data:
+            return dict((self.decode(k), self.decode(v))
+                        for k, v in data["__dict__"])
+        if "__bytes__" in data:
+            return base64.b64decode(data["__bytes__"].encode("ascii"))
+        if "__ref__" in data:
+            return self._objects[data["__ref__"]]
+        return self._decodeObject(data)
+
+    def _decodeObject(self, data):
+        cls = self.classes.get(data["__object__"])
+        if cls is None:
+            raise ValueError("Unknown class {0} in rules".format(
+                data["__object__"]))
+        if "value" in data:
+            obj = cls.__new__(cls, self.decode(data["value"]))
+        else:
+            obj = cls.__new__(cls)
+        self._objects.append(obj)
+        for name, value in data["state"]:
+            object.__setattr__(obj, name, self.decode(value))
+        return obj
+
+def writeRules(f, rules):
+    """
+    Write the *rules* loaded by the engine's CSS loader to the binary
+    file object *f*. Raise :class:`TypeError` if they contain objects of
+    classes outside of :data:`RULES_PACKAGES`.
+    """
+    encoder = _RulesEncoder()
+    data = encoder.encode(rules)
+    document = {
+        "magic": RULES_MAGIC,
+        "classes": sorted(_className(cls) for cls in encoder.classes),
+        "fingerprint": rulesFingerprint(encoder.classes),
+        "rules": data,
+    }
+    f.write(json.dumps(document, sort_keys=True).encode("ascii"))
+
+def _readRules(f):
+    data = _contents(f)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    try:
+        document = json.loads(data.decode("utf-8"))
+    except ValueError:
+        return None, None
+    if not isinstance(document, dict) or \
+            document.get("magic") != RULES_MAGIC:
+        return None, None
+    known = ruleClasses()
+    try:
+        classes = dict((name, known[name]) for name in document["classes"])
+    except KeyError:
+        return None, None
+    if document["fingerprint"] != rulesFingerprint(classes.values()):
+        return None, None
+    return document, classes
+
+def rulesCurrent(f):
+    """
+    Return whether the cooked rules in *f* were written for the engine
+    classes loaded now.
+    """
+    return _readRules(f)[0] is not None
+
+def loadRules(f):
+    """
+    Return the cooked rules read from *f*, or None if they are stale and
+    the style sheet has to be loaded instead.
+    """
+    document, classes = _readRules(f)
+    if document is None:
+        return None
+    try:
+        return _RulesDecoder(classes).decode(document["rules"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        # classes whose layout changed without a change of the source
+        # hash, e.g. with another Python version
+        return None
@@ -0,0 +1,60 @@
+# encoding=utf-8
+# File name: FrameStats.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+class FrameStats(object):
+    """
+    Collects counters which are reset every frame (*current*) and
+    accumulated over the whole run (*totals*), plus gauges which just
+    hold the last value set.
+    """
+
+    def __init__(self, **kwargs):
+        super(FrameStats, self).__init__(**kwargs)
+        self.frames = 0
+        self.current = {}
+        self.totals = {}
+        self.gauges = {}
+
+    def beginFrame(self):
+        self.frames += 1
+        self.current.clear()
+
+    def add(self, name, value=1):
+        self.current[name] = self.current.get(name, 0) + value
+        self.totals[name] = self.totals.get(name, 0) + value
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def asDict(self):
+        return {
+            "frames": self.frames,
+            "current": dict(self.current),
+            "totals": dict(self.totals),
+            "gauges": dict(self.gauges),
+        }
@@ -0,0 +1,166 @@
+# encoding=utf-8
+# File name: FrameTimer.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import csv
+import io
+import json
+import sys
+import time
+import numpy as np
+
+class FrameTimer(object):
+    """
+    Records time per frame phase into a ring buffer holding the last
+    *capacity* frames.
+
+    A frame is started with :meth:`begin`; each :meth:`mark` attributes
+    the time since the previous mark to the named phase (phases hit more
+    than once per frame accumulate) and :meth:`end` commits the frame.
+    Phases not hit in a frame count as zero.
+    """
+
+    def __init__(self, phases, capacity=1024, clock=time.time, **kwargs):
+        super(FrameTimer, self).__init__(**kwargs)
+        self.phases = list(phases)
+        self.capacity = capacity
+        self._clock = clock
+        self._indices = dict((name, i) for i, name in enumerate(self.phases))
+        self._samples = np.zeros((capacity, len(self.phases)))
+        self._totals = np.zeros(capacity)
+        self._row = [0.] * len(self.phases)
+        self._index = 0
+        self._count = 0
+        self._start = None
+        self._last = None
+
+    def begin(self):
+        self._row = [0.] * len(self.phases)
+        self._start = self._last = self._clock()
+
+    def mark(self, phase):
+        now = self._clock()
+        self._row[self._indices[phase]] += now - self._last
+        self._last = now
+
+    def end(self):
+        self.record(self._row, self._clock() - self._start)
+
+    def samples(self):
+        """
+        Return the ``(phases, totals)`` arrays of all frames in the
+        buffer, oldest first.
+        """
+        if self._count < self.capacity:
+            return self._samples[:self._count], self._totals[:self._count]
+        order = np.roll(np.arange(self.capacity), -self._index)
+        return self._samples[order], self._totals[order]
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """
+        Return a dict mapping each phase and ``"frame"`` to a dict with
+        the mean and the given percentiles in seconds.
+        """
+        phases, totals = self.samples()
+        result = {}
+        if not len(totals):
+            return result
+        columns = [(name, phases[:, i]) for i, name in enumerate(self.phases)]
+        columns.append(("frame", totals))
+        for name, values in columns:
+            entry = {"mean": float(values.mean())}
+            for p in percentiles:
+                entry["p{0}".format(p)] = float(np.percentile(values, p))
+            result[name] = entry
+        return result
+
+    def record(self, row, total=None):
+        """
+        Commit a complete frame of phase durations at once, for timings
+        which are not measured with the CPU clock.
+        """
+        index = self._index
+        self._samples[index] = row
+        self._totals[index] = sum(row) if total is None else total
+        self._index = (index + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    @property
+    def frameCount(self):
+        return self._count
+
+
+def dumpTimings(filename, timers):
+    """
+    Write the summaries of the :class:`FrameTimer` objects in the
+    *timers* dict, keyed by a label such as ``"cpu"``, to *filename*;
+    as CSV if it ends in ``.csv`` and as JSON otherwise.
+    """
+    if filename.endswith(".csv"):
+        with openCSV(filename, "w") as f:
+            dumpTimingsCSV(f, timers)
+    else:
+        with open(filename, "w") as f:
+            dumpTimingsJSON(f, timers)
+
+def openCSV(filename, mode="r"):
+    """
+    Open *filename* the way the csv module of the running Python wants
+    it: in binary mode on Python 2, as text without newline translation
+    on Python 3.
+    """
+    if sys.version_info[0] < 3:
+        return open(filename, mode + "b")
+    return io.open(filename, mode, newline="", encoding="utf-8")
+
+def dumpTimingsCSV(f, timers):
+    """
+    Write one row per clock and phase to *f*, opened with
+    :func:`openCSV`.
+    """
+    if sys.version_info[0] < 3:
+        text = lambda value: value.encode("utf-8")
+    else:
+        text = lambda value: value
+    writer = csv.writer(f)
+    writer.writerow([text(column) for column in
+                     ("clock", "phase", "mean", "p50", "p95", "p99")])
+    for label, timer in sorted(timers.items()):
+        summary = timer.summary()
+        for name in timer.phases + ["frame"]:
+            if name not in summary:
+                continue
+            entry = summary[name]
+            writer.writerow(
+                [text(label), text(name)] +
+                [repr(entry[key]) for key in ("mean", "p50", "p95", "p99")])
+
+def dumpTimingsJSON(f, timers):
+    json.dump(dict(
+        (label, {"frames": timer.frameCount, "phases": timer.summary()})
+        for label, timer in timers.items()
+    ), f, indent=2, sort_keys=True)
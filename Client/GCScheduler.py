@@ -0,0 +1,117 @@
+# encoding=utf-8
+# File name: GCScheduler.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import gc
+import time
+
+class GCScheduler(object):
+    """
+    Runs the cyclic garbage collector at points chosen by the frame loop
+    instead of whenever an allocation happens to cross a threshold.
+
+    Between :meth:`start` and :meth:`stop`, automatic collection is
+    disabled. After each frame, :meth:`afterFrame` collects the oldest
+    generation whose threshold is reached, like the collector would, if
+    the frame left at least *minSlack* seconds of its *frameBudget*. A
+    full collection (generation 2) additionally needs as much slack as
+    the last one took; until a frame leaves that much, generation 1 is
+    collected instead. If collections had to be deferred for so long
+    that the pending count exceeds *forceFactor* times the collector's
+    threshold, they run regardless of slack. :meth:`collectFull` is
+    meant for loading phases.
+
+    Pauses are recorded into the *stats* :class:`FrameStats` as
+    ``gcPauseTime`` and ``gcCollections``, and the longest pause as the
+    ``gcMaxPause`` gauge.
+    """
+
+    def __init__(self, stats, frameBudget=1/60, minSlack=0.002,
+            forceFactor=10, **kwargs):
+        super(GCScheduler, self).__init__(**kwargs)
+        self.stats = stats
+        self.frameBudget = frameBudget
+        self.minSlack = minSlack
+        self.forceFactor = forceFactor
+        self.maxPause = 0.
+        self.fullPause = 0.
+        self._wasEnabled = None
+
+    def start(self):
+        if self._wasEnabled is None:
+            self._wasEnabled = gc.isenabled()
+            gc.disable()
+
+    def stop(self):
+        if self._wasEnabled is not None:
+            if self._wasEnabled:
+                gc.enable()
+            self._wasEnabled = None
+
+    def _collect(self, generation):
+        start = time.time()
+        gc.collect(generation)
+        pause = time.time() - start
+        self.stats.add("gcPauseTime", pause)
+        self.stats.add("gcCollections")
+        if pause > self.maxPause:
+            self.maxPause = pause
+            self.stats.set("gcMaxPause", pause)
+        if generation == 2:
+            self.fullPause = pause
+            self.stats.add("gcFullCollections")
+        return pause
+
+    def afterFrame(self, frameStart):
+        """
+        Collect young generations if the frame started at *frameStart*
+        left enough of its budget, or if collection cannot be deferred
+        any longer.
+        """
+        count0, count1, count2 = gc.get_count()
+        threshold0, threshold1, threshold2 = gc.get_threshold()
+        if count0 < threshold0:
+            return
+        generation = 0
+        if count1 >= threshold1:
+            generation = 2 if count2 >= threshold2 else 1
+        slack = self.frameBudget - (time.time() - frameStart)
+        if slack < self.minSlack and count0 < threshold0 * self.forceFactor:
+            self.stats.add("gcDeferred")
+            return
+        if generation == 2 and slack < self.fullPause and \
+                count2 < threshold2 * self.forceFactor:
+            self.stats.add("gcFullDeferred")
+            generation = 1
+        self._collect(generation)
+
+    def collectFull(self):
+        """
+        Collect all generations. Only call this while loading, where a
+        long pause does not hurt.
+        """
+        return self._collect(2)
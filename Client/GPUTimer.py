@@ -0,0 +1,96 @@
+# encoding=utf-8
+# File name: GPUTimer.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from OpenGL.GL import *
+from OpenGL.GL.ARB.timer_query import glInitTimerQueryARB
+import numpy as np
+
+from Client.FrameTimer import FrameTimer
+
+def timerQueriesSupported():
+    return bool(glInitTimerQueryARB())
+
+class GPUTimer(object):
+    """
+    Measures GPU time per frame phase with GL_TIME_ELAPSED queries.
+
+    Each phase is enclosed in :meth:`begin` and :meth:`end`; phases must
+    not nest. Query results are only read back *latency* frames after
+    they were issued, and only if available by then, so the CPU never
+    waits for the GPU. Completed frames are recorded into
+    :attr:`timings`, a :class:`FrameTimer` with the same phases.
+    """
+
+    def __init__(self, phases, latency=3, capacity=1024, **kwargs):
+        super(GPUTimer, self).__init__(**kwargs)
+        self.phases = list(phases)
+        self.latency = latency
+        self.timings = FrameTimer(self.phases, capacity=capacity)
+        self.dropped = 0
+        self._indices = dict((name, i) for i, name in enumerate(self.phases))
+        self._queries = [
+            [glGenQueries(1) for phase in self.phases]
+            for i in range(latency + 1)]
+        self._issued = [[False] * len(self.phases)
+                        for i in range(latency + 1)]
+        self._frame = 0
+        self._result = np.zeros(1, dtype=np.uint64)
+
+    def begin(self, phase):
+        slot = self._frame % len(self._queries)
+        index = self._indices[phase]
+        self._issued[slot][index] = True
+        glBeginQuery(GL_TIME_ELAPSED, self._queries[slot][index])
+
+    def end(self):
+        glEndQuery(GL_TIME_ELAPSED)
+
+    def endFrame(self):
+        """
+        Finish the current frame and collect the results of the oldest
+        frame in flight. If its queries are not done yet, the frame is
+        dropped (and counted in :attr:`dropped`) instead of waiting.
+        """
+        self._frame += 1
+        slot = self._frame % len(self._queries)
+        issued = self._issued[slot]
+        if self._frame <= self.latency or not any(issued):
+            return
+        queries = self._queries[slot]
+        row = [0.] * len(self.phases)
+        for index, query in enumerate(queries):
+            if not issued[index]:
+                continue
+            if not glGetQueryObjectuiv(query, GL_QUERY_RESULT_AVAILABLE):
+                self.dropped += 1
+                break
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, self._result)
+            row[index] = int(self._result[0]) * 1e-9
+        else:
+            self.timings.record(row)
+        self._issued[slot] = [False] * len(self.phases)
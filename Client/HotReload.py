@@ -0,0 +1,226 @@
+# encoding=utf-8
+# File name: HotReload.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from Engine.CEngine.Log import server as log, Severity
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import threading
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF)
+
+# wd, mask, cookie, name length
+_event = struct.Struct(b"iIII")
+
+_libc = None
+
+def _loadLibc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                            use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return _libc
+
+def inotifySupported():
+    try:
+        return hasattr(_loadLibc(), "inotify_init1")
+    except OSError:
+        return False
+
+class DirectoryWatcher(object):
+    """
+    Watches a directory tree with inotify, through ctypes.
+
+    A background thread blocks reading the inotify descriptor, so
+    nothing is spent while no file changes. Changed paths (relative to
+    *directory*, with ``/`` as separator) are queued and collected on
+    the main thread with :meth:`changes`. Directories created later
+    are watched as well.
+    """
+
+    def __init__(self, directory, **kwargs):
+        super(DirectoryWatcher, self).__init__(**kwargs)
+        libc = _loadLibc()
+        self.directory = os.path.abspath(directory)
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._watches = {}
+        self._changed = collections.deque()
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            self._addWatch(dirpath)
+        self._thread = threading.Thread(target=self._run,
+            name="DirectoryWatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _addWatch(self, path):
+        wd = _libc.inotify_add_watch(self._fd,
+            os.fsencode(path) if hasattr(os, "fsencode") else
+            path.encode("utf-8"), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            log.log(Severity.Warning, "Cannot watch {0}: {1}".format(
+                path, os.strerror(err)))
+            return
+        self._watches[wd] = path
+
+    def _run(self):
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                # closed by close()
+                return
+            if not data:
+                return
+            offset = 0
+            while offset + _event.size <= len(data):
+                wd, mask, cookie, length = _event.unpack_from(data, offset)
+                offset += _event.size
+                name = data[offset:offset+length].rstrip(b"\0")
+                offset += length
+                self._handle(wd, mask, name.decode("utf-8", "replace"))
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # events were lost; report everything as changed
+            self._changed.append(None)
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        directory = self._watches.get(wd)
+        if directory is None:
+            return
+        path = os.path.join(directory, name) if name else directory
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            for dirpath, dirnames, filenames in os.walk(path):
+                self._addWatch(dirpath)
+            return
+        self._changed.append(
+            os.path.relpath(path, self.directory).replace(os.sep, "/"))
+
+    def changes(self):
+        """
+        Return the set of paths changed since the last call. It contains
+        None if changes may have been missed.
+        """
+        changed = set()
+        while self._changed:
+            changed.add(self._changed.popleft())
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class HotReloader(object):
+    """
+    Maps changed files in the data directory to the resources depending
+    on them.
+
+    Handlers are registered with :meth:`depend`, for a path relative to
+    the data directory, for a file name in any directory (if the
+    pattern has no ``/``) or, if it ends in ``/``, for everything below
+    a directory. :meth:`pump`, called once per frame, runs each affected
+    handler once with the list of changed paths; several events for the
+    same file within a frame thus cause one reload. Handlers are
+    expected to do the actual loading in the background, e.g. through
+    :class:`AsyncLoader` or :class:`ShaderPermutations`.
+
+    *invalidate*, if given, is called without arguments before the
+    handlers whenever something changed, to drop the VFS path cache.
+    Which mount paths a file corresponds to is not known here, and
+    rebuilding the cache is cheap.
+    """
+
+    def __init__(self, watcher, invalidate=None, **kwargs):
+        super(HotReloader, self).__init__(**kwargs)
+        self.watcher = watcher
+        self.invalidate = invalidate
+        self.reloads = 0
+        self._handlers = []
+
+    def depend(self, path, handler):
+        self._handlers.append((path, handler))
+
+    def _matches(self, pattern, path):
+        if path is None:
+            return True
+        if pattern.endswith("/"):
+            return path.startswith(pattern)
+        if "/" not in pattern:
+            return path.rsplit("/", 1)[-1] == pattern
+        return path == pattern
+
+    def pump(self):
+        changed = self.watcher.changes()
+        if not changed:
+            return
+        if self.invalidate is not None:
+            self.invalidate()
+        affected = collections.OrderedDict()
+        for pattern, handler in self._handlers:
+            paths = [path for path in changed
+                     if self._matches(pattern, path)]
+            if paths:
+                affected.setdefault(handler, []).extend(paths)
+        for handler, paths in affected.items():
+            log.log(Severity.Information, "Reloading after changes to {0}".format(
+                ", ".join(path or "<unknown>" for path in paths)))
+            self.reloads += 1
+            try:
+                handler(paths)
+            except Exception as err:
+                log.log(Severity.Error, "Reload failed: {0}".format(err))
@@ -0,0 +1,135 @@
+# encoding=utf-8
+# File name: ImportTimer.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+import sys
+import time
+
+class ImportTimer(object):
+    """
+    Measures how long first imports of each module take, similar to
+    ``python -X importtime`` (which Python 2 lacks), by wrapping
+    ``__import__``.
+
+    For each module, the cumulative time (including the modules it
+    imports) and the self time are recorded. Install it as early as
+    possible; imports which happened before are not seen.
+    """
+
+    def __init__(self, **kwargs):
+        super(ImportTimer, self).__init__(**kwargs)
+        self.times = {}
+        self._original = None
+        self._stack = []
+
+    def install(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    # Python 2 tries implicit relative imports first by default
+    _defaultLevel = -1 if sys.version_info[0] < 3 else 0
+
+    @staticmethod
+    def _loaded(name):
+        # Python 2 caches failed implicit relative imports as None
+        return sys.modules.get(name) is not None
+
+    @staticmethod
+    def _resolve(name, globals, level):
+        """
+        Return the absolute names *name* may refer to when imported
+        from the module with *globals* at *level*, in the order they
+        are tried.
+        """
+        if level == 0 or not globals:
+            return [name]
+        package = globals.get("__package__")
+        if not package:
+            package = globals.get("__name__") or ""
+            if "__path__" not in globals:
+                package = package.rpartition(".")[0]
+        if level < 0:
+            return [package + "." + name, name] if package else [name]
+        for _ in range(level - 1):
+            package = package.rpartition(".")[0]
+        return [".".join(part for part in (package, name) if part)]
+
+    def _import(self, name, globals=None, locals=None, fromlist=(),
+                level=_defaultLevel):
+        candidates = [candidate for candidate in
+                      self._resolve(name, globals, level) if candidate]
+        loaded = [candidate for candidate in candidates
+                  if self._loaded(candidate)]
+        if loaded:
+            # only submodules named in the fromlist may be new
+            candidates = [loaded[0] + "." + item for item in fromlist or ()
+                          if item != "*"]
+            candidates = [candidate for candidate in candidates
+                          if not self._loaded(candidate)]
+        if not candidates:
+            return self._original(name, globals, locals, fromlist, level)
+        # [child time] of this import
+        entry = [0.]
+        self._stack.append(entry)
+        start = time.time()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += elapsed
+            imported = [candidate for candidate in candidates
+                        if self._loaded(candidate)]
+            # failed imports are recorded under the absolute name
+            key = imported[0] if imported else candidates[-1]
+            cumulative, selfTime = self.times.get(key, (0., 0.))
+            self.times[key] = (cumulative + elapsed,
+                               selfTime + elapsed - entry[0])
+
+    def report(self, top=None):
+        """
+        Return a list of ``{"module", "self", "cumulative"}`` dicts,
+        sorted by self time, limited to the *top* entries if given.
+        """
+        result = [
+            {"module": name, "self": selfTime, "cumulative": cumulative}
+            for name, (cumulative, selfTime) in self.times.items()
+        ]
+        result.sort(key=lambda entry: entry["self"], reverse=True)
+        if top is not None:
+            del result[top:]
+        return result
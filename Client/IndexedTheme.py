@@ -0,0 +1,117 @@
+# encoding=utf-8
+# File name: IndexedTheme.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+"""
+A :class:`Theme` which only tests the rules which can match a widget.
+
+The engine's Theme tests every rule against every widget when styles
+are applied. :class:`IndexedTheme` additionally files the rules in a
+:class:`SelectorIndex` by the rightmost compound of their selector, and
+while the engine computes the style of a widget, it only gets to see
+the rules filed under the widget's type names, classes and states. The
+engine still does the actual matching, so rules whose selector cannot
+be parsed here are merely filed as universal.
+
+This relies on the engine's Theme keeping its rules as a list in
+``_rules``, in cascade order, and computing the style of a single
+widget in ``getWidgetStyle``; see :meth:`IndexedTheme.supported`.
+"""
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from Engine.UI.Theme import Theme
+
+from Client.Selectors import Selector, SelectorIndex
+
+class IndexedTheme(Theme):
+    # widget attributes holding its style classes and states; if a
+    # widget lacks one, all rules keyed by one are candidates
+    classesAttribute = "StyleClasses"
+    statesAttribute = "States"
+
+    def __init__(self, **kwargs):
+        super(IndexedTheme, self).__init__(**kwargs)
+        self.index = SelectorIndex()
+        self._candidates = {}
+        self.widgets = 0
+        self.candidates = 0
+
+    @staticmethod
+    def supported():
+        return callable(getattr(Theme, "getWidgetStyle", None)) and \
+            isinstance(getattr(Theme(), "_rules", None), list)
+
+    @staticmethod
+    def _selector(entry):
+        if isinstance(entry, tuple):
+            # (selector, rule) pairs
+            entry = entry[0]
+        return getattr(entry, "selector", entry)
+
+    def add_rules(self, rules):
+        super(IndexedTheme, self).add_rules(rules)
+        # the entries may have been sorted, so index them all again
+        self.index = SelectorIndex()
+        for position, entry in enumerate(self._rules):
+            try:
+                selector = Selector(str(self._selector(entry)))
+            except ValueError:
+                selector = Selector("*")
+            self.index.add(selector, position)
+        self._candidates.clear()
+
+    def _widgetKey(self, widget):
+        types = tuple(cls.__name__ for cls in type(widget).__mro__)
+        classes = getattr(widget, self.classesAttribute, None)
+        states = getattr(widget, self.statesAttribute, None)
+        return (types,
+                None if classes is None else frozenset(classes),
+                None if states is None else frozenset(states))
+
+    def candidateRules(self, widget):
+        """
+        Return the entries of ``_rules`` which may match *widget*, in
+        their original order.
+        """
+        key = self._widgetKey(widget)
+        try:
+            return self._candidates[key]
+        except KeyError:
+            pass
+        positions = sorted(set(entry[3]
+                               for entry in self.index.candidatesFor(*key)))
+        rules = [self._rules[position] for position in positions]
+        self._candidates[key] = rules
+        return rules
+
+    def getWidgetStyle(self, widget):
+        rules = self._rules
+        self._rules = self.candidateRules(widget)
+        self.widgets += 1
+        self.candidates += len(self._rules)
+        try:
+            return super(IndexedTheme, self).getWidgetStyle(widget)
+        finally:
+            self._rules = rules
@@ -0,0 +1,173 @@
+# encoding=utf-8
+# File name: MemoryStats.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from OpenGL.GL import *
+
+import collections
+import gc
+
+try:
+    import tracemalloc
+except ImportError:
+    # needs Python 3.4 or a patched interpreter with pytracemalloc
+    tracemalloc = None
+
+def textureBytes(texture):
+    """
+    Estimate the GPU memory held by *texture*, assuming four bytes per
+    texel, over all its mipmap levels. This binds *texture*; unbinding
+    it is up to the caller.
+    """
+    texture.bind()
+    size = 0
+    level = 0
+    while True:
+        w = int(glGetTexLevelParameteriv(GL_TEXTURE_2D, level,
+            GL_TEXTURE_WIDTH))
+        h = int(glGetTexLevelParameteriv(GL_TEXTURE_2D, level,
+            GL_TEXTURE_HEIGHT))
+        if w == 0 or h == 0:
+            break
+        size += w * h * 4
+        if w == 1 and h == 1:
+            break
+        level += 1
+    return size
+
+def bufferBytes(bufferType):
+    """
+    Return the summed ``bufferBytes`` of the live instances of
+    *bufferType*, e.g. :class:`~Client.Mesh.GLMesh`, for use as a GPU
+    source of :class:`MemoryStats`.
+    """
+    return sum(obj.bufferBytes for obj in gc.get_objects()
+               if isinstance(obj, bufferType))
+
+class MemoryStats(object):
+    """
+    Periodic memory snapshots, taken every *interval* frames by
+    :meth:`frameEnd`.
+
+    Each snapshot records
+
+    * the growth since the previous snapshot: with :mod:`tracemalloc`
+      the *top* allocation sites by size difference, otherwise the
+      *top* Python types by instance count difference,
+    * the number of live instances of each class in *watchTypes* (a
+      dict mapping a label to a class), and
+    * an estimate of the GPU memory held by the live textures of
+      *textureType* (see :func:`textureBytes`), plus whatever the
+      callables in *gpuSources* report in bytes.
+
+    The last *keep* snapshots are kept in :attr:`snapshots`, keyed by
+    frame number.
+    """
+
+    def __init__(self, watchTypes, textureType=None, gpuSources=None,
+            interval=300, keep=32, top=10, **kwargs):
+        super(MemoryStats, self).__init__(**kwargs)
+        self.watchTypes = dict(watchTypes)
+        self.textureType = textureType
+        self.gpuSources = dict(gpuSources or {})
+        self.interval = interval
+        self.top = top
+        self.snapshots = collections.OrderedDict()
+        self.keep = keep
+        self._previous = None
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _typeCounts(self, objects):
+        counts = collections.Counter()
+        for obj in objects:
+            counts[type(obj).__name__] += 1
+        return counts
+
+    def _growth(self, objects):
+        if tracemalloc is not None:
+            current = tracemalloc.take_snapshot()
+            growth = []
+            if self._previous is not None:
+                for stat in current.compare_to(self._previous, "lineno")[:self.top]:
+                    frame = stat.traceback[0]
+                    growth.append({
+                        "site": "{0}:{1}".format(frame.filename, frame.lineno),
+                        "sizeDiff": stat.size_diff,
+                        "countDiff": stat.count_diff,
+                    })
+        else:
+            current = self._typeCounts(objects)
+            growth = []
+            if self._previous is not None:
+                diff = current.copy()
+                diff.subtract(self._previous)
+                for name, countDiff in diff.most_common(self.top):
+                    if countDiff <= 0:
+                        break
+                    growth.append({"type": name, "countDiff": countDiff})
+        self._previous = current
+        return growth
+
+    def _textureBytes(self, textures):
+        total = sum(textureBytes(texture) for texture in textures)
+        if textures:
+            self.textureType.unbind()
+        return total
+
+    def snapshot(self, frame):
+        objects = gc.get_objects()
+        live = dict(
+            (label, sum(1 for obj in objects if isinstance(obj, cls)))
+            for label, cls in self.watchTypes.items())
+        gpu = dict((label, source())
+                   for label, source in self.gpuSources.items())
+        if self.textureType is not None:
+            gpu["textures"] = self._textureBytes(
+                [obj for obj in objects if isinstance(obj, self.textureType)])
+        entry = {
+            "growth": self._growth(objects),
+            "live": live,
+            "gpuBytes": gpu,
+            "gpuBytesTotal": sum(gpu.values()),
+        }
+        self.snapshots[frame] = entry
+        while len(self.snapshots) > self.keep:
+            self.snapshots.popitem(last=False)
+        return entry
+
+    def frameEnd(self, frame):
+        if frame % self.interval == 0:
+            self.snapshot(frame)
+
+    def report(self):
+        return {
+            "tracemalloc": tracemalloc is not None,
+            "snapshots": dict(
+                (str(frame), entry)
+                for frame, entry in self.snapshots.items()),
+        }
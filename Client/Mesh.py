@@ -0,0 +1,388 @@
+# encoding=utf-8
+# File name: Mesh.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+"""
+Cooked binary meshes.
+
+A cooked mesh file (``.mesh``) holds indexed, interleaved vertex data
+ready to be handed to GL, so loading it is a matter of mapping the file
+instead of parsing OBJ and MTL text. All values are little endian:
+
+* a header (:data:`HEADER`) with magic, version, counts, the bounding
+  box of the whole mesh and the offsets of the vertex and index data,
+* the material table (:data:`MATERIAL`): name, diffuse RGBA and the
+  name of the diffuse texture (empty if none),
+* the submesh table (:data:`SUBMESH`): one range of indices drawn with
+  one material, with its own bounding box,
+* the vertices, each position, normal and texture coordinates as
+  float32 (:data:`VERTEX_STRIDE` bytes), 16 byte aligned, and
+* the indices as uint32, 16 byte aligned.
+
+:func:`cookOBJ` converts an OBJ file (as written by our Blender
+exporter) and its MTL libraries.
+"""
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from OpenGL.GL import *
+
+import ctypes
+import io
+import mmap
+import os
+import numpy as np
+
+MAGIC = b"PUMS"
+VERSION = 1
+
+HEADER = np.dtype([
+    (str("magic"), str("S4")),
+    (str("version"), str("<u4")),
+    (str("vertexCount"), str("<u4")),
+    (str("indexCount"), str("<u4")),
+    (str("materialCount"), str("<u4")),
+    (str("submeshCount"), str("<u4")),
+    (str("vertexOffset"), str("<u4")),
+    (str("indexOffset"), str("<u4")),
+    (str("bounds"), str("<f4"), (2, 3)),
+])
+
+MATERIAL = np.dtype([
+    (str("name"), str("S64")),
+    (str("diffuse"), str("<f4"), (4,)),
+    (str("texture"), str("S128")),
+])
+
+SUBMESH = np.dtype([
+    (str("material"), str("<u4")),
+    (str("firstIndex"), str("<u4")),
+    (str("indexCount"), str("<u4")),
+    (str("reserved"), str("<u4")),
+    (str("bounds"), str("<f4"), (2, 3)),
+])
+
+# position, normal, texture coordinates
+VERTEX_COMPONENTS = 8
+VERTEX_STRIDE = VERTEX_COMPONENTS * 4
+
+def _align(offset, alignment=16):
+    return (offset + alignment - 1) // alignment * alignment
+
+def _bounds(positions):
+    if not len(positions):
+        return np.zeros((2, 3), dtype=np.float32)
+    return np.array([positions.min(axis=0), positions.max(axis=0)],
+                    dtype=np.float32)
+
+def writeMesh(f, vertices, indices, materials, submeshes):
+    """
+    Write a cooked mesh to the binary file object *f*.
+
+    *vertices* is an ``(n, 8)`` float array, *indices* a uint array,
+    *materials* a list of ``(name, diffuse, texture)`` tuples and
+    *submeshes* a list of ``(material, firstIndex, indexCount)`` tuples.
+    """
+    vertices = np.ascontiguousarray(vertices, dtype="<f4").reshape(
+        -1, VERTEX_COMPONENTS)
+    indices = np.ascontiguousarray(indices, dtype="<u4")
+
+    materialTable = np.zeros(len(materials), dtype=MATERIAL)
+    for i, (name, diffuse, texture) in enumerate(materials):
+        materialTable[i] = (name.encode("utf-8"), diffuse,
+                            (texture or "").encode("utf-8"))
+    submeshTable = np.zeros(len(submeshes), dtype=SUBMESH)
+    for i, (material, first, count) in enumerate(submeshes):
+        used = vertices[indices[first:first+count], :3]
+        submeshTable[i] = (material, first, count, 0, _bounds(used))
+
+    vertexOffset = _align(HEADER.itemsize + materialTable.nbytes +
+                          submeshTable.nbytes)
+    indexOffset = _align(vertexOffset + vertices.nbytes)
+    header = np.zeros(1, dtype=HEADER)
+    header[0] = (MAGIC, VERSION, len(vertices), len(indices),
+                 len(materials), len(submeshes), vertexOffset,
+                 indexOffset, _bounds(vertices[:, :3]))
+
+    f.write(header.tobytes())
+    f.write(materialTable.tobytes())
+    f.write(submeshTable.tobytes())
+    f.write(b"\0" * (vertexOffset - f.tell()))
+    f.write(vertices.tobytes())
+    f.write(b"\0" * (indexOffset - f.tell()))
+    f.write(indices.tobytes())
+
+def parseMTL(f):
+    """
+    Return a dict mapping material names to ``(diffuse, texture)``.
+    """
+    materials = {}
+    current = None
+    for line in f:
+        parts = line.split()
+        if not parts or parts[0].startswith("#"):
+            continue
+        if parts[0] == "newmtl":
+            current = [[1., 1., 1., 1.], None]
+            materials[parts[1]] = current
+        elif current is None:
+            continue
+        elif parts[0] == "Kd":
+            current[0][:3] = [float(v) for v in parts[1:4]]
+        elif parts[0] == "d":
+            current[0][3] = float(parts[1])
+        elif parts[0] == "map_Kd":
+            current[1] = parts[-1]
+    return dict((name, tuple(value)) for name, value in materials.items())
+
+def parseOBJ(f, openMTL):
+    """
+    Parse the OBJ file *f* into the arguments of :func:`writeMesh`.
+    Polygons are triangulated as fans. *openMTL* is called with the
+    name of each material library and must return a text file object.
+    """
+    positions, texCoords, normals = [], [], []
+    vertexIndices = {}
+    vertices = []
+    library = {}
+    materials = []
+    materialIndices = {}
+    # material index -> list of indices
+    groups = {}
+    current = None
+
+    def materialIndex(name):
+        if name not in materialIndices:
+            diffuse, texture = library.get(name, ((1., 1., 1., 1.), None))
+            materialIndices[name] = len(materials)
+            materials.append((name, diffuse, texture))
+        return materialIndices[name]
+
+    def vertex(spec):
+        index = vertexIndices.get(spec)
+        if index is None:
+            refs = (spec.split("/") + ["", ""])[:3]
+            v = positions[int(refs[0]) - 1]
+            vt = texCoords[int(refs[1]) - 1] if refs[1] else (0., 0.)
+            vn = normals[int(refs[2]) - 1] if refs[2] else (0., 0., 0.)
+            index = vertexIndices[spec] = len(vertices)
+            vertices.append(v + vn + vt)
+        return index
+
+    for line in f:
+        parts = line.split()
+        if not parts or parts[0].startswith("#"):
+            continue
+        keyword = parts[0]
+        if keyword == "v":
+            positions.append(tuple(float(v) for v in parts[1:4]))
+        elif keyword == "vt":
+            texCoords.append(tuple(float(v) for v in parts[1:3]))
+        elif keyword == "vn":
+            normals.append(tuple(float(v) for v in parts[1:4]))
+        elif keyword == "mtllib":
+            for name in parts[1:]:
+                with openMTL(name) as mtl:
+                    library.update(parseMTL(mtl))
+        elif keyword == "usemtl":
+            current = materialIndex(parts[1])
+        elif keyword == "f":
+            if current is None:
+                current = materialIndex("default")
+            polygon = [vertex(spec) for spec in parts[1:]]
+            indices = groups.setdefault(current, [])
+            for i in range(1, len(polygon) - 1):
+                indices.extend((polygon[0], polygon[i], polygon[i+1]))
+
+    allIndices = []
+    submeshes = []
+    for material in sorted(groups):
+        submeshes.append((material, len(allIndices), len(groups[material])))
+        allIndices.extend(groups[material])
+    return (np.array(vertices, dtype=np.float32).reshape(-1, VERTEX_COMPONENTS),
+            np.array(allIndices, dtype=np.uint32), materials, submeshes)
+
+def cookOBJ(objPath, meshPath):
+    """
+    Convert the OBJ file at *objPath* into a cooked mesh at *meshPath*.
+    Material libraries are looked up next to the OBJ file.
+    """
+    directory = os.path.dirname(objPath)
+    openMTL = lambda name: io.open(os.path.join(directory, name),
+                                   encoding="utf-8")
+    with io.open(objPath, encoding="utf-8") as f:
+        parsed = parseOBJ(f, openMTL)
+    with open(meshPath, "wb") as f:
+        writeMesh(f, *parsed)
+
+
+class MeshFile(object):
+    """
+    A cooked mesh read from the binary file object *f*, e.g. opened
+    through the VFS, which is closed along with the mesh. Files on disk
+    are mapped into memory, files from pack mounts are used through
+    their buffer. :attr:`vertices`, :attr:`indices`, :attr:`materials`
+    and :attr:`submeshes` are numpy views of that; nothing is copied.
+    """
+
+    def __init__(self, f, **kwargs):
+        super(MeshFile, self).__init__(**kwargs)
+        self.name = getattr(f, "name", None)
+        self._file = f
+        self._map = None
+        if hasattr(f, "getbuffer"):
+            self._data = f.getbuffer()
+        else:
+            try:
+                fileno = f.fileno()
+            except (AttributeError, IOError, io.UnsupportedOperation):
+                self._data = f.read()
+            else:
+                self._map = self._data = mmap.mmap(
+                    fileno, 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self._data, dtype=HEADER, count=1)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            raise ValueError("{0} is not a cooked mesh of version {1}".format(
+                self.name, VERSION))
+        # a copy, the header must not keep the data alive
+        self.bounds = np.array(header["bounds"])
+        offset = HEADER.itemsize
+        self.materials = np.frombuffer(self._data, dtype=MATERIAL,
+            count=int(header["materialCount"]), offset=offset)
+        offset += self.materials.nbytes
+        self.submeshes = np.frombuffer(self._data, dtype=SUBMESH,
+            count=int(header["submeshCount"]), offset=offset)
+        self.vertices = np.frombuffer(self._data, dtype="<f4",
+            count=int(header["vertexCount"]) * VERTEX_COMPONENTS,
+            offset=int(header["vertexOffset"])).reshape(
+                -1, VERTEX_COMPONENTS)
+        self.indices = np.frombuffer(self._data, dtype="<u4",
+            count=int(header["indexCount"]),
+            offset=int(header["indexOffset"]))
+        del header
+
+    def detach(self):
+        """
+        Copy the contents into memory and close the file. Afterwards all
+        data has been read, which makes this the part of loading to do
+        on a worker thread. Return the mesh.
+        """
+        self.vertices = np.array(self.vertices)
+        self.indices = np.array(self.indices)
+        self.materials = np.array(self.materials)
+        self.submeshes = np.array(self.submeshes)
+        self._closeFile()
+        return self
+
+    def _closeFile(self):
+        self._data = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        self.vertices = self.indices = None
+        self.materials = self.submeshes = None
+        self._closeFile()
+
+
+class GLMesh(object):
+    """
+    Uploads a :class:`MeshFile` into vertex and index buffer objects
+    and draws it with the fixed function pipeline. Textures named by
+    the materials are obtained from *loadTexture*, which returns a
+    texture, None, or a callable returning the texture to use for now,
+    such as the ``get`` method of a :class:`ResourceHandle`.
+    """
+
+    def __init__(self, mesh, loadTexture, **kwargs):
+        super(GLMesh, self).__init__(**kwargs)
+        self.bounds = np.array(mesh.bounds)
+        self._vbo, self._ibo = glGenBuffers(2)
+        glBindBuffer(GL_ARRAY_BUFFER, self._vbo)
+        glBufferData(GL_ARRAY_BUFFER, mesh.vertices.nbytes, mesh.vertices,
+                     GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._ibo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, mesh.indices.nbytes,
+                     mesh.indices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        # for memory accounting, see ResourceCache
+        self.bufferBytes = mesh.vertices.nbytes + mesh.indices.nbytes
+        self._materials = []
+        for material in mesh.materials:
+            texture = material["texture"].decode("utf-8")
+            self._materials.append((
+                tuple(float(v) for v in material["diffuse"]),
+                loadTexture(texture) if texture else None))
+        self._submeshes = [
+            (int(sub["material"]), int(sub["firstIndex"]),
+             int(sub["indexCount"]))
+            for sub in mesh.submeshes]
+
+    def draw(self):
+        glBindBuffer(GL_ARRAY_BUFFER, self._vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._ibo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(12))
+        glTexCoordPointer(2, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(24))
+        for material, first, count in self._submeshes:
+            diffuse, texture = self._materials[material]
+            glColor4f(*diffuse)
+            if callable(texture):
+                texture = texture()
+            if texture is not None:
+                texture.bind()
+            else:
+                glBindTexture(GL_TEXTURE_2D, 0)
+            glDrawElements(GL_TRIANGLES, count, GL_UNSIGNED_INT,
+                           ctypes.c_void_p(first * 4))
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glColor4f(1., 1., 1., 1.)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def delete(self):
+        glDeleteBuffers(2, [self._vbo, self._ibo])
+        self._vbo = self._ibo = None
+        self.bufferBytes = 0
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Convert an OBJ model into a cooked mesh.")
+    parser.add_argument("obj")
+    parser.add_argument("mesh")
+    args = parser.parse_args()
+    cookOBJ(args.obj, args.mesh)
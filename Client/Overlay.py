@@ -0,0 +1,514 @@
+# encoding=utf-8
+# File name: Overlay.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import Engine.CEngine.GL as CGL
+from Engine.CEngine.Log import server as log, Severity
+from Engine.GL.Texture import Texture2D
+
+from OpenGL.GL import *
+from OpenGL.GL.ARB.pixel_buffer_object import glInitPixelBufferObjectARB
+from OpenGL.GL.ARB.texture_non_power_of_two import \
+    glInitTextureNonPowerOfTwoARB
+import ctypes
+import math
+import threading
+import traceback
+import numpy as np
+
+class DamageRegion(object):
+    """
+    A set of non-overlapping (x, y, w, h) rectangles in surface
+    coordinates which need to be redrawn.
+
+    Overlapping rectangles are merged into their bounding box on
+    insertion. If more than *maxRects* rectangles accumulate, the whole
+    region collapses into its bounding box, as many tiny uploads are
+    slower than one slightly larger one.
+    """
+
+    def __init__(self, width=0, height=0, maxRects=16, **kwargs):
+        super(DamageRegion, self).__init__(**kwargs)
+        self.width = width
+        self.height = height
+        self.maxRects = maxRects
+        self.rects = []
+
+    def __bool__(self):
+        return bool(self.rects)
+    __nonzero__ = __bool__
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.addAll()
+
+    def clear(self):
+        self.rects = []
+
+    def addAll(self):
+        if self.width > 0 and self.height > 0:
+            self.rects = [(0, 0, self.width, self.height)]
+        else:
+            self.rects = []
+
+    def add(self, x, y, w, h):
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1 = min(int(math.ceil(x + w)), self.width)
+        y1 = min(int(math.ceil(y + h)), self.height)
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        merged = True
+        while merged:
+            merged = False
+            for i, (rx, ry, rw, rh) in enumerate(self.rects):
+                if rx < x1 and x0 < rx + rw and ry < y1 and y0 < ry + rh:
+                    x0, y0 = min(x0, rx), min(y0, ry)
+                    x1, y1 = max(x1, rx + rw), max(y1, ry + rh)
+                    del self.rects[i]
+                    merged = True
+                    break
+        self.rects.append((x0, y0, x1 - x0, y1 - y0))
+
+        if len(self.rects) > self.maxRects:
+            self.rects = [self.bounds()]
+
+    def bounds(self):
+        if not self.rects:
+            return None
+        x0 = min(x for x, _, _, _ in self.rects)
+        y0 = min(y for _, y, _, _ in self.rects)
+        x1 = max(x + w for x, _, w, _ in self.rects)
+        y1 = max(y + h for _, y, _, h in self.rects)
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def area(self):
+        return sum(w * h for _, _, w, h in self.rects)
+
+
+class WidgetDamage(object):
+    """
+    Turns input into overlay damage: *states* maps the names of
+    interaction states (e.g. ``"hover"`` or ``"focus"``) to functions
+    returning the widget currently in that state, or None.
+
+    Take a :meth:`snapshot` before an input event is handled and pass
+    it to :meth:`damage` afterwards, which adds the AbsoluteRect of
+    every widget which entered or left a state or moved to *region*,
+    both before and after the event.
+    """
+
+    def __init__(self, region, states, **kwargs):
+        super(WidgetDamage, self).__init__(**kwargs)
+        self.region = region
+        self.states = states
+
+    @staticmethod
+    def _rect(widget):
+        if widget is None:
+            return None
+        return tuple(widget.AbsoluteRect.XYWH)
+
+    def snapshot(self):
+        snapshot = {}
+        for name, get in self.states.items():
+            widget = get()
+            snapshot[name] = (widget, self._rect(widget))
+        return snapshot
+
+    def damage(self, before, touched=()):
+        """
+        Add the damage of the widgets whose state changed since
+        *before*. The widgets in the *touched* states are damaged even
+        if unchanged, e.g. the focused one on key input.
+        """
+        for name, get in self.states.items():
+            oldWidget, oldRect = before[name]
+            widget = get()
+            rect = self._rect(widget)
+            if widget is oldWidget and rect == oldRect and \
+                    name not in touched:
+                continue
+            for damaged in (oldRect, rect):
+                if damaged is not None:
+                    self.region.add(*damaged)
+
+
+def uploadSurfaceRect(surface, x, y, w, h, dstX=None, dstY=None):
+    """
+    Upload the (*x*, *y*, *w*, *h*) part of the cairo ARGB32 *surface*
+    into the currently bound GL_TEXTURE_2D at (*dstX*, *dstY*), which
+    default to (*x*, *y*). Returns the number of bytes transferred.
+    """
+    if dstX is None:
+        dstX, dstY = x, y
+    surface.flush()
+    stride = surface.get_stride()
+    data = np.frombuffer(surface.get_data(), dtype=np.uint8)
+    glPixelStorei(GL_UNPACK_ROW_LENGTH, stride // 4)
+    glPixelStorei(GL_UNPACK_SKIP_PIXELS, x)
+    glPixelStorei(GL_UNPACK_SKIP_ROWS, y)
+    glTexSubImage2D(GL_TEXTURE_2D, 0, dstX, dstY, w, h,
+        GL_BGRA, GL_UNSIGNED_INT_8_8_8_8_REV, data)
+    glPixelStorei(GL_UNPACK_SKIP_ROWS, 0)
+    glPixelStorei(GL_UNPACK_SKIP_PIXELS, 0)
+    glPixelStorei(GL_UNPACK_ROW_LENGTH, 0)
+    return w * h * 4
+
+
+class SyncOverlayUploader(object):
+    """
+    Uploads the overlay surface synchronously into the currently bound
+    texture.
+    """
+
+    def reset(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def bufferBytes(self):
+        return 0
+
+    def upload(self, surface, rects=None):
+        """
+        Upload *rects* of *surface*, or all of it if *rects* is None.
+        Returns the number of bytes transferred.
+        """
+        w, h = surface.get_width(), surface.get_height()
+        if rects is None or rects == [(0, 0, w, h)]:
+            CGL.glTexCairoSurfaceSubImage2D(GL_TEXTURE_2D, 0, 0, 0, surface)
+            return w * h * 4
+        return sum(uploadSurfaceRect(surface, *rect) for rect in rects)
+
+
+class PBOOverlayUploader(object):
+    """
+    Streams the overlay surface through a ring of pixel unpack buffers.
+
+    Data passed to :meth:`upload` is only copied into a buffer object;
+    the texture is updated from that buffer at the next :meth:`upload`
+    or :meth:`flush`, i.e. one frame later, which gives the driver the
+    time to do the transfer asynchronously instead of stalling the
+    frame.
+    """
+
+    def __init__(self, bufferCount=2, **kwargs):
+        super(PBOOverlayUploader, self).__init__(**kwargs)
+        self._buffers = [glGenBuffers(1) for i in range(bufferCount)]
+        self._sizes = [0] * bufferCount
+        self._index = 0
+        self._staged = None
+
+    def reset(self):
+        self._staged = None
+
+    def bufferBytes(self):
+        return sum(self._sizes)
+
+    def flush(self):
+        """
+        Transfer the data staged by the previous :meth:`upload` into the
+        currently bound texture.
+        """
+        if self._staged is None:
+            return
+        buffer, stride, y0, rects = self._staged
+        self._staged = None
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, buffer)
+        glPixelStorei(GL_UNPACK_ROW_LENGTH, stride // 4)
+        for x, y, w, h in rects:
+            glPixelStorei(GL_UNPACK_SKIP_PIXELS, x)
+            glPixelStorei(GL_UNPACK_SKIP_ROWS, y - y0)
+            glTexSubImage2D(GL_TEXTURE_2D, 0, x, y, w, h,
+                GL_BGRA, GL_UNSIGNED_INT_8_8_8_8_REV, None)
+        glPixelStorei(GL_UNPACK_SKIP_ROWS, 0)
+        glPixelStorei(GL_UNPACK_SKIP_PIXELS, 0)
+        glPixelStorei(GL_UNPACK_ROW_LENGTH, 0)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def upload(self, surface, rects=None):
+        self.flush()
+        if rects is None:
+            rects = [(0, 0, surface.get_width(), surface.get_height())]
+        if not rects:
+            return 0
+
+        # stage all rows touched by any rect in one go; that is a single
+        # memmove and the rects pick their part via GL_UNPACK_SKIP_*
+        y0 = min(y for _, y, _, _ in rects)
+        y1 = max(y + h for _, y, _, h in rects)
+        surface.flush()
+        stride = surface.get_stride()
+        data = np.frombuffer(surface.get_data(), dtype=np.uint8)
+        size = (y1 - y0) * stride
+
+        buffer = self._buffers[self._index]
+        self._sizes[self._index] = size
+        self._index = (self._index + 1) % len(self._buffers)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, buffer)
+        # orphan the previous storage so mapping does not wait for the
+        # transfer still reading from it
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, size, None, GL_STREAM_DRAW)
+        ptr = glMapBuffer(GL_PIXEL_UNPACK_BUFFER, GL_WRITE_ONLY)
+        ctypes.memmove(ptr, data.ctypes.data + y0 * stride, size)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
+        self._staged = (buffer, stride, y0, rects)
+        return sum(w * h * 4 for _, _, w, h in rects)
+
+
+def createOverlayUploader(mode):
+    """
+    Create an overlay uploader for *mode*, which is either ``"sync"``
+    or ``"pbo"``. If pixel buffer objects are not supported by the
+    context, the synchronous uploader is returned instead.
+    """
+    if mode == "pbo":
+        if glInitPixelBufferObjectARB():
+            return PBOOverlayUploader()
+        log.log(Severity.Warning, "Pixel buffer objects not supported, falling back to synchronous overlay upload")
+    elif mode != "sync":
+        raise ValueError("Unknown overlay upload mode: {0}".format(mode))
+    return SyncOverlayUploader()
+
+
+class OverlayRenderThread(threading.Thread):
+    """
+    Worker thread which calls *renderFunc* whenever :meth:`kick` is
+    called. Cairo drops the GIL while rasterizing, so this runs in
+    parallel to the GL work done by the main thread.
+
+    The caller is responsible for not touching the widget tree between
+    :meth:`kick` and the matching :meth:`wait`.
+    """
+
+    def __init__(self, renderFunc, **kwargs):
+        super(OverlayRenderThread, self).__init__(
+            name="OverlayRenderThread", **kwargs)
+        self.daemon = True
+        self._renderFunc = renderFunc
+        self._request = threading.Event()
+        self._done = threading.Event()
+        self._done.set()
+        self._error = None
+
+    def run(self):
+        while True:
+            self._request.wait()
+            self._request.clear()
+            try:
+                self._renderFunc()
+            except Exception as err:
+                log.log(Severity.Error, "Overlay rendering failed:\n" + traceback.format_exc())
+                self._error = err
+            self._done.set()
+
+    def kick(self):
+        self.wait()
+        self._done.clear()
+        self._request.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+
+
+class TiledOverlay(object):
+    """
+    GL side of the overlay split into square textures of *tileSize*
+    pixels. The overlay is still rasterized into a single cairo surface
+    (the widget tree renders through one context), but dirty regions
+    are snapped to the tile grid and only dirty tiles are uploaded.
+    This also avoids a single texture with the size of the whole
+    screen, which may exceed GL_MAX_TEXTURE_SIZE on multi-head setups.
+    """
+
+    def __init__(self, width, height, tileSize=256, recycle=None,
+            **kwargs):
+        super(TiledOverlay, self).__init__(**kwargs)
+        self.width = width
+        self.height = height
+        self.tileSize = tileSize
+        self.columns = (width + tileSize - 1) // tileSize
+        self.rows = (height + tileSize - 1) // tileSize
+        # tile textures of a previous grid can be reused as they are
+        self.tiles = list(recycle.tiles) if recycle is not None else []
+        count = self.columns * self.rows
+        del self.tiles[count:]
+        while len(self.tiles) < count:
+            self.tiles.append(Texture2D(tileSize, tileSize, format=GL_RGBA,
+                data=(GL_RGBA, GL_UNSIGNED_BYTE, None)))
+        self.dirty = set(range(len(self.tiles)))
+
+    def tileRect(self, index):
+        size = self.tileSize
+        x = (index % self.columns) * size
+        y = (index // self.columns) * size
+        return (x, y, min(size, self.width - x), min(size, self.height - y))
+
+    def markAll(self):
+        self.dirty.update(range(len(self.tiles)))
+
+    def markDirty(self, x, y, w, h):
+        size = self.tileSize
+        col0, row0 = max(x // size, 0), max(y // size, 0)
+        col1 = min((x + w - 1) // size, self.columns - 1)
+        row1 = min((y + h - 1) // size, self.rows - 1)
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                self.dirty.add(row * self.columns + col)
+
+    def dirtyRects(self):
+        return [self.tileRect(index) for index in sorted(self.dirty)]
+
+    def upload(self, surface):
+        """
+        Upload all dirty tiles from *surface* and mark them clean.
+        Returns the number of bytes transferred.
+        """
+        uploaded = 0
+        for index in sorted(self.dirty):
+            x, y, w, h = self.tileRect(index)
+            self.tiles[index].bind()
+            uploaded += uploadSurfaceRect(surface, x, y, w, h, 0, 0)
+        self.dirty.clear()
+        return uploaded
+
+    def draw(self):
+        size = self.tileSize
+        for index, tile in enumerate(self.tiles):
+            x, y, w, h = self.tileRect(index)
+            s, t = w / size, h / size
+            tile.bind()
+            glBegin(GL_QUADS)
+            glTexCoord2f(0, 0)
+            glVertex2f(x, y)
+            glTexCoord2f(0, t)
+            glVertex2f(x, y + h)
+            glTexCoord2f(s, t)
+            glVertex2f(x + w, y + h)
+            glTexCoord2f(s, 0)
+            glVertex2f(x + w, y)
+            glEnd()
+
+    def textureBytes(self):
+        return len(self.tiles) * self.tileSize * self.tileSize * 4
+
+
+class OverlayPool(object):
+    """
+    Keeps overlay textures and cairo surfaces across resizes.
+
+    Objects are requested with :meth:`acquire` for a minimum size and
+    are created with some headroom (*growth*), so that interactively
+    enlarging the window does not allocate on every step. Objects which
+    are given back with :meth:`release` are kept for *releaseDelay*
+    calls of :meth:`collect` (i.e. frames) and are handed out again if
+    they cover a later request without wasting more than
+    *shrinkFactor* times the requested area.
+
+    The number of allocations, reuses and releases per kind is kept in
+    :attr:`counters`.
+    """
+
+    def __init__(self, growth=1.25, granularity=64, shrinkFactor=4,
+            releaseDelay=120, **kwargs):
+        super(OverlayPool, self).__init__(**kwargs)
+        self.growth = growth
+        self.granularity = granularity
+        self.shrinkFactor = shrinkFactor
+        self.releaseDelay = releaseDelay
+        self.counters = {}
+        self._frame = 0
+        self._free = []
+
+    def _count(self, kind, event):
+        key = kind + event
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+    def _fits(self, capW, capH, w, h):
+        return (capW >= w and capH >= h and
+                capW * capH <= self.shrinkFactor * max(w * h, 1))
+
+    def grow(self, n, growth=None):
+        step = self.granularity
+        if growth is None:
+            growth = self.growth
+        return int(math.ceil(n * growth / step)) * step
+
+    def acquire(self, kind, w, h, create, growth=None):
+        """
+        Return a ``(obj, capW, capH)`` tuple of the given *kind* with a
+        capacity of at least *w* x *h*. If no released object fits,
+        ``create(capW, capH)`` is called with the grown size and must
+        return such a tuple itself. *growth* overrides the headroom
+        factor for this request.
+        """
+        for i, (entryKind, obj, capW, capH, _) in enumerate(self._free):
+            if entryKind == kind and self._fits(capW, capH, w, h):
+                del self._free[i]
+                self._count(kind, "Reuses")
+                return obj, capW, capH
+        self._count(kind, "Allocations")
+        return create(self.grow(w, growth), self.grow(h, growth))
+
+    def release(self, kind, obj, capW, capH):
+        self._free.append(
+            (kind, obj, capW, capH, self._frame + self.releaseDelay))
+
+    def collect(self):
+        """
+        Advance the frame counter and drop released objects whose grace
+        period has passed.
+        """
+        self._frame += 1
+        if not self._free:
+            return
+        keep = []
+        for entry in self._free:
+            if entry[4] > self._frame:
+                keep.append(entry)
+            else:
+                self._count(entry[0], "Releases")
+        self._free = keep
+
+
+def npotTexturesSupported():
+    """
+    Whether the context can create 2D textures of arbitrary size, which
+    is core since OpenGL 2.0.
+    """
+    version = glGetString(GL_VERSION).split(b" ")[0].split(b".")
+    if (int(version[0]), int(version[1])) >= (2, 0):
+        return True
+    return bool(glInitTextureNonPowerOfTwoARB())
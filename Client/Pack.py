@@ -0,0 +1,407 @@
+# encoding=utf-8
+# File name: Pack.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+"""
+Pack archives: many files in one, for mounting into the VFS with
+:class:`MountPack` instead of a directory.
+
+Layout, all integers little endian:
+
+* header (:data:`HEADER`): magic, version, entry count and the offset
+  of the index,
+* the entry data, each entry stored as is or zlib compressed,
+* the index: one :data:`ENTRY` record per entry, sorted by path,
+  followed by the UTF-8 encoded paths.
+
+Paths are absolute within the archive, e.g. ``/shaders/ui.shader``.
+"""
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import bisect
+import io
+import mmap
+import os
+import struct
+import time
+import zlib
+
+MAGIC = b"PUPK"
+VERSION = 1
+# magic, version, entry count, index offset
+HEADER = struct.Struct(b"<4sIIQ")
+# path offset, path length, data offset, stored size, size, compression
+ENTRY = struct.Struct(b"<IIQQQI")
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+# formats which are compressed already
+INCOMPRESSIBLE = frozenset([".png", ".jpg", ".jpeg", ".ogg", ".gz"])
+
+try:
+    # Python 2: mmap only has the old style buffer interface
+    _view = buffer
+except NameError:
+    def _view(obj, offset, size):
+        return memoryview(obj)[offset:offset+size]
+
+def _normpath(path):
+    if path.startswith("/") and "//" not in path and \
+            not path.endswith("/"):
+        return path
+    return "/" + "/".join(part for part in path.split("/") if part)
+
+def writePack(filename, files, compress=True, minSaving=0.1):
+    """
+    Write the archive *filename* containing *files*, a dict mapping
+    archive paths to file system paths. Entries are compressed if
+    *compress* is set and that saves at least *minSaving* of their size.
+    """
+    entries = []
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        for path, source in sorted(
+                (_normpath(path), source) for path, source in files.items()):
+            with open(source, "rb") as src:
+                data = src.read()
+            stored, compression = data, COMPRESSION_NONE
+            if compress and \
+                    os.path.splitext(path)[1].lower() not in INCOMPRESSIBLE:
+                packed = zlib.compress(data, 9)
+                if len(packed) <= len(data) * (1 - minSaving):
+                    stored, compression = packed, COMPRESSION_ZLIB
+            entries.append((path, f.tell(), len(stored), len(data),
+                            compression))
+            f.write(stored)
+
+        indexOffset = f.tell()
+        names = b""
+        records = []
+        for path, offset, storedSize, size, compression in entries:
+            name = path.encode("utf-8")
+            records.append(ENTRY.pack(len(names), len(name), offset,
+                                      storedSize, size, compression))
+            names += name
+        f.write(b"".join(records))
+        f.write(names)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries), indexOffset))
+
+def packDirectory(filename, directory, compress=True):
+    """
+    Write the contents of *directory* into the archive *filename*.
+    """
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for name in filenames:
+            source = os.path.join(dirpath, name)
+            path = os.path.relpath(source, directory).replace(os.sep, "/")
+            files[path] = source
+    writePack(filename, files, compress=compress)
+
+
+class PackFile(object):
+    """
+    A pack archive mapped into memory. The index is read once on
+    opening. Exact lookups go through a dict, directory listings are
+    binary searches over the sorted paths.
+    """
+
+    def __init__(self, filename, **kwargs):
+        super(PackFile, self).__init__(**kwargs)
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, indexOffset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{0} is not a pack of version {1}".format(
+                filename, VERSION))
+        namesOffset = indexOffset + count * ENTRY.size
+        self._paths = []
+        self._entries = []
+        for i in range(count):
+            (nameOffset, nameLength, offset, storedSize, size,
+             compression) = ENTRY.unpack_from(
+                self._map, indexOffset + i * ENTRY.size)
+            start = namesOffset + nameOffset
+            self._paths.append(
+                self._map[start:start+nameLength].decode("utf-8"))
+            self._entries.append((offset, storedSize, size, compression))
+        self._index = dict((path, i) for i, path in enumerate(self._paths))
+
+    def _find(self, path):
+        return self._index.get(path)
+
+    def __contains__(self, path):
+        return self._find(_normpath(path)) is not None
+
+    def __len__(self):
+        return len(self._paths)
+
+    def isdir(self, path):
+        prefix = _normpath(path).rstrip("/") + "/"
+        i = bisect.bisect_left(self._paths, prefix)
+        return i < len(self._paths) and self._paths[i].startswith(prefix)
+
+    def listdir(self, path):
+        """
+        Return the names of the files and directories directly below
+        *path*.
+        """
+        prefix = _normpath(path).rstrip("/") + "/"
+        names = []
+        i = bisect.bisect_left(self._paths, prefix)
+        while i < len(self._paths) and self._paths[i].startswith(prefix):
+            name = self._paths[i][len(prefix):].split("/", 1)[0]
+            if not names or names[-1] != name:
+                names.append(name)
+            i += 1
+        return names
+
+    def size(self, path):
+        i = self._find(_normpath(path))
+        if i is None:
+            raise IOError("No such file in {0}: {1}".format(
+                self.filename, path))
+        return self._entries[i][2]
+
+    def read(self, path):
+        """
+        Return the contents of *path*. Uncompressed entries are returned
+        as a buffer into the mapping instead of being copied.
+        """
+        i = self._find(_normpath(path))
+        if i is None:
+            raise IOError("No such file in {0}: {1}".format(
+                self.filename, path))
+        offset, storedSize, size, compression = self._entries[i]
+        if compression == COMPRESSION_ZLIB:
+            return zlib.decompress(self._map[offset:offset+storedSize])
+        return _view(self._map, offset, size)
+
+    def close(self):
+        self._map.close()
+
+
+class PackEntryFile(object):
+    """
+    Read-only binary file object over the contents of a pack entry, as
+    returned by :meth:`MountPack.open`. For uncompressed entries it reads
+    from the mapping of the pack; :meth:`getbuffer` returns the whole
+    entry without copying it, like ``BytesIO.getbuffer``.
+    """
+
+    def __init__(self, data, name):
+        self._data = data
+        self._pos = 0
+        self.name = name
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def seekable(self):
+        return True
+
+    def getbuffer(self):
+        return self._data
+
+    def read(self, size=-1):
+        end = len(self._data)
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        data = bytes(self._data[self._pos:end])
+        self._pos = max(self._pos, end)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._data)
+        if offset < 0:
+            raise IOError("Negative seek position {0}".format(offset))
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        # views into the mapping keep the pack from being closed
+        release = getattr(self._data, "release", None)
+        if release is not None:
+            try:
+                release()
+            except BufferError:
+                # still in use, e.g. by arrays from getbuffer()
+                pass
+        self._data = b""
+        self.closed = True
+
+
+class MountPack(object):
+    """
+    Read-only VFS mount of a pack archive, used like
+    ``MountDirectory``::
+
+        vfs.mount('/data', MountPack("data.pack"), MountPriority.FileSystem)
+    """
+
+    def __init__(self, filename, **kwargs):
+        super(MountPack, self).__init__(**kwargs)
+        self.pack = PackFile(filename)
+
+    def fileReadable(self, path):
+        return path in self.pack
+
+    def fileWritable(self, path):
+        return False
+
+    def listdir(self, path):
+        return self.pack.listdir(path)
+
+    def open(self, path, flag='r'):
+        if flag not in ('r', 'rb'):
+            raise IOError("Pack mounts are read-only")
+        return PackEntryFile(self.pack.read(path), path)
+
+    def __repr__(self):
+        return "<MountPack {0!r}>".format(self.pack.filename)
+
+
+def benchmarkLookups(fileCount=5000, fileSize=512, repeat=3,
+        compress=True):
+    """
+    Compare opening and reading *fileCount* small files from a
+    directory with reading them from a pack of the same files. The
+    first pass (cold) includes opening the pack; later passes are warm.
+    Return a dict of timings in seconds.
+    """
+    import random
+    import shutil
+    import tempfile
+
+    base = tempfile.mkdtemp(prefix="pyuniverse-pack-")
+    try:
+        directory = os.path.join(base, "data")
+        rng = random.Random(0)
+        names = []
+        for i in range(fileCount):
+            name = "dir{0:02d}/file{1:05d}.txt".format(i % 50, i)
+            path = os.path.join(directory, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(b"".join(
+                    struct.pack(b"<B", rng.randrange(32, 96))
+                    for j in range(fileSize)))
+            names.append(name)
+        packName = os.path.join(base, "data.pack")
+        start = time.time()
+        packDirectory(packName, directory, compress=compress)
+        packTime = time.time() - start
+
+        lookups = list(names)
+        rng.shuffle(lookups)
+        result = {"files": fileCount, "compressed": compress,
+                  "packTime": packTime,
+                  "directory": [], "pack": [], "packZeroCopy": []}
+        for i in range(repeat):
+            start = time.time()
+            for name in lookups:
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        f.read()
+            result["directory"].append(time.time() - start)
+
+        # through the VFS interface: reading copies, like files do, while
+        # getbuffer() hands out the mapping
+        mount = None
+        for i in range(repeat):
+            start = time.time()
+            if mount is None:
+                mount = MountPack(packName)
+            for name in lookups:
+                if mount.fileReadable(name):
+                    with mount.open(name) as f:
+                        f.read()
+            result["pack"].append(time.time() - start)
+        for i in range(repeat):
+            start = time.time()
+            for name in lookups:
+                if mount.fileReadable(name):
+                    with mount.open(name) as f:
+                        f.getbuffer()
+            result["packZeroCopy"].append(time.time() - start)
+        mount.pack.close()
+        return result
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+    parser = argparse.ArgumentParser(
+        description="Create pack archives or benchmark them.")
+    subparsers = parser.add_subparsers(dest="command")
+    create = subparsers.add_parser("create",
+        help="Pack the contents of a directory.")
+    create.add_argument("directory")
+    create.add_argument("pack")
+    create.add_argument("--no-compression", dest="compress",
+        action="store_false")
+    bench = subparsers.add_parser("bench",
+        help="Compare lookups in a directory and in a pack.")
+    bench.add_argument("--files", type=int, default=5000)
+    bench.add_argument("--repeat", type=int, default=3)
+    bench.add_argument("--no-compression", dest="compress",
+        action="store_false")
+    args = parser.parse_args()
+    if args.command == "create":
+        packDirectory(args.pack, args.directory, compress=args.compress)
+    else:
+        json.dump(benchmarkLookups(args.files, repeat=args.repeat,
+                                   compress=args.compress),
+                  sys.stdout, indent=2, sort_keys=True)
+        print()
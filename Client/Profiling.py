@@ -0,0 +1,247 @@
+# encoding=utf-8
+# File name: Profiling.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from Engine.CEngine.Log import server as log, Severity
+
+import cProfile
+import collections
+import io
+import os
+import sys
+import threading
+import time
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler which samples the Python stack of one thread
+    (by default the one creating the profiler) every *interval* seconds
+    from a background thread.
+
+    Unlike cProfile, the profiled code runs at full speed; the cost is
+    one stack walk per sample, paid by the sampling thread while it
+    holds the GIL. At the default 200 Hz that is a few percent at most.
+
+    Samples are kept as a counter of stacks, which can be written in the
+    collapsed format understood by flamegraph.pl and similar tools.
+    """
+
+    def __init__(self, interval=0.005, threadId=None, **kwargs):
+        super(SamplingProfiler, self).__init__(**kwargs)
+        self.interval = interval
+        self.threadId = threadId if threadId is not None else \
+            threading.current_thread().ident
+        self.stacks = collections.Counter()
+        self.sampleCount = 0
+        self._thread = None
+        self._stopEvent = threading.Event()
+
+    @staticmethod
+    def _frameName(frame):
+        code = frame.f_code
+        return "{0} ({1}:{2})".format(
+            code.co_name, os.path.basename(code.co_filename),
+            code.co_firstlineno)
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.threadId)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(self._frameName(frame))
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks[tuple(stack)] += 1
+        self.sampleCount += 1
+
+    def _run(self):
+        wait = self._stopEvent.wait
+        interval = self.interval
+        while not wait(interval):
+            self._sample()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopEvent.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="SamplingProfiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopEvent.set()
+        self._thread.join()
+        self._thread = None
+
+    def clear(self):
+        self.stacks.clear()
+        self.sampleCount = 0
+
+    def collapsed(self):
+        """
+        Return the samples as lines of ``frame;frame;frame count``,
+        outermost frame first.
+        """
+        return "".join(
+            "{0} {1}\n".format(";".join(stack), count)
+            for stack, count in sorted(self.stacks.items()))
+
+    def writeCollapsed(self, filename):
+        with io.open(filename, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+
+    def topFunctions(self, n=10):
+        """
+        Return the *n* frames which were on top of the stack most often
+        as ``(name, samples)`` list, i.e. the functions with the most
+        self time.
+        """
+        counts = collections.Counter()
+        for stack, count in self.stacks.items():
+            if stack:
+                counts[stack[-1]] += count
+        return counts.most_common(n)
+
+
+class FrameWindowProfiler(object):
+    """
+    Profiles windows of frames instead of the whole run, so resource
+    loading and shader compilation do not end up in the steady-state
+    numbers.
+
+    A window is opened and closed
+
+    * by :meth:`toggle` (bound to a hotkey by the application),
+    * for each ``(start, end)`` frame range in *ranges*, covering frames
+      start up to but excluding end, or
+    * automatically when a frame took longer than *budget* seconds, in
+      which case the following *budgetFrames* frames are captured.
+
+    *kind* is either ``"cprofile"`` or ``"sampling"``. Each window is
+    written to its own file, named after *prefix* and the frame numbers
+    it covers, as pstats or collapsed stacks respectively. The file
+    names are collected in :attr:`written`.
+
+    :meth:`frameEnd` has to be called after every frame.
+    """
+
+    def __init__(self, prefix, kind="cprofile", ranges=(), budget=None,
+            budgetFrames=60, sampleInterval=0.005, **kwargs):
+        super(FrameWindowProfiler, self).__init__(**kwargs)
+        if kind not in ("cprofile", "sampling"):
+            raise ValueError("Unknown profiler kind: {0}".format(kind))
+        self.prefix = prefix
+        self.kind = kind
+        self.ranges = sorted(ranges)
+        self.budget = budget
+        self.budgetFrames = budgetFrames
+        self.sampleInterval = sampleInterval
+        self.written = []
+        self._profiler = None
+        self._startFrame = None
+        self._stopFrame = None
+        self._frame = 0
+        self._lastFrameEnd = None
+
+    @property
+    def capturing(self):
+        return self._profiler is not None
+
+    def start(self, stopFrame=None):
+        if self._profiler is not None:
+            return
+        if self.kind == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = SamplingProfiler(interval=self.sampleInterval)
+            self._profiler.start()
+        self._startFrame = self._frame + 1
+        self._stopFrame = stopFrame
+        self._lastFrameEnd = time.time()
+
+    def stop(self):
+        if self._profiler is None:
+            return
+        profiler, self._profiler = self._profiler, None
+        filename = "{0}-frames-{1}-{2}".format(
+            self.prefix, self._startFrame, self._frame)
+        if self.kind == "cprofile":
+            profiler.disable()
+            filename += ".pstats"
+            profiler.dump_stats(filename)
+        else:
+            profiler.stop()
+            filename += ".collapsed"
+            profiler.writeCollapsed(filename)
+        self.written.append(filename)
+        log.log(Severity.Information, "Profile of frames {0} to {1} written to {2}".format(
+            self._startFrame, self._frame, filename))
+        # writing the profile is not part of the next frame, or with a
+        # budget every window would trigger the next one
+        self._lastFrameEnd = time.time()
+
+    def toggle(self):
+        if self._profiler is None:
+            self.start()
+        else:
+            self.stop()
+
+    def frameEnd(self, frame):
+        """
+        Notify the profiler that *frame* has been completed.
+        """
+        now = time.time()
+        duration = None
+        if self._lastFrameEnd is not None:
+            duration = now - self._lastFrameEnd
+        self._lastFrameEnd = now
+        self._frame = frame
+
+        if self._profiler is not None:
+            if self._stopFrame is not None and frame + 1 >= self._stopFrame:
+                self.stop()
+            return
+
+        while self.ranges and self.ranges[0][1] <= frame + 1:
+            del self.ranges[0]
+        if self.ranges and self.ranges[0][0] <= frame + 1:
+            start, stop = self.ranges.pop(0)
+            self.start(stop)
+        elif (self.budget is not None and duration is not None and
+                duration > self.budget):
+            log.log(Severity.Warning, "Frame {0} took {1:.1f} ms, profiling the next {2} frames".format(
+                frame, duration * 1000, self.budgetFrames))
+            self.start(frame + 1 + self.budgetFrames)
@@ -31,11 +31,12 @@ import Engine.CEngine.GL as CGL
 import Engine.CEngine.SceneGraph as CSceneGraph
 import Engine.CEngine.Window.key as key
 import Engine.CEngine.Pango as Pango
+from Engine.CEngine.Log import server as log, Severity
 
 import cairo
 
-import StringIO
 from OpenGL.GL import *
+import functools
 import math
 import os
 import sys
@@ -48,11 +49,6 @@ from Engine.UI import SceneWidget, VBox, HBox, LabelWidget, WindowWidget
 from Engine.VFS.FileSystem import XDGFileSystem, MountPriority
 from Engine.VFS.Mounts import MountDirectory
 from Engine.Resources.Manager import ResourceManager
-import Engine.Resources.PNGTextureLoader
-import Engine.Resources.ModelLoader
-import Engine.Resources.CSSLoader
-import Engine.Resources.MaterialLoader
-import Engine.Resources.ShaderLoader
 from Engine.GL import make_pot
 from Engine.GL.Shader import Shader
 from Engine.GL.RenderModel import RenderModel
@@ -61,20 +57,165 @@ from Engine.UI.Theme import Theme
 import Engine.GL.Base as GL
 from Engine.UI.CSS.Rect import Rect
 
+from Client.FrameStats import FrameStats
+from Client.FrameTimer import FrameTimer, dumpTimings, dumpTimingsJSON
+from Client.GPUTimer import GPUTimer, timerQueriesSupported
+from Client.GCScheduler import GCScheduler
+from Client.IndexedTheme import IndexedTheme
+from Client.MemoryStats import MemoryStats, bufferBytes
+from Client.Resources import require, installCache, AsyncLoader
+import Client.Resources as Resources
+from Client.ResourceCache import ResourceCache
+from Client.Mesh import MeshFile, GLMesh
+import Client.Cooked as Cooked
+from Client.Pack import MountPack
+from Client.VFSCache import CachingXDGFileSystem
+from Client.HotReload import DirectoryWatcher, HotReloader, \
+    inotifySupported
+from Client.ShaderCache import ProgramBinaryCache, \
+    programBinariesSupported
+from Client.ShaderPermutations import ShaderPermutations
+from Client.Overlay import DamageRegion, createOverlayUploader, \
+    OverlayRenderThread, TiledOverlay, OverlayPool, WidgetDamage, \
+    npotTexturesSupported
+
+FRAME_PHASES = [
+    "load",
+    "update",
+    "renderScene",
+    "clearCairoSurface",
+    "render",
+    "upload",
+    "composite",
+    "flip",
+    "gc",
+    "shaders",
+]
+
+# Application attributes holding the widget in each interaction state,
+# see WidgetDamage
+INTERACTION_STATES = {
+    "hover": "_hoveredWidget",
+    "focus": "_focusedWidget",
+    "pressed": "_pressedWidget",
+    "dragged": "_draggedWidget",
+}
+
+GPU_FRAME_PHASES = [
+    "renderScene",
+    "upload",
+    "composite",
+]
+
 class Scene(SceneWidget):
-    def __init__(self, parent, **kwargs):
+    def __init__(self, parent, shipCount=1, loader=None, meshPath=None,
+            loadTexture=None, vfs=None, **kwargs):
         super(Scene, self).__init__(parent)
         self.rotX = 0.
         self.rotZ = 0.
         self._sceneGraph = CSceneGraph.SceneGraph()
-        self._testModel = ResourceManager().require('spaceship.obj', RenderModel)
         self._node = CSceneGraph.Node() #rotationsnode
         self._sceneGraph.RootNode.addChild(self._node)
-        transNode = CSceneGraph.Node()
-        transNode.addChild(self._testModel)
-        transNode.translate(0.,0.,-12.)
-        transNode.scale(0.5,0.5,0.5)
-        self._node.addChild(transNode)
+        self._testModel = None
+        self._mesh = None
+        self._shipNodes = []
+        self._shipOffsets = []
+        # time spent loading the ship model synchronously
+        self.modelLoadTime = None
+        start = time.time()
+        self._loadTexture = loadTexture or \
+            (lambda name: require(name, Texture2D))
+        self._loader = loader
+        self._vfs = vfs
+        self.meshPath = meshPath if shipCount else None
+        if shipCount and meshPath is not None:
+            # cooked meshes are drawn directly instead of through the
+            # scene graph, see renderScene
+            if loader is not None:
+                # read on a worker, uploaded on the main thread
+                loader.submit(meshPath,
+                    lambda: MeshFile(vfs.open(meshPath, "rb")).detach(),
+                    self._createMesh).addCallback(self._meshLoaded)
+            else:
+                self._mesh = self._createMesh(
+                    MeshFile(vfs.open(meshPath, "rb")))
+                self.modelLoadTime = time.time() - start
+        elif shipCount:
+            if loader is not None:
+                # the ships stay empty until the model arrives
+                loader.require_async('spaceship.obj', RenderModel
+                    ).addCallback(self._modelLoaded)
+            else:
+                self._testModel = require('spaceship.obj', RenderModel)
+                self.modelLoadTime = time.time() - start
+        # additional ships are laid out in a square grid around the
+        # first one
+        columns = int(math.ceil(math.sqrt(shipCount)))
+        for i in range(shipCount):
+            col, row = i % columns, i // columns
+            offset = ((col - (columns - 1) / 2.) * 4.,
+                      (row - (columns - 1) / 2.) * 4.,
+                      -12. - columns * 2.)
+            self._shipOffsets.append(offset)
+            if meshPath is not None:
+                continue
+            transNode = CSceneGraph.Node()
+            if self._testModel is not None:
+                transNode.addChild(self._testModel)
+            self._shipNodes.append(transNode)
+            transNode.translate(*offset)
+            transNode.scale(0.5,0.5,0.5)
+            self._node.addChild(transNode)
+
+    def _createMesh(self, mesh):
+        try:
+            return GLMesh(mesh, self._loadTexture)
+        finally:
+            mesh.close()
+
+    def _meshLoaded(self, handle):
+        if handle.error is not None:
+            log.log(Severity.Error, "Could not load {0}: {1}".format(
+                handle.name, handle.error))
+            return
+        self._mesh = handle.get()
+
+    def reloadMesh(self):
+        """
+        Load the cooked mesh again in the background and replace the
+        current one with it once it is uploaded. Return False if there
+        is no cooked mesh or no loader to do that.
+        """
+        if self.meshPath is None or self._loader is None:
+            return False
+        path, vfs = self.meshPath, self._vfs
+        self._loader.forget(path)
+        self._loader.submit(path,
+            lambda: MeshFile(vfs.open(path, "rb")).detach(),
+            self._createMesh).addCallback(self._meshReloaded)
+        return True
+
+    def _meshReloaded(self, handle):
+        if handle.error is not None:
+            # keep drawing the old mesh until the file is fixed
+            log.log(Severity.Error, "Reloading {0} failed: {1}".format(
+                handle.name, handle.error))
+            return
+        old, self._mesh = self._mesh, handle.get()
+        if old is not None:
+            old.delete()
+
+    def _loaded(self):
+        return self._mesh is not None or self._testModel is not None
+
+    def _modelLoaded(self, handle):
+        if handle.error is not None:
+            log.log(Severity.Error, "Could not load {0}: {1}".format(
+                handle.name, handle.error))
+            return
+        self._testModel = handle.get()
+        for transNode in self._shipNodes:
+            transNode.addChild(self._testModel)
 
     def renderScene(self):
         self._setupProjection()
@@ -86,11 +227,55 @@ class Scene(SceneWidget):
         self._node.rotate(self.rotZ, 0.,0.,1.)
         self._sceneGraph.update(0)
         self._sceneGraph.draw()
+        if self._mesh is not None:
+            self._drawMeshes()
+        elif not self._loaded():
+            self._drawPlaceholders()
         self._resetProjection()
         glPopMatrix()
         glDisable(GL_DEPTH_TEST)
         glDisable(GL_CULL_FACE)
 
+    def _drawShips(self, draw):
+        glPushMatrix()
+        glRotatef(math.degrees(self.rotX), 1., 0., 0.)
+        glRotatef(math.degrees(self.rotZ), 0., 0., 1.)
+        for offset in self._shipOffsets:
+            glPushMatrix()
+            glTranslatef(*offset)
+            glScalef(0.5, 0.5, 0.5)
+            draw()
+            glPopMatrix()
+        glPopMatrix()
+
+    def _drawMeshes(self):
+        self._drawShips(self._mesh.draw)
+
+    def _drawPlaceholders(self):
+        # grey boxes in place of the ships while their model loads
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glColor4f(0.5, 0.5, 0.5, 1.)
+        self._drawShips(self._drawBox)
+        glColor4f(1., 1., 1., 1.)
+
+    @staticmethod
+    def _drawBox():
+        glBegin(GL_QUADS)
+        for axis in range(3):
+            for sign in (-1., 1.):
+                normal = [0., 0., 0.]
+                normal[axis] = sign
+                glNormal3f(*normal)
+                # counter-clockwise seen from outside
+                u, v = (axis + 1) % 3, (axis + 2) % 3
+                for a, b in ((-1., -1.), (1., -1.), (1., 1.), (-1., 1.)):
+                    corner = [0., 0., 0.]
+                    corner[axis] = sign
+                    corner[u] = a
+                    corner[v] = b * sign
+                    glVertex3f(*corner)
+        glEnd()
+
     def update(self, timeDelta):
         self.rotX += timeDelta * 0.2
         self.rotZ += timeDelta * 0.3
@@ -108,50 +293,270 @@ class MatTest(CGL.Class):
         self.StateGroup = CGL.StateGroup(self, 0)
 
 class PythonicUniverse(Application):
-    def __init__(self, display, mountCWDData=True, **kwargs):
+    def __init__(self, display, mountCWDData=True, dataDirectory=None,
+            trackOverlayDamage=False, retainOverlay=False,
+            overlayUpload="sync", pipelineOverlay=False,
+            overlayTileSize=None, overlayTextureStrategy="auto",
+            timePhases=False, timeGPU=False, frameTimingsFile=None,
+            shipCount=1, windowCount=1, fixedTimeDelta=None,
+            scheduleGC=False, frameBudget=1/60, trackMemory=False,
+            memoryInterval=300, shaderCache="on", lazyShaders=False,
+            asyncLoading=False, cpuBudget=None, gpuBudget=None,
+            modelFormat="obj", cachePaths=False, hotReload=False,
+            selectorIndex=False, **kwargs):
+        if pipelineOverlay and overlayTileSize:
+            raise ValueError("The pipelined overlay cannot be tiled")
+        # doAlign may already be called from the Application constructor
+        self.frameStats = FrameStats()
+        self.frameTimer = FrameTimer(FRAME_PHASES) if timePhases else None
+        self.frameTimingsFile = frameTimingsFile
+        self.gpuTimer = None
+        self.fixedTimeDelta = fixedTimeDelta
+        self.memoryStats = None
+        self.gcScheduler = None
+        self.programCache = None
+        self._placeholder = None
+        self.resourceLoader = None
+        self.resourceCache = None
+        self.hotReloader = None
+        self._frameBudget = frameBudget
+        self._selectorIndex = selectorIndex
+        if modelFormat not in ("obj", "cooked"):
+            raise ValueError("Unknown model format: {0}".format(modelFormat))
+        if shaderCache not in ("on", "off", "cold"):
+            raise ValueError("Unknown shader cache mode: {0}".format(
+                shaderCache))
+        if scheduleGC:
+            self.gcScheduler = GCScheduler(self.frameStats,
+                frameBudget=frameBudget)
+        # a FrameWindowProfiler, set up by the launcher if requested
+        self.windowProfiler = None
+        self._trackOverlayDamage = trackOverlayDamage
+        self._retainOverlay = retainOverlay
+        self._overlayUploadMode = overlayUpload
+        self._overlayUploader = None
+        self._overlayDamage = DamageRegion()
+        self._overlayThread = None
+        self._overlayBuffers = None
+        self._overlayReady = None
+        self._overlayRendering = None
+        self._overlayTileSize = overlayTileSize
+        self._overlayTiles = None
+        self._overlaySize = None
+        self._overlayTexture = None
+        self.overlayPool = OverlayPool()
+        if overlayTextureStrategy not in ("auto", "pot", "npot"):
+            raise ValueError("Unknown overlay texture strategy: {0}".format(
+                overlayTextureStrategy))
+        self._overlayTextureStrategy = overlayTextureStrategy
+        if pipelineOverlay:
+            self._overlayThread = OverlayRenderThread(self.render)
+            self._overlayThread.start()
         super(PythonicUniverse, self).__init__(display, **kwargs)
-        vfs = XDGFileSystem('pyuniverse')
-        if mountCWDData:
-            vfs.mount('/data', MountDirectory(os.path.join(os.getcwd(), "data")), MountPriority.FileSystem)
+        self._widgetDamage = self._createWidgetDamage()
+        if trackMemory:
+            self.memoryStats = MemoryStats(
+                {
+                    "Texture2D": Texture2D,
+                    "RenderModel": RenderModel,
+                    "Node": CSceneGraph.Node,
+                },
+                textureType=Texture2D,
+                gpuSources={
+                    "overlayUploadBuffers":
+                        lambda: self._overlayUploader.bufferBytes(),
+                    "meshBuffers": lambda: bufferBytes(GLMesh),
+                },
+                interval=memoryInterval)
+        if timeGPU:
+            if timerQueriesSupported():
+                self.gpuTimer = GPUTimer(GPU_FRAME_PHASES)
+            else:
+                log.log(Severity.Warning, "Timer queries not supported, GPU timings disabled")
+        if cachePaths:
+            vfs = CachingXDGFileSystem('pyuniverse', stats=self.frameStats)
+        else:
+            vfs = XDGFileSystem('pyuniverse')
+        self.vfs = vfs
+        # either the source tree or one cooked by utils/cook/cook.py
+        self.dataDirectory = dataDirectory or \
+            os.path.join(os.getcwd(), "data")
+        if mountCWDData and os.path.isfile(self.dataDirectory):
+            vfs.mount('/data', MountPack(self.dataDirectory), MountPriority.FileSystem)
+        elif mountCWDData:
+            vfs.mount('/data', MountDirectory(self.dataDirectory), MountPriority.FileSystem)
 
         ResourceManager(vfs)
+        if cpuBudget is not None or gpuBudget is not None:
+            self.resourceCache = ResourceCache(self.frameStats,
+                cpuBudget=cpuBudget, gpuBudget=gpuBudget,
+                textureType=Texture2D, vfs=vfs)
+            installCache(self.resourceCache)
+        if asyncLoading:
+            self.resourceLoader = AsyncLoader(stats=self.frameStats)
 
-        self.theme = Theme()
-        self.theme.add_rules(ResourceManager().require("ui.css"))
+        self.theme = self._createTheme()
+        if self.resourceLoader is not None:
+            # widgets are unstyled until the rules are loaded
+            self.resourceLoader.require_async("ui.css", pin=True
+                ).addCallback(self._rulesLoaded)
+        else:
+            rules = None
+            rulesPath = Cooked.cookedPath(vfs, "ui.css", ".rules")
+            if rulesPath is not None:
+                # cooked rules consist of the classes of the CSS loader
+                Resources.loaders.ensure("ui.css")
+                with vfs.open(rulesPath, "rb") as f:
+                    rules = Cooked.loadRules(f)
+                if rules is None:
+                    log.log(Severity.Warning, "{0} was cooked for another engine version, ignoring it".format(rulesPath))
+            if rules is None:
+                rules = require("ui.css", pin=True)
+            self.theme.add_rules(rules)
 
         mainScreen = self._primaryWidget
 
-        scene = Scene(mainScreen)
+        meshPath = None
+        if modelFormat == "cooked":
+            meshPath = Cooked.cookedPath(vfs, "spaceship.obj", ".mesh")
+            if meshPath is None:
+                log.log(Severity.Warning, "No cooked mesh found, falling back to OBJ")
+        self.scene = scene = Scene(mainScreen, shipCount=shipCount,
+            loader=self.resourceLoader, meshPath=meshPath,
+            loadTexture=self._loadTexture, vfs=vfs)
         self.addSceneWidget(scene)
+        if scene.modelLoadTime is not None:
+            self.frameStats.set("modelLoadTime", scene.modelLoadTime)
 
-        window = WindowWidget(self._windowLayer)
-        window.Title.Text = "Test"
-        window.AbsoluteRect.XYWH = (32, 32, 128, 128)
+        for i in range(windowCount):
+            window = WindowWidget(self._windowLayer)
+            window.Title.Text = "Test"
+            window.AbsoluteRect.XYWH = (32 + (i % 32) * 24,
+                                        32 + (i // 32 % 24) * 24, 128, 128)
 
-        self.theme.applyStyles(self)
+        self.applyStyles()
 
-        self._shader = ResourceManager().require("/data/shaders/ui.shader")
+        if shaderCache != "off":
+            self._setupProgramCache(clear=(shaderCache == "cold"))
+        self._shader = require("/data/shaders/ui.shader", pin=True)
         self._upsideDownHelper = np.asarray([-1.0, self.AbsoluteRect.Height], dtype=np.float32)
-        self._shader.cacheShaders([
-            {
+        self.shaderPermutations = self._createShaderPermutations()
+        if not lazyShaders:
+            self.shaderPermutations.compileAll()
+        shader = self.shaderPermutations.bind(texturing=False)
+
+        shader = self.shaderPermutations.bind(texturing=True)
+        glUniform1i(shader["texture"], 0)
+
+        Shader.unbind()
+
+        if self.gcScheduler is not None:
+            # loading is done; get rid of its garbage now and take
+            # collection into our own hands
+            self.gcScheduler.collectFull()
+            self.gcScheduler.start()
+
+        if hotReload:
+            self._setupHotReload()
+
+    def _createShaderPermutations(self):
+        permutations = ShaderPermutations(self._shader,
+            self.frameStats,
+            defaults={
+                "texturing": False,
+                "upsideDown": False
+            },
+            fallback={
                 "texturing": True,
-                "upsideDown": True
+                "upsideDown": False
             },
+            frameBudget=self._frameBudget,
+            programCache=self.programCache)
+        permutations.request(
             {
                 "texturing": True,
-                "upsideDown": False
+                "upsideDown": True
             },
             {
                 "texturing": False,
                 "upsideDown": False
             },
-        ])
-        shader = self._shader.bind(texturing=False)
+        )
+        return permutations
 
-        shader = self._shader.bind(texturing=True)
-        glUniform1i(shader["texture"], 0)
+    def _setupHotReload(self):
+        if not os.path.isdir(self.dataDirectory):
+            log.log(Severity.Warning, "Hot reloading needs a data directory, not a pack")
+            return
+        if not inotifySupported():
+            log.log(Severity.Warning, "inotify not available, hot reloading disabled")
+            return
+        if self.resourceLoader is None:
+            self.resourceLoader = AsyncLoader(stats=self.frameStats)
+        self.hotReloader = HotReloader(
+            DirectoryWatcher(self.dataDirectory),
+            invalidate=getattr(self.vfs, "invalidate", None))
+        self.hotReloader.depend("ui.css", self._reloadRules)
+        self.hotReloader.depend("shaders/", self._reloadShaders)
+        if self.scene.meshPath is not None:
+            self.hotReloader.depend(self.scene.meshPath[len("/data/"):],
+                lambda paths: self.scene.reloadMesh())
+        else:
+            # RenderModels come from the ResourceManager, which keeps
+            # returning the loaded one
+            log.log(Severity.Information, "OBJ models are not reloaded, use --model-format cooked and re-run cook.py")
 
-        Shader.unbind()
+    # Reloads parse the changed files with their loader directly, as the
+    # ResourceManager would hand out the resource it already loaded.
+
+    def _reloadRules(self, paths):
+        loader = self.resourceLoader
+        loader.forget("/data/ui.css")
+        loader.submit("/data/ui.css", functools.partial(
+            Resources.loadUncached, self.vfs, "/data/ui.css")
+            ).addCallback(self._rulesReloaded)
+
+    def _rulesReloaded(self, handle):
+        if handle.error is not None:
+            # keep the old theme until the file is fixed
+            log.log(Severity.Error, "Reloading ui.css failed: {0}".format(handle.error))
+            return
+        # rules cannot be removed from a theme, so start over
+        self.theme = self._createTheme()
+        self._rulesLoaded(handle)
+
+    def _reloadShaders(self, paths):
+        # read on a worker and parsed on the main thread; the
+        # permutations are then compiled in spare frame time, see
+        # ShaderPermutations.reload
+        name = "/data/shaders/ui.shader"
+        loader = self.resourceLoader
+        loader.forget(name)
+        loader.submit(name,
+            functools.partial(Resources.readUncached, self.vfs, name),
+            functools.partial(Resources.loadUncached, self.vfs, name)
+            ).addCallback(self._shaderReloaded)
+
+    def _shaderReloaded(self, handle):
+        if handle.error is not None:
+            log.log(Severity.Error, "Reloading {0} failed: {1}".format(
+                handle.name, handle.error))
+            return
+        self._shader = handle.get()
+        self.shaderPermutations.reload(self._shader)
+
+    def _setupProgramCache(self, clear=False):
+        # the engine compiles and links the permutations, the cache
+        # takes over linking around cacheShaders, see ShaderPermutations
+        if not hasattr(sys.modules[Shader.__module__], "glLinkProgram"):
+            log.log(Severity.Information, "Shader implementation does not link through glLinkProgram, shader cache disabled")
+            return
+        if not programBinariesSupported():
+            log.log(Severity.Information, "Program binaries not supported, shader cache disabled")
+            return
+        self.programCache = ProgramBinaryCache()
+        if clear:
+            self.programCache.clear()
 
     def clearCairoSurface(self):
         ctx = self._cairoContext
@@ -161,10 +566,165 @@ class PythonicUniverse(Application):
         ctx.set_operator(cairo.OPERATOR_OVER)
         ctx.set_line_cap(cairo.LINE_CAP_SQUARE)
 
+    def _loadTexture(self, name):
+        path = Cooked.cookedPath(self.vfs, name, ".tex")
+        if path is None:
+            return require(name, Texture2D)
+        if self.resourceLoader is None:
+            with self.vfs.open(path, "rb") as f:
+                return Cooked.loadTexture(f, Texture2D)
+        # decoded on a worker, the placeholder is drawn until then
+        return self.resourceLoader.submit(path,
+            functools.partial(self._readTexture, path),
+            lambda texture: Cooked.createTexture(Texture2D, *texture),
+            placeholder=self._placeholderTexture()).get
+
+    def _readTexture(self, path):
+        with self.vfs.open(path, "rb") as f:
+            return Cooked.readTexture(f, copy=True)
+
+    def _placeholderTexture(self):
+        if self._placeholder is None:
+            self._placeholder = Texture2D(1, 1, format=GL_RGBA,
+                data=(GL_RGBA, GL_UNSIGNED_BYTE, b"\x80\x80\x80\xff"))
+        return self._placeholder
+
+    def _rulesLoaded(self, handle):
+        self.theme.add_rules(handle.result())
+        self.applyStyles()
+
+    def _createTheme(self):
+        if not self._selectorIndex:
+            return Theme()
+        if not IndexedTheme.supported():
+            log.log(Severity.Warning, "Theme does not match rules through getWidgetStyle, selector index disabled")
+            self._selectorIndex = False
+            return Theme()
+        return IndexedTheme()
+
+    def applyStyles(self):
+        theme = self.theme
+        indexed = isinstance(theme, IndexedTheme)
+        if indexed:
+            theme.candidates = 0
+        start = time.time()
+        theme.applyStyles(self)
+        self.frameStats.set("styleTime", time.time() - start)
+        if indexed:
+            self.frameStats.set("styleCandidates", theme.candidates)
+        self.invalidateOverlay()
+
+    def _createWidgetDamage(self):
+        missing = [attr for attr in INTERACTION_STATES.values()
+                   if not hasattr(self, attr)]
+        if missing:
+            log.log(Severity.Information, "Application has no {0}, input invalidates the whole overlay".format(", ".join(missing)))
+            return None
+        return WidgetDamage(self._overlayDamage, dict(
+            (name, functools.partial(getattr, self, attr))
+            for name, attr in INTERACTION_STATES.items()))
+
+    def _handleInput(self, handler, args, touched=()):
+        # Widgets do not report their own damage. Input changes the
+        # widgets entering or leaving hover, focus etc. (restyles,
+        # dragging) and those in the *touched* states (text, sliders).
+        damage = self._widgetDamage
+        if damage is None:
+            self.invalidateOverlay()
+            return handler(*args) if handler is not None else None
+        before = damage.snapshot()
+        try:
+            if handler is not None:
+                return handler(*args)
+        finally:
+            damage.damage(before, touched)
+
+    def _inherited(self, name):
+        return getattr(super(PythonicUniverse, self), name, None)
+
+    def onMouseMove(self, *args):
+        return self._handleInput(self._inherited("onMouseMove"), args,
+                                 ("pressed",))
+
+    def onMouseDown(self, *args):
+        return self._handleInput(self._inherited("onMouseDown"), args)
+
+    def onMouseUp(self, *args):
+        return self._handleInput(self._inherited("onMouseUp"), args)
+
+    def onScroll(self, *args):
+        return self._handleInput(self._inherited("onScroll"), args,
+                                 ("hover",))
+
+    def onKeyUp(self, *args):
+        return self._handleInput(self._inherited("onKeyUp"), args,
+                                 ("focus",))
+
+    def onTextInput(self, *args):
+        return self._handleInput(self._inherited("onTextInput"), args,
+                                 ("focus",))
+
+    def invalidateOverlay(self, rect=None):
+        """
+        Mark *rect* (a :class:`Rect`, usually the AbsoluteRect of a
+        widget) of the UI overlay as dirty, or the whole overlay if
+        *rect* is None. Only has an effect with overlay damage tracking
+        or a retained overlay, otherwise the whole overlay is redrawn
+        every frame anyways.
+
+        Input events invalidate the widgets whose interaction state
+        changed (see :class:`Client.Overlay.WidgetDamage`), and the
+        scene widgets are invalidated every frame. Style application,
+        layout passes and completed asynchronous loads invalidate the
+        whole overlay. Code changing widgets outside of those has to
+        call this itself.
+        """
+        if rect is None:
+            self._overlayDamage.addAll()
+        else:
+            self._overlayDamage.add(*rect.XYWH)
+
+    def frameTimings(self):
+        """
+        Return the enabled frame timers, keyed by ``"cpu"`` and
+        ``"gpu"``.
+        """
+        timers = {}
+        if self.frameTimer is not None:
+            timers["cpu"] = self.frameTimer
+        if self.gpuTimer is not None:
+            timers["gpu"] = self.gpuTimer.timings
+        return timers
+
+    def dumpFrameTimings(self, filename=None):
+        """
+        Write the per-phase frame timing summary to *filename*, which
+        defaults to :attr:`frameTimingsFile`. Without any filename, the
+        summary is printed.
+        """
+        timers = self.frameTimings()
+        if not timers:
+            return
+        filename = filename or self.frameTimingsFile
+        if filename is None:
+            dumpTimingsJSON(sys.stdout, timers)
+            print()
+        else:
+            dumpTimings(filename, timers)
+
     def onKeyDown(self, symbol, modifiers):
+        return self._handleInput(self._keyDown, (symbol, modifiers),
+                                 ("focus",))
+
+    def _keyDown(self, symbol, modifiers):
         if symbol == key.Escape:
             print("bye!")
             self._eventLoop.terminate()
+        elif symbol == key.F11:
+            self.dumpFrameTimings()
+        elif symbol == key.F12:
+            if self.windowProfiler is not None:
+                self.windowProfiler.toggle()
         elif symbol == key.f:
             if self.fullscreen:
                 self._window.setWindowed(0, 800, 600)
@@ -174,65 +734,309 @@ class PythonicUniverse(Application):
                 self.fullscreen = True
 
     def doAlign(self):
+        if self._overlayThread is not None:
+            self._overlayThread.wait()
         super(PythonicUniverse, self).doAlign()
+        self.invalidateOverlay()
 
         mainScreen = self._primaryWidget
 
         w, h = mainScreen.AbsoluteRect.Width, mainScreen.AbsoluteRect.Height
-        if hasattr(self, "_cairoSurface") and w == self._cairoSurface.get_width() and h == self._cairoSurface.get_height():
+        if self._overlaySize == (w, h):
             return
-        potW, potH = make_pot(w), make_pot(h)
+        self._overlaySize = (w, h)
+        pool = self.overlayPool
+
+        if self._overlayTileSize:
+            self._overlayTiles = TiledOverlay(w, h, self._overlayTileSize,
+                recycle=self._overlayTiles)
+        else:
+            if self._overlayTextureStrategy == "auto":
+                self._overlayTextureStrategy = \
+                    "npot" if npotTexturesSupported() else "pot"
+            if self._overlayTexture is not None:
+                pool.release("texture", *self._overlayTexture)
+            if self._overlayTextureStrategy == "npot":
+                # exact size; there is no point in saving memory on
+                # padding only to spend it on headroom again
+                self._overlayTexture = pool.acquire("texture", w, h,
+                    self._createOverlayTexture, growth=1.0)
+            else:
+                self._overlayTexture = pool.acquire("texture", w, h,
+                    self._createOverlayTexture)
+            self.cairoTex, texW, texH = self._overlayTexture
+            self.cairoTexCoords = (w / texW, h / texH)
 
-        self.cairoTexCoords = (w / potW, h / potH)
+        if self._overlayBuffers is not None:
+            for buffer in self._overlayBuffers:
+                pool.release("surface", *buffer)
+        count = 2 if self._overlayThread is not None else 1
+        # in pipelined mode, the worker rasterizes into one buffer while
+        # the other is uploaded
+        self._overlayBuffers = [
+            pool.acquire("surface", w, h, self._createOverlayBuffer)
+            for i in range(count)]
+        self._overlayReady = None
+        self._overlayRendering = None
+        (self._cairoSurface, self._cairoContext,
+         self._pangoContext) = self._overlayBuffers[0][0]
 
-        self.cairoTex = Texture2D(
-            potW, potH, format=GL_RGBA,
+        self._overlayDamage.resize(w, h)
+        self._updateOverlayMemoryStats()
+        if self._overlayUploader is None:
+            self._overlayUploader = createOverlayUploader(
+                self._overlayUploadMode)
+        self._overlayUploader.reset()
+        self.updateRenderingContext()
+
+    def _createOverlayTexture(self, w, h):
+        if self._overlayTextureStrategy == "pot":
+            w, h = make_pot(w), make_pot(h)
+        texture = Texture2D(
+            w, h, format=GL_RGBA,
             data=(GL_RGBA, GL_UNSIGNED_BYTE, None))
-        self._cairoSurface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
-        self._cairoContext = cairo.Context(self._cairoSurface)
-        self._pangoContext = Pango.PangoCairoContext(self._cairoContext)
+        return texture, w, h
+
+    def _updateOverlayMemoryStats(self):
+        stats = self.frameStats
+        if self._overlayTiles is not None:
+            stats.set("overlayTextureStrategy", "tiled")
+            stats.set("overlayTextureBytes",
+                self._overlayTiles.textureBytes())
+        else:
+            _, texW, texH = self._overlayTexture
+            stats.set("overlayTextureStrategy", self._overlayTextureStrategy)
+            stats.set("overlayTextureBytes", texW * texH * 4)
+        stats.set("overlaySurfaceBytes", sum(
+            buffer[0].get_stride() * capH
+            for buffer, _, capH in self._overlayBuffers))
+
+    def _createOverlayBuffer(self, w, h):
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        ctx = cairo.Context(surface)
+        return (surface, ctx, Pango.PangoCairoContext(ctx)), w, h
+
+    def beginOverlayPipeline(self):
+        """
+        In pipelined mode, start rasterizing the overlay on the worker
+        thread into the buffer which is not waiting to be uploaded.
+        This happens with full damage only; partial damage would have
+        to be tracked per buffer.
+        """
+        damage = self._overlayDamage
+        if not (self._retainOverlay or self._trackOverlayDamage):
+            damage.addAll()
+        if not damage:
+            return
+        damage.clear()
+
+        buffers = [buffer for buffer, _, _ in self._overlayBuffers]
+        back = buffers[1] if self._overlayReady is buffers[0] else buffers[0]
+        (self._cairoSurface, self._cairoContext,
+         self._pangoContext) = back
         self.updateRenderingContext()
+        self.clearCairoSurface()
+        self._overlayRendering = back
+        self._overlayThread.kick()
+
+    def finishOverlayPipeline(self):
+        """
+        Hand-off point of the pipelined mode: wait for the worker, after
+        which the buffer it rendered is uploaded in the next frame. Must
+        be called before control returns to the event loop, as widgets
+        may not be modified while the worker renders them.
+        """
+        self._overlayThread.wait()
+        if self._overlayRendering is not None:
+            self._overlayReady = self._overlayRendering
+            self._overlayRendering = None
+
+    def uploadOverlayPipeline(self):
+        ready, self._overlayReady = self._overlayReady, None
+        if ready is None:
+            self._overlayUploader.flush()
+            self.frameStats.add("overlayFramesRetained")
+            return
+        w, h = self._overlaySize
+        self.frameStats.add("overlayUploadBytes",
+            self._overlayUploader.upload(ready[0], [(0, 0, w, h)]))
+
+    def renderTiledOverlay(self):
+        """
+        Tiled counterpart of :meth:`renderOverlay`: the damage is
+        widened to whole tiles, which are then redrawn and uploaded.
+        """
+        tiles = self._overlayTiles
+        damage = self._overlayDamage
+        if not (self._retainOverlay or self._trackOverlayDamage):
+            damage.addAll()
+        for rect in damage.rects:
+            tiles.markDirty(*rect)
+        damage.clear()
+        if not tiles.dirty:
+            self.frameStats.add("overlayFramesRetained")
+            return
+
+        self._rasterizeOverlay(tiles.dirtyRects())
+        self.frameStats.add("overlayUploadBytes",
+            tiles.upload(self._cairoSurface))
+
+    def _rasterizeOverlay(self, rects):
+        timer = self.frameTimer
+        ctx = self._cairoContext
+        ctx.reset_clip()
+        for x, y, w, h in rects:
+            ctx.rectangle(x, y, w, h)
+        ctx.clip()
+        self.clearCairoSurface()
+        if timer is not None:
+            timer.mark("clearCairoSurface")
+        self.render()
+        ctx.reset_clip()
+        if timer is not None:
+            timer.mark("render")
+
+    def renderOverlay(self):
+        """
+        Redraw and upload the dirty part of the UI overlay into
+        :attr:`cairoTex`, which must be bound.
+
+        With a retained overlay, frames in which nothing was invalidated
+        keep the texture contents of the previous frame and do not touch
+        cairo at all.
+        """
+        surface = self._cairoSurface
+        damage = self._overlayDamage
+        uploader = self._overlayUploader
+        if not (self._retainOverlay or self._trackOverlayDamage):
+            damage.addAll()
+        if not damage:
+            uploader.flush()
+            self.frameStats.add("overlayFramesRetained")
+            return
+
+        self._rasterizeOverlay(damage.rects)
+        self.frameStats.add("overlayUploadBytes",
+            uploader.upload(surface, damage.rects))
+        damage.clear()
 
     def frameUnsynced(self, deltaT):
+        if self.fixedTimeDelta is not None:
+            deltaT = self.fixedTimeDelta
+        frameStart = time.time()
+        timer = self.frameTimer
+        gpuTimer = self.gpuTimer
+        if timer is not None:
+            timer.begin()
+        self.frameStats.beginFrame()
+        self.overlayPool.collect()
+        if self.hotReloader is not None:
+            self.hotReloader.pump()
+        if self.resourceLoader is not None:
+            # completed loads replace placeholders the UI may show
+            if self.resourceLoader.pump():
+                self.invalidateOverlay()
+                if self.gcScheduler is not None and \
+                        not self.resourceLoader.pending:
+                    # a batch of loads is done, collect its garbage
+                    self.gcScheduler.collectFull()
+        if timer is not None:
+            timer.mark("load")
         window = self._screens[0][0]
         window.switchTo()
+        pipelined = self._overlayThread is not None
+        if pipelined:
+            self.beginOverlayPipeline()
+            if timer is not None:
+                timer.mark("clearCairoSurface")
 
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glLoadIdentity()
 
         wx, wy, ww, wh = self._primaryWidget.AbsoluteRect.XYWH
 
+        if gpuTimer is not None:
+            gpuTimer.begin("renderScene")
         for sceneWidget in window._sceneWidgets:
+            # whatever the scene widget draws into the overlay changes
+            # along with the scene
+            self.invalidateOverlay(sceneWidget.AbsoluteRect)
             glViewport(*sceneWidget.AbsoluteRect.XYWH)
             sceneWidget.update(deltaT)
+            if timer is not None:
+                timer.mark("update")
             sceneWidget.renderScene()
+            if timer is not None:
+                timer.mark("renderScene")
+        if gpuTimer is not None:
+            gpuTimer.end()
 
         glViewport(0, 0, ww, wh)
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
         glOrtho(wx, ww, wh, wy, -1., 1.)
         glMatrixMode(GL_MODELVIEW)
-        ctx = self._cairoContext
-        self.clearCairoSurface()
 
-        self.render()
+        if gpuTimer is not None:
+            gpuTimer.begin("upload")
+        if self._overlayTiles is not None:
+            self.renderTiledOverlay()
+        else:
+            self.cairoTex.bind()
+            if pipelined:
+                self.uploadOverlayPipeline()
+            else:
+                self.renderOverlay()
+        if timer is not None:
+            timer.mark("upload")
+        if gpuTimer is not None:
+            gpuTimer.end()
+            gpuTimer.begin("composite")
 
-        self.cairoTex.bind()
-        s, t = self.cairoTexCoords
-        CGL.glTexCairoSurfaceSubImage2D(GL_TEXTURE_2D, 0, 0, 0, self._cairoSurface)
         glEnable(GL_TEXTURE_2D)
         glEnable(GL_BLEND)
         glBlendFunc(GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
-        glBegin(GL_QUADS)
-        glTexCoord2f(0, 0)
-        glVertex2f(0, 0)
-        glTexCoord2f(0, t)
-        glVertex2f(0, wh)
-        glTexCoord2f(s, t)
-        glVertex2f(ww, wh)
-        glTexCoord2f(s, 0)
-        glVertex2f(ww, 0)
-        glEnd()
+        if self._overlayTiles is not None:
+            self._overlayTiles.draw()
+        else:
+            s, t = self.cairoTexCoords
+            glBegin(GL_QUADS)
+            glTexCoord2f(0, 0)
+            glVertex2f(0, 0)
+            glTexCoord2f(0, t)
+            glVertex2f(0, wh)
+            glTexCoord2f(s, t)
+            glVertex2f(ww, wh)
+            glTexCoord2f(s, 0)
+            glVertex2f(ww, 0)
+            glEnd()
         Texture2D.unbind()
+        if gpuTimer is not None:
+            gpuTimer.end()
+        if timer is not None:
+            timer.mark("composite")
 
         window.flip()
+        if timer is not None:
+            timer.mark("flip")
+        if pipelined:
+            self.finishOverlayPipeline()
+            if timer is not None:
+                timer.mark("render")
+        if self.gcScheduler is not None:
+            self.gcScheduler.afterFrame(frameStart)
+            if timer is not None:
+                timer.mark("gc")
+        self.shaderPermutations.afterFrame(frameStart)
+        if timer is not None:
+            timer.mark("shaders")
+        if timer is not None:
+            timer.end()
+        if gpuTimer is not None:
+            gpuTimer.endFrame()
+        if self.resourceCache is not None:
+            self.resourceCache.frameEnd(self.frameStats.frames)
+        if self.memoryStats is not None:
+            self.memoryStats.frameEnd(self.frameStats.frames)
+        if self.windowProfiler is not None:
+            self.windowProfiler.frameEnd(self.frameStats.frames)
@@ -0,0 +1,307 @@
+# encoding=utf-8
+# File name: ResourceCache.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from Engine.CEngine.Log import server as log, Severity
+
+import collections
+import sys
+import threading
+import types
+
+from Client.MemoryStats import textureBytes
+import Client.Resources as Resources
+
+# shared by everything, never part of a resource's size
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType)
+
+class CacheEntry(object):
+    __slots__ = ("resource", "lastUse", "cpuBytes", "gpuBytes", "pinned",
+                 "baseRefs", "objects")
+
+    def __init__(self, resource, lastUse, pinned):
+        self.resource = resource
+        self.lastUse = lastUse
+        # sized from frameEnd, see ResourceCache
+        self.cpuBytes = None
+        self.gpuBytes = None
+        self.pinned = pinned
+        self.baseRefs = None
+        # ids of the objects counted for this entry
+        self.objects = ()
+
+    def refs(self):
+        return sys.getrefcount(self.resource)
+
+
+class ResourceCache(object):
+    """
+    Keeps loaded resources within a *cpuBudget* and a *gpuBudget* in
+    bytes (None meaning unlimited) by evicting the least recently used
+    ones, judged by the frame of their last :meth:`require`.
+
+    A resource is never evicted while it is pinned (see :meth:`require`
+    and :meth:`pin`), or while anything but the cache holds a reference
+    to it, e.g. a scene graph node. This is detected by comparing its
+    reference count with the one right after loading.
+
+    Evicting only frees memory if the cache holds the last reference.
+    If the ResourceManager supports releasing resources, they are
+    loaded through it and released on eviction. Otherwise, with a
+    *vfs*, they are loaded with their loader directly (see
+    :func:`Client.Resources.loadUncached`), bypassing the
+    ResourceManager; without either, the budgets are not enforced and a
+    warning is logged. *load*, a callable taking the resource name and
+    type, replaces all of that.
+
+    Sizes are estimated by *sizeOf*, a callable returning a
+    ``(cpuBytes, gpuBytes)`` tuple for a resource. The default follows
+    the Python objects reachable from the resource, up to *maxObjects*
+    of them, so the materials and textures of a model are included. It
+    counts ``sys.getsizeof`` of each object as CPU memory, and as GPU
+    memory four bytes per texel of all mipmap levels of *textureType*
+    instances plus the ``bufferBytes`` of objects owning buffer
+    objects, like :class:`~Client.Mesh.GLMesh`. Objects reachable from
+    several resources are counted for the first one only. Memory held
+    by engine objects which is not visible from Python is not counted.
+
+    :meth:`require` may be called from :class:`AsyncLoader` workers, so
+    resources are sized later, from :meth:`frameEnd` on the main
+    thread, where the texture sizes can be queried from GL. Eviction
+    runs from there as well. Hits, misses and evictions are counted in
+    the *stats* :class:`FrameStats` as ``resourceCacheHits``,
+    ``resourceCacheMisses`` and ``resourceCacheEvictions``; the cached
+    sizes are the ``resourceCacheCPUBytes`` and
+    ``resourceCacheGPUBytes`` gauges.
+    """
+
+    def __init__(self, stats, cpuBudget=None, gpuBudget=None,
+            textureType=None, sizeOf=None, vfs=None, load=None,
+            maxObjects=10000, **kwargs):
+        super(ResourceCache, self).__init__(**kwargs)
+        self.stats = stats
+        self.cpuBudget = cpuBudget
+        self.gpuBudget = gpuBudget
+        self.textureType = textureType
+        self.sizeOf = sizeOf
+        self.maxObjects = maxObjects
+        self.cpuBytes = 0
+        self.gpuBytes = 0
+        self.frame = 0
+        self._entries = collections.OrderedDict()
+        self._unsized = []
+        # id of every object counted -> key of the entry counting it
+        self._owners = {}
+        # require may be called from AsyncLoader workers
+        self._lock = threading.RLock()
+        self._release = False
+        self.canEvict = True
+        if load is not None:
+            self._load = load
+        elif Resources.releaseSupported():
+            self._load = Resources.requireUncached
+            self._release = True
+        elif vfs is not None:
+            self._load = lambda name, resourceType: \
+                Resources.loadUncached(vfs, name, resourceType=resourceType)
+        else:
+            self._load = Resources.requireUncached
+            self.canEvict = False
+        if not self.canEvict and (cpuBudget is not None or
+                                  gpuBudget is not None):
+            log.log(Severity.Warning, "ResourceManager cannot release resources, cache budgets are not enforced")
+
+    def _textureBytes(self, texture):
+        size = textureBytes(texture)
+        self.textureType.unbind()
+        return size
+
+    def _walk(self, resource, exclude):
+        # sizes of the objects reachable from resource, except those
+        # whose ids are in exclude, and the set of ids counted
+        cpuBytes = 0
+        gpuBytes = 0
+        seen = set()
+        stack = [resource]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen or id(obj) in exclude or \
+                    isinstance(obj, _SHARED_TYPES):
+                continue
+            if len(seen) >= self.maxObjects:
+                log.log(Severity.Debug, "Stopped sizing {0!r} after {1} objects".format(
+                    resource, self.maxObjects))
+                break
+            seen.add(id(obj))
+            cpuBytes += sys.getsizeof(obj)
+            if self.textureType is not None and \
+                    isinstance(obj, self.textureType):
+                # nothing of interest below a texture
+                gpuBytes += self._textureBytes(obj)
+                continue
+            bufferBytes = getattr(obj, "bufferBytes", None)
+            if isinstance(bufferBytes, int):
+                gpuBytes += bufferBytes
+            if isinstance(obj, dict):
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                stack.extend(obj)
+            stack.extend(getattr(obj, "__dict__", {}).values())
+            for slot in getattr(type(obj), "__slots__", ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+        return cpuBytes, gpuBytes, seen
+
+    def _size(self, key, entry):
+        if self.sizeOf is not None:
+            entry.cpuBytes, entry.gpuBytes = self.sizeOf(entry.resource)
+            return
+        # objects counted for other entries already are skipped
+        entry.cpuBytes, entry.gpuBytes, objects = self._walk(
+            entry.resource, self._owners)
+        entry.objects = tuple(objects)
+        for obj in entry.objects:
+            self._owners[obj] = key
+
+    def require(self, resourceName, resourceType=None, pin=False):
+        key = (resourceName, resourceType)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.stats.add("resourceCacheHits")
+                entry.lastUse = self.frame
+                entry.pinned = entry.pinned or pin
+                # most recently used last
+                del self._entries[key]
+                self._entries[key] = entry
+                return entry.resource
+
+        resource = self._load(resourceName, resourceType)
+        with self._lock:
+            self.stats.add("resourceCacheMisses")
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = CacheEntry(resource, self.frame, pin)
+                self._entries[key] = entry
+                self._unsized.append(key)
+            entry.pinned = entry.pinned or pin
+            resource = entry.resource
+            if entry.baseRefs is None:
+                # minus the reference held by the resource local
+                entry.baseRefs = entry.refs() - 1
+        return resource
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        if entry.cpuBytes is not None:
+            self.cpuBytes -= entry.cpuBytes
+            self.gpuBytes -= entry.gpuBytes
+        for obj in entry.objects:
+            del self._owners[obj]
+        return entry
+
+    def forget(self, resourceName, resourceType=None):
+        with self._lock:
+            if (resourceName, resourceType) in self._entries:
+                self._remove((resourceName, resourceType))
+                self._updateGauges()
+
+    def pin(self, resourceName, resourceType=None, pinned=True):
+        with self._lock:
+            self._entries[(resourceName, resourceType)].pinned = pinned
+
+    def unpin(self, resourceName, resourceType=None):
+        self.pin(resourceName, resourceType, pinned=False)
+
+    def _updateGauges(self):
+        self.stats.set("resourceCacheCPUBytes", self.cpuBytes)
+        self.stats.set("resourceCacheGPUBytes", self.gpuBytes)
+
+    def _overBudget(self):
+        return ((self.cpuBudget is not None and
+                 self.cpuBytes > self.cpuBudget) or
+                (self.gpuBudget is not None and
+                 self.gpuBytes > self.gpuBudget))
+
+    def sizeNew(self):
+        """
+        Size the resources loaded since the last call. Must be called
+        on the main thread.
+        """
+        with self._lock:
+            unsized, self._unsized = self._unsized, []
+            for key in unsized:
+                entry = self._entries.get(key)
+                if entry is None or entry.cpuBytes is not None:
+                    continue
+                self._size(key, entry)
+                self.cpuBytes += entry.cpuBytes
+                self.gpuBytes += entry.gpuBytes
+            if unsized:
+                self._updateGauges()
+
+    def evict(self):
+        """
+        Evict least recently used resources until both budgets are met
+        or nothing evictable is left. Return the number evicted.
+        """
+        evicted = 0
+        if not self.canEvict:
+            # dropping entries would not free anything
+            return 0
+        with self._lock:
+            if not self._overBudget():
+                return 0
+            # the entry order is only approximately LRU, as the frame of
+            # the last use is what counts
+            candidates = sorted(self._entries.items(),
+                                key=lambda item: item[1].lastUse)
+            for key, entry in candidates:
+                if not self._overBudget():
+                    break
+                if entry.pinned or entry.cpuBytes is None or \
+                        entry.refs() > entry.baseRefs:
+                    continue
+                self._remove(key)
+                if self._release:
+                    Resources.release(*key)
+                evicted += 1
+            self._updateGauges()
+        if evicted:
+            self.stats.add("resourceCacheEvictions", evicted)
+            log.log(Severity.Debug, "Evicted {0} resources from the cache".format(evicted))
+        return evicted
+
+    def frameEnd(self, frame):
+        self.frame = frame
+        self.sizeNew()
+        self.evict()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,490 @@
+# encoding=utf-8
+# File name: Resources.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+"""
+Client side access to the engine's ResourceManager.
+
+The resource loaders of the engine register themselves with the
+ResourceManager when their module is imported. Instead of importing all
+of them at startup, they are declared here by file extension and
+resource type and imported by :func:`require` the first time a resource
+of that kind is requested.
+
+:class:`AsyncLoader` loads resources in the background; see there.
+"""
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import collections
+import importlib
+import io
+import os
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from Engine.Resources.Manager import ResourceManager
+
+class LazyLoaderRegistry(object):
+    def __init__(self, **kwargs):
+        super(LazyLoaderRegistry, self).__init__(**kwargs)
+        self._byExtension = {}
+        self._byType = {}
+        self._dependencies = {}
+        self._threadSafe = set()
+        self._loaded = set()
+        self._lock = threading.RLock()
+
+    def declare(self, module, extensions=(), types=(), requires=(),
+            threadSafe=False):
+        """
+        Declare that the loader in *module* handles files with the given
+        *extensions* (without dot) and resources of the classes named in
+        *types*. Modules in *requires* are imported along with it, e.g.
+        for loaders which load other resources themselves.
+
+        Loaders which make no GL calls may be declared *threadSafe*, so
+        that :class:`AsyncLoader` runs them on its worker threads.
+        """
+        for extension in extensions:
+            self._byExtension.setdefault(extension.lower(), []).append(module)
+        for typeName in types:
+            self._byType.setdefault(typeName, []).append(module)
+        self._dependencies[module] = list(requires)
+        if threadSafe:
+            self._threadSafe.add(module)
+
+    def _load(self, module):
+        with self._lock:
+            if module in self._loaded:
+                return
+            self._loaded.add(module)
+            for dependency in self._dependencies.get(module, ()):
+                self._load(dependency)
+            importlib.import_module(module)
+
+    def _modules(self, resourceName, resourceType):
+        extension = os.path.splitext(resourceName)[1][1:].lower()
+        modules = list(self._byExtension.get(extension, ()))
+        if resourceType is not None:
+            modules.extend(self._byType.get(resourceType.__name__, ()))
+        return modules
+
+    def ensure(self, resourceName, resourceType=None):
+        """
+        Import all loaders which may be needed to load *resourceName* as
+        *resourceType*.
+        """
+        for module in self._modules(resourceName, resourceType):
+            self._load(module)
+
+    def isThreadSafe(self, resourceName, resourceType=None):
+        """
+        Return whether *resourceName* can be loaded off the main thread,
+        i.e. whether all loaders involved (including the ones they
+        require) are declared thread safe.
+        """
+        pending = self._modules(resourceName, resourceType)
+        if not pending:
+            return False
+        seen = set()
+        while pending:
+            module = pending.pop()
+            if module in seen:
+                continue
+            if module not in self._threadSafe:
+                return False
+            seen.add(module)
+            pending.extend(self._dependencies.get(module, ()))
+        return True
+
+    def loaderClass(self, resourceName):
+        """
+        Import the loader for the extension of *resourceName* and return
+        its class, which is named like its module.
+        """
+        modules = self._modules(resourceName, None)
+        if not modules:
+            raise ValueError("No loader declared for {0}".format(
+                resourceName))
+        self._load(modules[0])
+        module = importlib.import_module(modules[0])
+        return getattr(module, modules[0].rsplit(".", 1)[-1])
+
+    @property
+    def loaded(self):
+        return frozenset(self._loaded)
+
+
+loaders = LazyLoaderRegistry()
+loaders.declare("Engine.Resources.PNGTextureLoader",
+    extensions=["png"], types=["Texture2D"])
+loaders.declare("Engine.Resources.MaterialLoader",
+    extensions=["mtl"], types=["Material"],
+    requires=["Engine.Resources.PNGTextureLoader"])
+loaders.declare("Engine.Resources.ModelLoader",
+    extensions=["obj"], types=["RenderModel"],
+    requires=["Engine.Resources.MaterialLoader"])
+loaders.declare("Engine.Resources.CSSLoader",
+    extensions=["css"], threadSafe=True)
+loaders.declare("Engine.Resources.ShaderLoader",
+    extensions=["shader"], types=["Shader"])
+
+_cache = None
+
+def installCache(cache):
+    """
+    Route :func:`require` through *cache*, a :class:`ResourceCache`, or
+    directly to the ResourceManager again if *cache* is None.
+    """
+    global _cache
+    _cache = cache
+
+def requireUncached(resourceName, resourceType=None):
+    loaders.ensure(resourceName, resourceType)
+    if resourceType is None:
+        return ResourceManager().require(resourceName)
+    return ResourceManager().require(resourceName, resourceType)
+
+def releaseSupported():
+    """
+    Whether the ResourceManager can drop resources, see :func:`release`.
+    Without it, required resources stay loaded for good.
+    """
+    return hasattr(ResourceManager(), "release")
+
+def release(resourceName, resourceType=None):
+    """
+    Ask the ResourceManager to drop its reference to a resource, if it
+    supports that. Return whether it did.
+    """
+    releaseFunc = getattr(ResourceManager(), "release", None)
+    if releaseFunc is None:
+        return False
+    if resourceType is None:
+        releaseFunc(resourceName)
+    else:
+        releaseFunc(resourceName, resourceType)
+    return True
+
+def invalidate(resourceName, resourceType=None):
+    """
+    Drop a resource from the installed cache and the ResourceManager,
+    so the next :func:`require` loads it again. Return False if the
+    ResourceManager does not support that, in which case :func:`require`
+    keeps returning the old resource.
+    """
+    if _cache is not None:
+        _cache.forget(resourceName, resourceType)
+    return release(resourceName, resourceType)
+
+def _dataPath(resourceName):
+    # relative names are below /data
+    if not resourceName.startswith("/"):
+        return "/data/" + resourceName
+    return resourceName
+
+def readUncached(vfs, resourceName):
+    """
+    Return the contents of the file of *resourceName* in *vfs*.
+    """
+    with vfs.open(_dataPath(resourceName), "rb") as f:
+        return f.read()
+
+def loadUncached(vfs, resourceName, data=None, resourceType=None):
+    """
+    Load *resourceName* from *vfs* as *resourceType* with its loader
+    directly, bypassing the ResourceManager and the installed cache.
+    This loads a changed file again even if the ResourceManager cannot
+    release the old resource, and the resource is not kept alive by the
+    ResourceManager. *data* are the contents of the file if they were
+    already read with :func:`readUncached`, e.g. on a worker thread.
+    """
+    loader = loaders.loaderClass(resourceName)()
+    args = () if resourceType is None else (resourceType,)
+    if data is not None:
+        return loader.load(io.BytesIO(data), *args)
+    with vfs.open(_dataPath(resourceName), "rb") as f:
+        return loader.load(f, *args)
+
+def require(resourceName, resourceType=None, pin=False):
+    """
+    Like ``ResourceManager().require``, but imports the required
+    resource loaders first and goes through the installed cache, if
+    any. *pin* keeps the resource from being evicted from the cache.
+    """
+    if _cache is not None:
+        return _cache.require(resourceName, resourceType, pin=pin)
+    return requireUncached(resourceName, resourceType)
+
+
+class ResourceHandle(object):
+    """
+    Handle to a resource requested from an :class:`AsyncLoader`.
+
+    Until the resource is loaded, :meth:`get` returns the *placeholder*.
+    Callbacks added with :meth:`addCallback` are called with the handle
+    on the main thread once loading finished, successfully or not.
+    """
+
+    def __init__(self, loader, name, resourceType=None, placeholder=None,
+            pin=False, **kwargs):
+        super(ResourceHandle, self).__init__(**kwargs)
+        self.name = name
+        self.resourceType = resourceType
+        self.placeholder = placeholder
+        self.pin = pin
+        self.error = None
+        # set for loads submitted with AsyncLoader.submit
+        self._parse = None
+        self._finish = None
+        self._parsed = None
+        self._loader = loader
+        self._resource = None
+        self._done = False
+        self._callbacks = []
+
+    @property
+    def ready(self):
+        return self._done
+
+    def get(self):
+        """
+        Return the resource if it is loaded and the placeholder
+        otherwise.
+        """
+        if self._done and self.error is None:
+            return self._resource
+        return self.placeholder
+
+    def result(self):
+        """
+        Return the resource, loading it on the calling thread (which
+        must be the main thread) if it is not loaded yet. Errors raised
+        by the loader are re-raised.
+        """
+        if not self._done:
+            self._loader._finishNow(self)
+        if self.error is not None:
+            raise self.error
+        return self._resource
+
+    def addCallback(self, callback):
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _complete(self, resource=None, error=None):
+        self._resource = resource
+        self.error = error
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class AsyncLoader(object):
+    """
+    Loads resources on a pool of *workers* threads.
+
+    Resources whose loaders are declared thread safe (no GL calls) are
+    loaded completely on the workers. For all others, the workers only
+    import the loaders, and the load itself, which creates GL objects,
+    is left to :meth:`pump` on the main thread. :meth:`pump` has to be
+    called once per frame; it runs the callbacks of finished handles and
+    spends up to *budget* seconds on main thread loads, but always
+    completes at least one.
+
+    Loads which do not go through the ResourceManager, e.g. of cooked
+    files, can be split the same way with :meth:`submit`.
+
+    Loads are counted in the *stats* :class:`FrameStats`, if given, as
+    ``resourcesLoaded`` and ``resourceLoadTime`` (main thread only).
+    """
+
+    def __init__(self, workers=2, budget=0.004, stats=None, **kwargs):
+        super(AsyncLoader, self).__init__(**kwargs)
+        self.budget = budget
+        self.stats = stats
+        self._handles = {}
+        self._submitted = {}
+        self._requests = queue.Queue()
+        # deque appends and pops are atomic, so workers can hand over
+        # through these without locking
+        self._finished = collections.deque()
+        self._mainThread = collections.deque()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work,
+                name="AsyncLoader-{0}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def require_async(self, name, resourceType=None, placeholder=None,
+            pin=False):
+        """
+        Request *name* as *resourceType* and return its
+        :class:`ResourceHandle`. Requesting the same resource again
+        returns the same handle. *pin* is passed on to :func:`require`.
+        """
+        key = (name, resourceType)
+        handle = self._handles.get(key)
+        if handle is None:
+            handle = ResourceHandle(self, name, resourceType,
+                placeholder=placeholder, pin=pin)
+            self._handles[key] = handle
+            self._requests.put(handle)
+        return handle
+
+    def submit(self, name, parse, finish=None, placeholder=None):
+        """
+        Call *parse* on a worker and then *finish*, if given, with its
+        result from :meth:`pump`; GL objects have to be created in
+        *finish*. Return a :class:`ResourceHandle` named *name* for the
+        result of *finish*, or else of *parse*. Submitting the same
+        *name* again returns the same handle.
+        """
+        handle = self._submitted.get(name)
+        if handle is None:
+            handle = ResourceHandle(self, name, placeholder=placeholder)
+            handle._parse = parse
+            handle._finish = finish
+            self._submitted[name] = handle
+            self._requests.put(handle)
+        return handle
+
+    def forget(self, name, resourceType=None):
+        """
+        Drop the handle of *name*, so that it is loaded again by the
+        next :meth:`require_async` or :meth:`submit`.
+        """
+        self._handles.pop((name, resourceType), None)
+        self._submitted.pop(name, None)
+
+    def prefetch(self, resources):
+        """
+        Request each of *resources*, given as names or as
+        ``(name, resourceType)`` tuples, and return the list of handles.
+        """
+        handles = []
+        for resource in resources:
+            if isinstance(resource, tuple):
+                handles.append(self.require_async(*resource))
+            else:
+                handles.append(self.require_async(resource))
+        return handles
+
+    def _work(self):
+        while True:
+            handle = self._requests.get()
+            if handle is None:
+                return
+            try:
+                if handle._parse is not None:
+                    handle._parsed = (handle._parse(),)
+                    if handle._finish is not None:
+                        self._mainThread.append(handle)
+                    else:
+                        self._finished.append(
+                            (handle, handle._parsed[0], None))
+                    continue
+                loaders.ensure(handle.name, handle.resourceType)
+                if not loaders.isThreadSafe(handle.name, handle.resourceType):
+                    self._mainThread.append(handle)
+                    continue
+                resource = require(handle.name, handle.resourceType,
+                    pin=handle.pin)
+            except Exception as err:
+                self._finished.append((handle, None, err))
+            else:
+                self._finished.append((handle, resource, None))
+
+    def _load(self, handle):
+        start = time.time()
+        try:
+            if handle._parse is not None:
+                parsed = handle._parsed
+                parsed = parsed[0] if parsed is not None else handle._parse()
+                resource = parsed
+                if handle._finish is not None:
+                    resource = handle._finish(parsed)
+            else:
+                resource = require(handle.name, handle.resourceType,
+                    pin=handle.pin)
+        except Exception as err:
+            handle._complete(error=err)
+        else:
+            handle._complete(resource)
+        if self.stats is not None:
+            self.stats.add("resourcesLoaded")
+            self.stats.add("resourceLoadTime", time.time() - start)
+
+    def _finishNow(self, handle):
+        # the handle may be anywhere in the pipeline; loading it here
+        # and skipping it later is simplest
+        self._load(handle)
+
+    def pump(self):
+        """
+        Complete loads on the main thread. Call once per frame.
+
+        Returns the number of handles completed, whose callbacks have
+        run by then.
+        """
+        completed = 0
+        while self._finished:
+            handle, resource, error = self._finished.popleft()
+            if not handle.ready:
+                handle._complete(resource, error)
+                completed += 1
+                if self.stats is not None:
+                    self.stats.add("resourcesLoaded")
+        deadline = time.time() + self.budget
+        while self._mainThread:
+            handle = self._mainThread.popleft()
+            if not handle.ready:
+                self._load(handle)
+                completed += 1
+                if time.time() >= deadline:
+                    break
+        return completed
+
+    @property
+    def pending(self):
+        handles = list(self._handles.values()) + \
+            list(self._submitted.values())
+        return sum(1 for handle in handles if not handle.ready)
+
+    def shutdown(self):
+        for thread in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
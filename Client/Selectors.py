@@ -0,0 +1,333 @@
+# encoding=utf-8
+# File name: Selectors.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+"""
+Compiled CSS selector matching for styling widget trees.
+
+Widgets are described to the matcher as nodes, ``(type, classes,
+states)`` tuples with the classes and states as frozensets; a path is
+the tuple of nodes from the root down to the widget. Selectors consist
+of compound selectors (``Type.class:state``, any part optional, ``*``
+for any type) joined by descendant (whitespace) or child (``>``)
+combinators.
+
+:class:`SelectorIndex` files each rule under the rightmost compound of
+its selector, so a widget only evaluates the rules which can possibly
+apply to it, and memoizes the result per path.
+"""
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import re
+
+_compoundRe = re.compile(
+    r"(?P<type>\*|[A-Za-z_][\w-]*)?(?P<rest>(?:[.:][A-Za-z_][\w-]*)*)$")
+_partRe = re.compile(r"([.:])([A-Za-z_][\w-]*)")
+
+DESCENDANT = " "
+CHILD = ">"
+
+def makeNode(type, classes=(), states=()):
+    return (type, frozenset(classes), frozenset(states))
+
+class Compound(object):
+    __slots__ = ("type", "classes", "states")
+
+    def __init__(self, type=None, classes=(), states=()):
+        self.type = type
+        self.classes = frozenset(classes)
+        self.states = frozenset(states)
+
+    @classmethod
+    def parse(cls, text):
+        match = _compoundRe.match(text)
+        if match is None or not text:
+            raise ValueError("Invalid compound selector: {0!r}".format(text))
+        type = match.group("type")
+        classes, states = [], []
+        for prefix, name in _partRe.findall(match.group("rest")):
+            (classes if prefix == "." else states).append(name)
+        return cls(None if type == "*" else type, classes, states)
+
+    def matches(self, node):
+        type, classes, states = node
+        return ((self.type is None or self.type == type) and
+                self.classes <= classes and self.states <= states)
+
+
+class Selector(object):
+    """
+    A parsed selector. *compounds* are ordered left to right and
+    ``combinators[i]`` joins ``compounds[i]`` and ``compounds[i+1]``.
+    """
+
+    def __init__(self, text, **kwargs):
+        super(Selector, self).__init__(**kwargs)
+        self.text = text
+        tokens = text.replace(">", " > ").split()
+        self.compounds = []
+        self.combinators = []
+        combinator = None
+        for token in tokens:
+            if token == ">":
+                if not self.compounds or combinator is not None:
+                    raise ValueError("Invalid selector: {0!r}".format(text))
+                combinator = CHILD
+                continue
+            if self.compounds:
+                self.combinators.append(combinator or DESCENDANT)
+            self.compounds.append(Compound.parse(token))
+            combinator = None
+        if not self.compounds or combinator is not None:
+            raise ValueError("Invalid selector: {0!r}".format(text))
+        self.specificity = (
+            sum(len(c.classes) + len(c.states) for c in self.compounds),
+            sum(1 for c in self.compounds if c.type is not None))
+
+    @property
+    def rightmost(self):
+        return self.compounds[-1]
+
+    def _matchFrom(self, path, compound, position):
+        # compounds[compound] matched path[position]; match the rest
+        # leftwards, backtracking over descendant combinators
+        if compound == 0:
+            return True
+        previous = self.compounds[compound - 1]
+        if self.combinators[compound - 1] == CHILD:
+            return (position > 0 and previous.matches(path[position - 1])
+                    and self._matchFrom(path, compound - 1, position - 1))
+        for ancestor in range(position - 1, -1, -1):
+            if previous.matches(path[ancestor]) and \
+                    self._matchFrom(path, compound - 1, ancestor):
+                return True
+        return False
+
+    def matches(self, path):
+        position = len(path) - 1
+        return (position >= 0 and self.rightmost.matches(path[position])
+                and self._matchFrom(path, len(self.compounds) - 1, position))
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return "<Selector {0!r}>".format(self.text)
+
+
+class SelectorIndex(object):
+    """
+    Rules indexed by the rightmost compound of their selectors: under
+    one of its classes if it has any, else its type, else one of its
+    states, else in the universal bucket. Classes come first as they
+    are the most selective.
+
+    :meth:`match` returns the rules matching a path in cascade order
+    (ascending specificity, then order of addition) and memoizes the
+    result per path, states included. Adding rules drops the memo, as
+    does exceeding *memoSize* entries.
+    """
+
+    def __init__(self, memoSize=65536, **kwargs):
+        super(SelectorIndex, self).__init__(**kwargs)
+        self.memoSize = memoSize
+        self._byClass = {}
+        self._byType = {}
+        self._byState = {}
+        self._universal = []
+        self._memo = {}
+        self._count = 0
+        self.lookups = 0
+        self.memoHits = 0
+        self.evaluations = 0
+
+    def add(self, selector, rule):
+        if not isinstance(selector, Selector):
+            selector = Selector(selector)
+        entry = (selector.specificity, self._count, selector, rule)
+        self._count += 1
+        key = selector.rightmost
+        if key.classes:
+            self._byClass.setdefault(min(key.classes), []).append(entry)
+        elif key.type is not None:
+            self._byType.setdefault(key.type, []).append(entry)
+        elif key.states:
+            self._byState.setdefault(min(key.states), []).append(entry)
+        else:
+            self._universal.append(entry)
+        self._memo.clear()
+
+    def __len__(self):
+        return self._count
+
+    def candidates(self, node):
+        type, classes, states = node
+        return self.candidatesFor((type,), classes, states)
+
+    def candidatesFor(self, types, classes=None, states=None):
+        """
+        Return the entries of the rules which may match a widget with
+        any of the type names *types* (e.g. those of its class and its
+        bases), the *classes* and the *states*. If classes or states are
+        None, they are unknown and all rules keyed by one are included.
+        """
+        result = list(self._universal)
+        for name in types:
+            result.extend(self._byType.get(name, ()))
+        for names, buckets in ((classes, self._byClass),
+                               (states, self._byState)):
+            if names is None:
+                for bucket in buckets.values():
+                    result.extend(bucket)
+                continue
+            for name in names:
+                result.extend(buckets.get(name, ()))
+        return result
+
+    def match(self, path):
+        """
+        Return the rules matching the widget at the end of *path*, a
+        tuple of nodes (see :func:`makeNode`), in cascade order.
+        """
+        self.lookups += 1
+        try:
+            result = self._memo[path]
+        except KeyError:
+            pass
+        else:
+            self.memoHits += 1
+            return result
+        matched = []
+        for entry in self.candidates(path[-1]):
+            self.evaluations += 1
+            if entry[2].matches(path):
+                matched.append(entry)
+        matched.sort(key=lambda entry: entry[:2])
+        result = [entry[3] for entry in matched]
+        if len(self._memo) >= self.memoSize:
+            self._memo.clear()
+        self._memo[path] = result
+        return result
+
+
+def benchmark(ruleCount=5000, widgetCount=5000, seed=0):
+    """
+    Match a random widget tree against random rules, once by testing
+    every rule against every widget, once by testing only the
+    candidates of each widget (as :class:`Client.IndexedTheme` does)
+    and once through a :class:`SelectorIndex`, twice (cold and
+    memoized). Return the timings in seconds and whether all agreed.
+    """
+    import random
+    import time
+
+    rng = random.Random(seed)
+    types = ["Widget{0}".format(i) for i in range(30)]
+    classes = ["c{0}".format(i) for i in range(400)]
+    states = ["hover", "focus", "active", "disabled"]
+
+    def compound():
+        text = rng.choice(types + ["*"] * 5)
+        for i in range(rng.choice([0, 1, 1, 2])):
+            text += "." + rng.choice(classes)
+        if rng.random() < 0.2:
+            text += ":" + rng.choice(states)
+        return text
+
+    rules = []
+    for i in range(ruleCount):
+        parts = [compound() for j in range(rng.choice([1, 1, 2, 3]))]
+        joiner = rng.choice([" ", " > "])
+        rules.append((joiner.join(parts), i))
+
+    paths = []
+    stack = [()]
+    while len(paths) < widgetCount:
+        parent = rng.choice(stack)
+        node = makeNode(rng.choice(types),
+            rng.sample(classes, rng.choice([0, 1, 2])),
+            [state for state in states if rng.random() < 0.05])
+        path = parent + (node,)
+        paths.append(path)
+        if len(path) < 8:
+            stack.append(path)
+
+    selectors = [(Selector(text), rule) for text, rule in rules]
+    start = time.time()
+    naive = []
+    for path in paths:
+        matched = [(selector.specificity, i, rule)
+                   for i, (selector, rule) in enumerate(selectors)
+                   if selector.matches(path)]
+        matched.sort()
+        naive.append([rule for _, _, rule in matched])
+    naiveTime = time.time() - start
+
+    index = SelectorIndex()
+    start = time.time()
+    for text, rule in rules:
+        index.add(text, rule)
+    buildTime = time.time() - start
+    start = time.time()
+    filtered = []
+    for path in paths:
+        matched = [entry for entry in index.candidates(path[-1])
+                   if entry[2].matches(path)]
+        matched.sort(key=lambda entry: entry[:2])
+        filtered.append([entry[3] for entry in matched])
+    candidatesTime = time.time() - start
+    start = time.time()
+    indexed = [index.match(path) for path in paths]
+    coldTime = time.time() - start
+    start = time.time()
+    for path in paths:
+        index.match(path)
+    warmTime = time.time() - start
+
+    return {
+        "rules": ruleCount,
+        "widgets": widgetCount,
+        "naive": naiveTime,
+        "indexBuild": buildTime,
+        "candidates": candidatesTime,
+        "indexedCold": coldTime,
+        "indexedWarm": warmTime,
+        "evaluations": index.evaluations,
+        "agree": naive == indexed == filtered,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+    parser = argparse.ArgumentParser(
+        description="Benchmark naive against indexed selector matching.")
+    parser.add_argument("--rules", type=int, default=5000)
+    parser.add_argument("--widgets", type=int, default=5000)
+    args = parser.parse_args()
+    json.dump(benchmark(args.rules, args.widgets), sys.stdout, indent=2,
+              sort_keys=True)
+    print()
@@ -0,0 +1,210 @@
+# encoding=utf-8
+# File name: ShaderCache.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from Engine.CEngine.Log import server as log, Severity
+
+from OpenGL.GL import *
+from OpenGL.GL.ARB.get_program_binary import glInitGetProgramBinaryARB, \
+    glProgramBinary, glGetProgramBinary, glProgramParameteri, \
+    GL_PROGRAM_BINARY_LENGTH, GL_PROGRAM_BINARY_RETRIEVABLE_HINT
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import numpy as np
+
+def programBinariesSupported():
+    return bool(glInitGetProgramBinaryARB())
+
+def cacheDirectory(appName="pyuniverse"):
+    """
+    Return the directory for cached program binaries, following the XDG
+    base directory specification.
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, appName, "shaders")
+
+def driverString():
+    """
+    Return a string identifying the GL driver. Program binaries are only
+    valid for the driver which produced them.
+    """
+    return "\n".join(
+        (glGetString(name) or b"").decode("utf-8", "replace")
+        for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+
+class ProgramBinaryCache(object):
+    """
+    On-disk cache of linked GL program binaries.
+
+    Entries are keyed by the hash of the shader source, the define set
+    and the driver string (see :meth:`key`), so editing a shader,
+    changing a permutation or updating the driver simply results in a
+    miss. Binaries the driver rejects anyway are deleted and count as
+    stale; the caller then compiles the program as usual.
+
+    Programs which are to be stored should be linked with
+    ``GL_PROGRAM_BINARY_RETRIEVABLE_HINT`` set.
+
+    For shaders linked by the engine, :meth:`linking` takes over the
+    link step of their compilation.
+    """
+
+    _headerFormat = b"<4sI"
+    _magic = b"PUPB"
+
+    def __init__(self, directory=None, driver=None, **kwargs):
+        super(ProgramBinaryCache, self).__init__(**kwargs)
+        self.directory = directory or cacheDirectory()
+        self.driver = driver if driver is not None else driverString()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.stored = 0
+
+    def key(self, source, defines):
+        h = hashlib.sha1()
+        h.update(source if isinstance(source, bytes)
+                 else source.encode("utf-8"))
+        h.update(json.dumps(defines, sort_keys=True).encode("utf-8"))
+        h.update(self.driver.encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".bin")
+
+    def store(self, key, program):
+        """
+        Write the binary of the linked *program* to the cache. Failures
+        are logged and otherwise ignored.
+        """
+        size = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        if not size:
+            return
+        length = np.zeros(1, dtype=np.int32)
+        binaryFormat = np.zeros(1, dtype=np.uint32)
+        binary = np.empty(size, dtype=np.uint8)
+        glGetProgramBinary(program, size, length, binaryFormat, binary)
+
+        path = self._path(key)
+        tmpPath = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            try:
+                os.makedirs(self.directory)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+            with open(tmpPath, "wb") as f:
+                f.write(struct.pack(self._headerFormat, self._magic,
+                                    int(binaryFormat[0])))
+                f.write(binary[:int(length[0])].tobytes())
+            # atomic, so concurrent instances never see partial files
+            os.rename(tmpPath, path)
+        except (IOError, OSError) as err:
+            log.log(Severity.Warning, "Could not cache program binary: {0}".format(err))
+            return
+        self.stored += 1
+
+    def linkProgram(self, program, link=glLinkProgram):
+        """
+        Drop-in replacement for ``glLinkProgram``: load the binary
+        cached for the sources of the shaders attached to *program*
+        into it, or else link it with *link* and store the binary.
+        Afterwards the link status can be queried as usual.
+        """
+        sources = [glGetShaderSource(shader)
+                   for shader in glGetAttachedShaders(program)]
+        # the sources already contain the defines of the permutation
+        key = self.key(b"\0".join(sorted(sources)), None)
+        path = self._path(key)
+        data = None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except IOError:
+            pass
+
+        headerSize = struct.calcsize(self._headerFormat)
+        if data is not None:
+            if len(data) > headerSize and data[:4] == self._magic:
+                binaryFormat = struct.unpack(
+                    self._headerFormat, data[:headerSize])[1]
+                binary = np.frombuffer(data, dtype=np.uint8,
+                                       offset=headerSize)
+                glProgramBinary(program, binaryFormat, binary, len(binary))
+                if glGetProgramiv(program, GL_LINK_STATUS):
+                    self.hits += 1
+                    return
+            log.log(Severity.Debug, "Discarding stale program binary {0}".format(path))
+            self.stale += 1
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+        self.misses += 1
+        glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT,
+                            GL_TRUE)
+        link(program)
+        if glGetProgramiv(program, GL_LINK_STATUS):
+            self.store(key, program)
+
+    @contextlib.contextmanager
+    def linking(self, shader):
+        """
+        Within the context, programs linked by the module implementing
+        the class of *shader* (e.g. in ``cacheShaders``) go through
+        :meth:`linkProgram`.
+        """
+        module = sys.modules.get(type(shader).__module__)
+        link = getattr(module, "glLinkProgram", None)
+        if link is None:
+            yield
+            return
+        module.glLinkProgram = lambda program: \
+            self.linkProgram(program, link)
+        try:
+            yield
+        finally:
+            module.glLinkProgram = link
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "stored": self.stored,
+        }
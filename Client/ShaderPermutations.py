@@ -0,0 +1,245 @@
+# encoding=utf-8
+# File name: ShaderPermutations.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from Engine.CEngine.Log import server as log, Severity
+
+import collections
+import time
+
+class ShaderPermutations(object):
+    """
+    Compiles the permutations of a :class:`Shader` lazily instead of all
+    up front with ``cacheShaders``.
+
+    Permutations passed to :meth:`request` are compiled one per frame
+    from :meth:`afterFrame`, if the frame left at least *minSlack*
+    seconds of its *frameBudget*. :meth:`bind` of a permutation which
+    is not compiled yet queues it and binds the *fallback* permutation
+    instead, which is compiled right away. Only if a permutation is
+    bound with *fallback* unset does it have to be compiled in the
+    middle of the frame; that is a stall. Binds of the shader which do
+    not go through :meth:`bind`, e.g. by the engine, are watched as
+    well: if the shader has to compile the permutation for them, that
+    is recorded as a stall too.
+
+    Compiling happens synchronously in ``cacheShaders``, so it cannot
+    overlap with rendering; spreading it over frames is all this does.
+
+    Permutations are given as define dicts, completed from *defaults*.
+    Every compile is recorded with its frame, duration and whether it
+    stalled in :attr:`events` (the last *keep*), and summed up in the
+    *stats* :class:`FrameStats` as ``shaderCompiles``,
+    ``shaderCompileTime``, ``shaderStalls``, ``shaderStallTime`` and
+    ``shaderFallbacks``.
+
+    With a *programCache* (a :class:`ProgramBinaryCache`), programs are
+    linked through it.
+
+    :meth:`reload` replaces the shader, e.g. after its source changed,
+    without compiling anything in the middle of a frame: the
+    permutations are compiled for the new shader from
+    :meth:`afterFrame`, and it is only used once all of them are.
+    """
+
+    def __init__(self, shader, stats, defaults=None, fallback=None,
+            frameBudget=1/60, minSlack=0.004, keep=256, programCache=None,
+            **kwargs):
+        super(ShaderPermutations, self).__init__(**kwargs)
+        self.shader = shader
+        self.stats = stats
+        self.programCache = programCache
+        self.defaults = dict(defaults or {})
+        self.frameBudget = frameBudget
+        self.minSlack = minSlack
+        self.events = collections.deque(maxlen=keep)
+        self._compiled = set()
+        self._pending = collections.OrderedDict()
+        self._replacement = None
+        self._replacementCompiled = set()
+        self._replacementPending = collections.OrderedDict()
+        self._watchBinds(shader)
+        self.fallback = None
+        if fallback is not None:
+            self.fallback = self._complete(fallback)
+            self._compile(self.fallback, stall=False)
+
+    def _complete(self, defines):
+        complete = dict(self.defaults)
+        complete.update(defines)
+        return complete
+
+    @staticmethod
+    def _key(defines):
+        return tuple(sorted(defines.items()))
+
+    def _watchBinds(self, shader):
+        bind = shader.bind
+
+        def watchedBind(*args, **defines):
+            if shader is self._replacement:
+                compiled = self._replacementCompiled
+                pending = self._replacementPending
+            elif shader is self.shader:
+                compiled, pending = self._compiled, self._pending
+            else:
+                # replaced already
+                return bind(*args, **defines)
+            complete = self._complete(defines)
+            key = self._key(complete)
+            if key in compiled:
+                return bind(*args, **defines)
+            # the shader compiles the permutation itself
+            start = time.time()
+            result = bind(*args, **defines)
+            compiled.add(key)
+            pending.pop(key, None)
+            self._record(complete, time.time() - start, stall=True)
+            return result
+        shader.bind = watchedBind
+
+    def _compile(self, defines, stall, replacement=False):
+        shader = self._replacement if replacement else self.shader
+        start = time.time()
+        if self.programCache is not None:
+            with self.programCache.linking(shader):
+                shader.cacheShaders([defines])
+        else:
+            shader.cacheShaders([defines])
+        self._record(defines, time.time() - start, stall)
+        key = self._key(defines)
+        if replacement:
+            self._replacementCompiled.add(key)
+        else:
+            self._compiled.add(key)
+            if self._replacement is not None and \
+                    key not in self._replacementCompiled:
+                # needed by the new shader as well
+                self._replacementPending[key] = defines
+
+    def _record(self, defines, duration, stall):
+        self.events.append({
+            "frame": self.stats.frames,
+            "defines": defines,
+            "duration": duration,
+            "stall": stall,
+        })
+        self.stats.add("shaderCompiles")
+        self.stats.add("shaderCompileTime", duration)
+        if stall:
+            self.stats.add("shaderStalls")
+            self.stats.add("shaderStallTime", duration)
+            log.log(Severity.Warning, "Compiling shader permutation {0} stalled frame {1} for {2:.1f} ms".format(
+                defines, self.stats.frames, duration * 1000))
+
+    def request(self, *permutations):
+        """
+        Queue the define dicts in *permutations* for compilation in the
+        background.
+        """
+        for defines in permutations:
+            defines = self._complete(defines)
+            key = self._key(defines)
+            if key not in self._compiled:
+                self._pending[key] = defines
+
+    def bind(self, **defines):
+        """
+        Bind the permutation selected by *defines*, or the fallback if
+        it is not compiled yet.
+        """
+        defines = self._complete(defines)
+        key = self._key(defines)
+        if key not in self._compiled:
+            if self.fallback is not None:
+                self._pending[key] = defines
+                self.stats.add("shaderFallbacks")
+                return self.shader.bind(**self.fallback)
+            self._pending.pop(key, None)
+            self._compile(defines, stall=True)
+        return self.shader.bind(**defines)
+
+    def reload(self, shader):
+        """
+        Replace the shader by *shader* once the fallback and all
+        permutations compiled so far are compiled for it, which
+        happens from :meth:`afterFrame`. Until then, the current shader
+        stays in use. Reloading again before that drops the previous
+        replacement.
+        """
+        self._replacement = shader
+        self._watchBinds(shader)
+        self._replacementCompiled = set()
+        self._replacementPending = collections.OrderedDict()
+        if self.fallback is not None:
+            self._replacementPending[self._key(self.fallback)] = \
+                self.fallback
+        for key in self._compiled:
+            self._replacementPending[key] = dict(key)
+        if not self._replacementPending:
+            self._swapReplacement()
+
+    def _compileNext(self):
+        # the replacement comes first, it is what is being worked on
+        if self._replacement is not None:
+            _, defines = self._replacementPending.popitem(last=False)
+            self._compile(defines, stall=False, replacement=True)
+            if not self._replacementPending:
+                self._swapReplacement()
+        else:
+            _, defines = self._pending.popitem(last=False)
+            self._compile(defines, stall=False)
+
+    def _swapReplacement(self):
+        self.shader = self._replacement
+        self._compiled = self._replacementCompiled
+        self._replacement = None
+        self._replacementCompiled = set()
+        self.stats.add("shaderReloads")
+
+    def afterFrame(self, frameStart):
+        """
+        Compile one pending permutation if the frame started at
+        *frameStart* left enough of its budget.
+        """
+        if not self.pending:
+            return
+        slack = self.frameBudget - (time.time() - frameStart)
+        if slack < self.minSlack:
+            return
+        self._compileNext()
+
+    def compileAll(self):
+        """
+        Compile all pending permutations now, e.g. while loading.
+        """
+        while self.pending:
+            self._compileNext()
+
+    @property
+    def pending(self):
+        return len(self._pending) + len(self._replacementPending)
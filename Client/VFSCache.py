@@ -0,0 +1,169 @@
+# encoding=utf-8
+# File name: VFSCache.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+from Engine.VFS.FileSystem import XDGFileSystem
+
+class CachedMount(object):
+    """
+    Wraps a VFS mount and remembers the results of
+    :meth:`fileReadable` and :meth:`listdir`, negative ones included,
+    so repeated lookups do not touch the file system.
+
+    Writes through :meth:`open` invalidate the path written. Changes
+    made behind the mount's back are only noticed after
+    :meth:`invalidate`.
+
+    Lookups are counted in the *stats* :class:`FrameStats`, if given,
+    as ``vfsLookups`` and ``vfsCacheMisses``; the latter are the ones
+    which went to the wrapped mount.
+    """
+
+    def __init__(self, mount, stats=None, **kwargs):
+        super(CachedMount, self).__init__(**kwargs)
+        self.mount = mount
+        self.stats = stats
+        self.hits = 0
+        self.negativeHits = 0
+        self.misses = 0
+        self._readable = {}
+        self._listings = {}
+
+    def _count(self, miss):
+        if miss:
+            self.misses += 1
+        if self.stats is not None:
+            self.stats.add("vfsLookups")
+            if miss:
+                self.stats.add("vfsCacheMisses")
+
+    def fileReadable(self, path):
+        try:
+            readable = self._readable[path]
+        except KeyError:
+            readable = self._readable[path] = self.mount.fileReadable(path)
+            self._count(True)
+            return readable
+        if readable:
+            self.hits += 1
+        else:
+            self.negativeHits += 1
+        self._count(False)
+        return readable
+
+    def fileWritable(self, path):
+        return self.mount.fileWritable(path)
+
+    def listdir(self, path):
+        try:
+            names = self._listings[path]
+        except KeyError:
+            names = self._listings[path] = list(self.mount.listdir(path))
+            self._count(True)
+            return list(names)
+        self.hits += 1
+        self._count(False)
+        return list(names)
+
+    def open(self, path, flag='r', *args, **kwargs):
+        if flag not in ('r', 'rb'):
+            self.invalidate(path)
+        return self.mount.open(path, flag, *args, **kwargs)
+
+    def invalidate(self, path=None):
+        """
+        Forget what is known about *path*, or everything if it is None.
+        As a new or removed file changes the listing of its directory,
+        all listings are dropped in either case.
+        """
+        if path is None:
+            self._readable.clear()
+        else:
+            self._readable.pop(path, None)
+        self._listings.clear()
+
+    def __getattr__(self, name):
+        return getattr(self.mount, name)
+
+    def __repr__(self):
+        return "<CachedMount {0!r}>".format(self.mount)
+
+
+class CachingXDGFileSystem(XDGFileSystem):
+    """
+    :class:`XDGFileSystem` whose mounts are wrapped into
+    :class:`CachedMount` objects, so resolving a path through the
+    mounts is answered from memory once it has been done before.
+
+    All caches are dropped on :meth:`mount` and :meth:`unmount`, and
+    :meth:`invalidate` can be called on file system notifications.
+    Mounts may be unmounted by passing the unwrapped object.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.stats = kwargs.pop("stats", None)
+        # set before the base constructor, which may mount already
+        self._cachedMounts = {}
+        super(CachingXDGFileSystem, self).__init__(*args, **kwargs)
+
+    def _wrapped(self, value):
+        return self._cachedMounts.get(id(value), value)
+
+    def mount(self, mountPoint, mount, *args, **kwargs):
+        cached = CachedMount(mount, stats=self.stats)
+        self._cachedMounts[id(mount)] = cached
+        self.invalidate()
+        return super(CachingXDGFileSystem, self).mount(
+            mountPoint, cached, *args, **kwargs)
+
+    def unmount(self, *args, **kwargs):
+        self.invalidate()
+        unmounted = [id(value) for value in list(args) + list(kwargs.values())
+                     if id(value) in self._cachedMounts]
+        args = [self._wrapped(arg) for arg in args]
+        kwargs = dict((key, self._wrapped(value))
+                      for key, value in kwargs.items())
+        result = super(CachingXDGFileSystem, self).unmount(*args, **kwargs)
+        for key in unmounted:
+            del self._cachedMounts[key]
+        return result
+
+    def invalidate(self, path=None):
+        """
+        Drop the cached lookups of *path* (as seen by the mounts), or
+        all of them.
+        """
+        for cached in self._cachedMounts.values():
+            cached.invalidate(path)
+
+    def cacheStats(self):
+        mounts = list(self._cachedMounts.values())
+        return {
+            "hits": sum(cached.hits for cached in mounts),
+            "negativeHits": sum(cached.negativeHits for cached in mounts),
+            "misses": sum(cached.misses for cached in mounts),
+        }
@@ -0,0 +1,147 @@
+# encoding=utf-8
+# File name: test_Cooked.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import io
+import json
+import sys
+import types
+import unittest
+
+from Client.Cooked import writeRules, loadRules, rulesCurrent, \
+    ruleClasses, RULES_MAGIC
+
+MODULE = "Engine.UI.CSS.testRules"
+
+def createModule(name=MODULE):
+    # stands in for the modules of the engine's CSS loader
+    module = types.ModuleType(str(name))
+    module.__file__ = __file__
+
+    class Selector(object):
+        def __init__(self, type, classes):
+            self.type = type
+            self.classes = classes
+
+    class Length(float):
+        __slots__ = ("unit",)
+
+    class Rule(object):
+        __slots__ = ("selectors", "properties")
+
+    for cls in (Selector, Length, Rule):
+        cls.__module__ = str(name)
+        setattr(module, cls.__name__, cls)
+    return module
+
+class RulesTest(unittest.TestCase):
+    def setUp(self):
+        self.module = createModule()
+        sys.modules[MODULE] = self.module
+
+    def tearDown(self):
+        sys.modules.pop(MODULE, None)
+
+    def _rules(self):
+        m = self.module
+        selector = m.Selector("Label", frozenset(["title"]))
+        width = m.Length(12.5)
+        width.unit = "px"
+        first = m.Rule()
+        first.selectors = [selector, (selector, b"\xff")]
+        first.properties = {"width": width, 3: None, "flags": set([1, 2])}
+        second = m.Rule()
+        second.selectors = [selector]
+        second.properties = {}
+        return [first, second]
+
+    def _write(self, rules):
+        f = io.BytesIO()
+        writeRules(f, rules)
+        f.seek(0)
+        return f
+
+    def test_roundTrip(self):
+        first, second = loadRules(self._write(self._rules()))
+        m = self.module
+        self.assertIsInstance(first, m.Rule)
+        selector, (same, data) = first.selectors
+        self.assertIsInstance(selector, m.Selector)
+        self.assertEqual(selector.type, "Label")
+        self.assertEqual(selector.classes, frozenset(["title"]))
+        self.assertEqual(data, b"\xff")
+        # shared objects stay shared
+        self.assertIs(same, selector)
+        self.assertIs(second.selectors[0], selector)
+        width = first.properties["width"]
+        self.assertIsInstance(width, m.Length)
+        self.assertEqual(width, 12.5)
+        self.assertEqual(width.unit, "px")
+        self.assertIsNone(first.properties[3])
+        self.assertEqual(first.properties["flags"], set([1, 2]))
+
+    def test_plainData(self):
+        document = json.loads(
+            self._write(self._rules()).getvalue().decode("ascii"))
+        self.assertEqual(document["magic"], RULES_MAGIC)
+        self.assertEqual(document["classes"], [
+            MODULE + ":Length", MODULE + ":Rule", MODULE + ":Selector"])
+
+    def test_foreignClassRejected(self):
+        class Foreign(object):
+            pass
+        self.assertRaises(TypeError, writeRules, io.BytesIO(), [Foreign()])
+
+    def test_unknownClassNotImported(self):
+        f = self._write(self._rules())
+        document = json.loads(f.getvalue().decode("ascii"))
+        name = "Engine.UI.CSS.notImported"
+        document["classes"].append(name + ":Evil")
+        document["rules"] = {"__object__": name + ":Evil", "state": []}
+        f = io.BytesIO(json.dumps(document).encode("ascii"))
+        self.assertFalse(rulesCurrent(f))
+        f.seek(0)
+        self.assertIsNone(loadRules(f))
+        self.assertNotIn(name, sys.modules)
+
+    def test_onlyCSSModules(self):
+        self.assertIn(MODULE + ":Rule", ruleClasses())
+        self.assertFalse([name for name in ruleClasses()
+                          if not name.startswith("Engine.")])
+
+    def test_staleFingerprint(self):
+        f = self._write(self._rules())
+        self.assertTrue(rulesCurrent(f))
+        # the module changed since cooking
+        self.module.__file__ = sys.modules["Client.Cooked"].__file__
+        f.seek(0)
+        self.assertFalse(rulesCurrent(f))
+        f.seek(0)
+        self.assertIsNone(loadRules(f))
+
+    def test_garbage(self):
+        self.assertIsNone(loadRules(io.BytesIO(b"\x80\x02}q\x00.")))
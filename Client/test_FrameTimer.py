@@ -0,0 +1,147 @@
+# encoding=utf-8
+# File name: test_FrameTimer.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from Client.FrameTimer import FrameTimer, dumpTimings, dumpTimingsJSON, \
+    openCSV
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+class Writer(object):
+    # json.dump writes str on Python 2 and 3 alike
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data)
+
+class FrameTimerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.timer = FrameTimer(["update", "render"], capacity=8,
+            clock=self.clock)
+
+    def frame(self, update, render, rest=0.):
+        self.timer.begin()
+        self.clock.now += update
+        self.timer.mark("update")
+        self.clock.now += render
+        self.timer.mark("render")
+        self.clock.now += rest
+        self.timer.end()
+
+    def test_marks(self):
+        self.timer.begin()
+        self.clock.now += 1.
+        self.timer.mark("update")
+        self.clock.now += 2.
+        self.timer.mark("render")
+        self.clock.now += 3.
+        # phases hit twice accumulate
+        self.timer.mark("update")
+        self.clock.now += 4.
+        self.timer.end()
+        phases, totals = self.timer.samples()
+        self.assertEqual(phases.tolist(), [[4., 2.]])
+        self.assertEqual(totals.tolist(), [10.])
+
+    def test_ring(self):
+        for i in range(11):
+            self.frame(i, 0.)
+        self.assertEqual(self.timer.frameCount, 8)
+        phases, totals = self.timer.samples()
+        self.assertEqual(phases[:, 0].tolist(), list(range(3, 11)))
+        self.assertEqual(totals.tolist(), list(range(3, 11)))
+
+    def test_percentiles(self):
+        timer = FrameTimer(["render"], capacity=100, clock=self.clock)
+        for i in range(100, 0, -1):
+            timer.record([i / 1000])
+        summary = timer.summary()
+        self.assertEqual(sorted(summary), ["frame", "render"])
+        for name in ("frame", "render"):
+            entry = summary[name]
+            self.assertAlmostEqual(entry["mean"], 0.0505)
+            self.assertAlmostEqual(entry["p50"], 0.0505)
+            self.assertAlmostEqual(entry["p95"], 0.09505)
+            self.assertAlmostEqual(entry["p99"], 0.09901)
+
+    def test_customPercentiles(self):
+        for i in range(4):
+            self.frame(0., 1., rest=1.)
+        summary = self.timer.summary(percentiles=(90,))
+        self.assertEqual(summary["render"], {"mean": 1., "p90": 1.})
+        self.assertEqual(summary["update"], {"mean": 0., "p90": 0.})
+        self.assertEqual(summary["frame"], {"mean": 2., "p90": 2.})
+
+    def test_empty(self):
+        self.assertEqual(self.timer.summary(), {})
+
+    def test_recordTotal(self):
+        self.timer.record([1., 2.])
+        self.timer.record([1., 2.], total=5.)
+        self.assertEqual(self.timer.samples()[1].tolist(), [3., 5.])
+
+    def test_json(self):
+        self.frame(1., 2.)
+        f = Writer()
+        dumpTimingsJSON(f, {"cpu": self.timer})
+        data = json.loads("".join(f.parts))
+        self.assertEqual(data["cpu"]["frames"], 1)
+        self.assertEqual(data["cpu"]["phases"]["render"]["p50"], 2.)
+
+    def test_csv(self):
+        self.frame(1., 2.)
+        self.frame(3., 2.)
+        directory = tempfile.mkdtemp(prefix="pyuniverse-test-")
+        try:
+            path = os.path.join(directory, "timings.csv")
+            dumpTimings(path, {"cpu": self.timer, "gpu": FrameTimer([])})
+            with openCSV(path) as f:
+                rows = list(csv.reader(f))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(rows[0],
+                         ["clock", "phase", "mean", "p50", "p95", "p99"])
+        self.assertEqual([row[:2] for row in rows[1:]],
+                         [["cpu", "update"], ["cpu", "render"],
+                          ["cpu", "frame"]])
+        self.assertEqual([float(value) for value in rows[1][2:]],
+                         [2., 2., 2.9, 2.98])
+        self.assertEqual(float(rows[3][2]), 4.)
@@ -0,0 +1,98 @@
+# encoding=utf-8
+# File name: test_GPUTimer.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import unittest
+
+from Client.test_Overlay import _createContext
+
+class GPUTimerTest(unittest.TestCase):
+    """
+    Runs real timer queries. Run under xvfb-run to get a context.
+    """
+
+    phases = ["clear", "flush"]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.haveContext = _createContext()
+
+    def setUp(self):
+        if not self.haveContext:
+            self.skipTest("no GL context (run under xvfb-run)")
+        import Client.GPUTimer as GPUTimer
+        if not GPUTimer.timerQueriesSupported():
+            self.skipTest("no timer queries")
+        self.module = GPUTimer
+        self.timer = GPUTimer.GPUTimer(self.phases, latency=2)
+
+    def _frame(self):
+        from OpenGL import GL
+        self.timer.begin("clear")
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+        self.timer.end()
+        self.timer.begin("flush")
+        GL.glFlush()
+        self.timer.end()
+        # all results are available when they are collected
+        GL.glFinish()
+        self.timer.endFrame()
+
+    def test_ring(self):
+        queries = [query for slot in self.timer._queries for query in slot]
+        self.assertEqual(len(set(int(query) for query in queries)), 6)
+        for i in range(2):
+            self._frame()
+        # nothing is read back before latency frames have passed
+        self.assertEqual(self.timer.timings.frameCount, 0)
+        for i in range(5):
+            self._frame()
+        self.assertEqual(self.timer.timings.frameCount, 5)
+        self.assertEqual(self.timer.dropped, 0)
+        phases, totals = self.timer.timings.samples()
+        self.assertTrue((phases >= 0).all())
+        # the same queries are used over and over
+        self.assertEqual(
+            [query for slot in self.timer._queries for query in slot],
+            queries)
+
+    def test_dropUnavailable(self):
+        for i in range(2):
+            self._frame()
+        getQueryObject = self.module.glGetQueryObjectuiv
+        self.module.glGetQueryObjectuiv = lambda query, name: 0
+        try:
+            self._frame()
+        finally:
+            self.module.glGetQueryObjectuiv = getQueryObject
+        self.assertEqual(self.timer.dropped, 1)
+        self.assertEqual(self.timer.timings.frameCount, 0)
+        # the dropped slot is reused as usual
+        for i in range(3):
+            self._frame()
+        self.assertEqual(self.timer.dropped, 1)
+        self.assertEqual(self.timer.timings.frameCount, 3)
@@ -0,0 +1,87 @@
+# encoding=utf-8
+# File name: test_ImportTimer.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from Client.ImportTimer import ImportTimer
+
+PACKAGE = "importtimertestpkg"
+
+FILES = {
+    "__init__.py": "",
+    "a.py": "from . import b\nfrom .c import x\n",
+    "b.py": "",
+    "c.py": "x = 1\n",
+    # an implicit relative import on Python 2
+    "d.py": "import e\n",
+    "e.py": "",
+}
+
+class ImportTimerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="pyuniverse-test-")
+        os.mkdir(os.path.join(self.directory, PACKAGE))
+        for name, source in FILES.items():
+            with open(os.path.join(self.directory, PACKAGE, name), "w") as f:
+                f.write(source)
+        sys.path.insert(0, self.directory)
+        self.timer = ImportTimer()
+        self.timer.install()
+
+    def tearDown(self):
+        self.timer.uninstall()
+        sys.path.remove(self.directory)
+        for name in list(sys.modules):
+            if name.split(".")[0] == PACKAGE:
+                del sys.modules[name]
+        shutil.rmtree(self.directory)
+
+    def test_relativeImports(self):
+        __import__(str(PACKAGE + ".a"))
+        self.assertEqual(
+            sorted(self.timer.times),
+            [PACKAGE + ".a", PACKAGE + ".b", PACKAGE + ".c"])
+        cumulative, selfTime = self.timer.times[PACKAGE + ".a"]
+        self.assertLessEqual(selfTime, cumulative)
+
+    def test_reimportNotRecorded(self):
+        __import__(str(PACKAGE + ".c"))
+        self.timer.times.clear()
+        __import__(str(PACKAGE + ".c"))
+        self.assertEqual(self.timer.times, {})
+
+    @unittest.skipIf(sys.version_info[0] >= 3,
+                     "no implicit relative imports")
+    def test_implicitRelativeImport(self):
+        __import__(str(PACKAGE + ".d"))
+        self.assertIn(PACKAGE + ".e", self.timer.times)
+        self.assertNotIn("e", self.timer.times)
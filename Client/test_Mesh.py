@@ -0,0 +1,136 @@
+# encoding=utf-8
+# File name: test_Mesh.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Client.Mesh import MeshFile, writeMesh, parseOBJ, VERTEX_COMPONENTS
+from Client.Pack import MountPack, writePack
+
+OBJ = """\
+mtllib ship.mtl
+v 0 0 0
+v 1 0 0
+v 1 2 0
+v 0 2 -3
+vt 0 0
+vt 1 1
+vn 0 0 1
+usemtl hull
+f 1/1/1 2/2/1 3/1/1 4/2/1
+usemtl glass
+f 1//1 3//1 4//1
+"""
+
+MTL = """\
+newmtl hull
+Kd 0.5 0.25 1
+map_Kd hull.png
+newmtl glass
+Kd 0 0 1
+d 0.5
+"""
+
+class MeshTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="pyuniverse-test-")
+        self.filename = os.path.join(self.directory, "ship.mesh")
+        self.vertices, self.indices, self.materials, self.submeshes = \
+            parseOBJ(io.StringIO(OBJ), lambda name: io.StringIO(MTL))
+        with open(self.filename, "wb") as f:
+            writeMesh(f, self.vertices, self.indices, self.materials,
+                      self.submeshes)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parseOBJ(self):
+        # one vertex per distinct v/vt/vn combination
+        self.assertEqual(self.vertices.shape, (7, VERTEX_COMPONENTS))
+        self.assertEqual(self.vertices[1].tolist(),
+                         [1., 0., 0., 0., 0., 1., 1., 1.])
+        self.assertEqual(self.vertices[4].tolist(),
+                         [0., 0., 0., 0., 0., 1., 0., 0.])
+        # the quad becomes a fan of two triangles
+        self.assertEqual(self.indices.tolist(),
+                         [0, 1, 2, 0, 2, 3, 4, 5, 6])
+        self.assertEqual(self.materials, [
+            ("hull", [0.5, 0.25, 1., 1.], "hull.png"),
+            ("glass", [0., 0., 1., 0.5], None),
+        ])
+        self.assertEqual(self.submeshes, [(0, 0, 6), (1, 6, 3)])
+
+    def check(self, mesh):
+        self.assertTrue(np.array_equal(mesh.vertices, self.vertices))
+        self.assertTrue(np.array_equal(mesh.indices, self.indices))
+        self.assertEqual(mesh.bounds.tolist(), [[0., 0., -3.], [1., 2., 0.]])
+        self.assertEqual(mesh.materials["name"].tolist(), [b"hull", b"glass"])
+        self.assertEqual(mesh.materials["texture"].tolist(),
+                         [b"hull.png", b""])
+        self.assertEqual(mesh.materials["diffuse"][1].tolist(),
+                         [0., 0., 1., 0.5])
+        self.assertEqual(mesh.submeshes["firstIndex"].tolist(), [0, 6])
+        self.assertEqual(mesh.submeshes["indexCount"].tolist(), [6, 3])
+        self.assertEqual(mesh.submeshes["bounds"][1].tolist(),
+                         [[0., 0., -3.], [1., 2., 0.]])
+
+    def test_mapped(self):
+        mesh = MeshFile(open(self.filename, "rb"))
+        self.check(mesh)
+        mesh.close()
+        # the bounds do not refer to the closed mapping
+        self.assertEqual(mesh.bounds.tolist(), [[0., 0., -3.], [1., 2., 0.]])
+
+    def test_read(self):
+        with open(self.filename, "rb") as f:
+            data = f.read()
+        self.check(MeshFile(io.BytesIO(data)))
+
+    def test_pack(self):
+        packName = os.path.join(self.directory, "data.pack")
+        writePack(packName, {"ship.mesh": self.filename}, compress=False)
+        mount = MountPack(packName)
+        try:
+            mesh = MeshFile(mount.open("ship.mesh"))
+            self.check(mesh)
+            mesh.close()
+        finally:
+            mount.pack.close()
+
+    def test_detach(self):
+        mesh = MeshFile(open(self.filename, "rb")).detach()
+        self.check(mesh)
+        mesh.close()
+
+    def test_notAMesh(self):
+        self.assertRaises(ValueError, MeshFile, io.BytesIO(b"\0" * 256))
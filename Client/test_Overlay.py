@@ -0,0 +1,315 @@
+# encoding=utf-8
+# File name: test_Overlay.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import os
+import unittest
+
+import numpy as np
+
+from Client.Overlay import DamageRegion, OverlayPool, WidgetDamage
+
+class DamageRegionTest(unittest.TestCase):
+    def setUp(self):
+        self.damage = DamageRegion(100, 80, maxRects=4)
+
+    def test_empty(self):
+        self.assertFalse(self.damage)
+        self.assertIsNone(self.damage.bounds())
+        self.assertEqual(self.damage.area(), 0)
+
+    def test_addAll(self):
+        self.damage.addAll()
+        self.assertEqual(self.damage.rects, [(0, 0, 100, 80)])
+        self.damage.clear()
+        self.assertFalse(self.damage)
+
+    def test_clipped(self):
+        self.damage.add(-10, 70, 20, 20)
+        self.assertEqual(self.damage.rects, [(0, 70, 10, 10)])
+
+    def test_outside(self):
+        self.damage.add(100, 0, 10, 10)
+        self.damage.add(0, -20, 10, 10)
+        self.damage.add(5, 5, 0, 10)
+        self.assertFalse(self.damage)
+
+    def test_fractional(self):
+        self.damage.add(1.5, 2.5, 3, 3)
+        self.assertEqual(self.damage.rects, [(1, 2, 4, 4)])
+
+    def test_disjoint(self):
+        self.damage.add(0, 0, 10, 10)
+        self.damage.add(20, 20, 10, 10)
+        self.assertEqual(sorted(self.damage.rects),
+                         [(0, 0, 10, 10), (20, 20, 10, 10)])
+        self.assertEqual(self.damage.area(), 200)
+        self.assertEqual(self.damage.bounds(), (0, 0, 30, 30))
+
+    def test_merge(self):
+        self.damage.add(0, 0, 10, 10)
+        self.damage.add(5, 5, 10, 10)
+        self.assertEqual(self.damage.rects, [(0, 0, 15, 15)])
+
+    def test_mergeChain(self):
+        # the bounding box of a merge may overlap further rects
+        self.damage.add(0, 0, 10, 10)
+        self.damage.add(20, 0, 10, 10)
+        self.damage.add(8, 0, 14, 5)
+        self.assertEqual(self.damage.rects, [(0, 0, 30, 10)])
+
+    def test_collapse(self):
+        for i in range(5):
+            self.damage.add(i * 20, i * 15, 5, 5)
+        self.assertEqual(self.damage.rects, [(0, 0, 85, 65)])
+
+    def test_resize(self):
+        self.damage.resize(50, 40)
+        self.assertEqual(self.damage.rects, [(0, 0, 50, 40)])
+        self.damage.resize(0, 40)
+        self.assertFalse(self.damage)
+
+
+class OverlayPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = OverlayPool(growth=1.25, granularity=64,
+            shrinkFactor=4, releaseDelay=2)
+        self.created = []
+
+    def create(self, w, h):
+        obj = object()
+        self.created.append((w, h))
+        return obj, w, h
+
+    def test_grow(self):
+        self.assertEqual(self.pool.grow(100), 128)
+        self.assertEqual(self.pool.grow(100, growth=1), 128)
+        self.assertEqual(self.pool.grow(128, growth=1), 128)
+
+    def test_allocate(self):
+        obj, w, h = self.pool.acquire("texture", 100, 50, self.create)
+        self.assertEqual((w, h), (128, 64))
+        self.assertEqual(self.created, [(128, 64)])
+        self.assertEqual(self.pool.counters, {"textureAllocations": 1})
+
+    def test_reuse(self):
+        obj, w, h = self.pool.acquire("texture", 100, 50, self.create)
+        self.pool.release("texture", obj, w, h)
+        again = self.pool.acquire("texture", 110, 60, self.create)
+        self.assertIs(again[0], obj)
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(self.pool.counters,
+                         {"textureAllocations": 1, "textureReuses": 1})
+
+    def test_kinds(self):
+        obj, w, h = self.pool.acquire("texture", 100, 50, self.create)
+        self.pool.release("texture", obj, w, h)
+        self.pool.acquire("surface", 100, 50, self.create)
+        self.assertEqual(self.pool.counters,
+                         {"textureAllocations": 1, "surfaceAllocations": 1})
+
+    def test_tooSmall(self):
+        obj, w, h = self.pool.acquire("texture", 100, 50, self.create)
+        self.pool.release("texture", obj, w, h)
+        self.pool.acquire("texture", 200, 50, self.create)
+        self.assertEqual(self.pool.counters["textureAllocations"], 2)
+
+    def test_tooLarge(self):
+        obj, w, h = self.pool.acquire("texture", 1000, 1000, self.create)
+        self.pool.release("texture", obj, w, h)
+        # would waste more than shrinkFactor times the area
+        self.pool.acquire("texture", 100, 100, self.create)
+        self.assertEqual(self.pool.counters, {"textureAllocations": 2})
+
+    def test_releaseDelay(self):
+        obj, w, h = self.pool.acquire("texture", 100, 50, self.create)
+        self.pool.release("texture", obj, w, h)
+        self.pool.collect()
+        self.assertNotIn("textureReleases", self.pool.counters)
+        self.pool.collect()
+        self.assertEqual(self.pool.counters["textureReleases"], 1)
+        self.pool.acquire("texture", 100, 50, self.create)
+        self.assertEqual(self.pool.counters["textureAllocations"], 2)
+
+
+class Rect(object):
+    def __init__(self, *xywh):
+        self.XYWH = xywh
+
+class Widget(object):
+    def __init__(self, *xywh):
+        self.AbsoluteRect = Rect(*xywh)
+
+class WidgetDamageTest(unittest.TestCase):
+    def setUp(self):
+        self.region = DamageRegion(200, 100)
+        self.widgets = {"hover": None, "focus": None}
+        self.damage = WidgetDamage(self.region, dict(
+            (name, lambda name=name: self.widgets[name])
+            for name in self.widgets))
+        self.a = Widget(10, 10, 20, 10)
+        self.b = Widget(100, 50, 30, 20)
+
+    def test_unchanged(self):
+        self.widgets["hover"] = self.a
+        self.damage.damage(self.damage.snapshot())
+        self.assertEqual(self.region.rects, [])
+
+    def test_hover(self):
+        self.widgets["hover"] = self.a
+        before = self.damage.snapshot()
+        self.widgets["hover"] = self.b
+        self.damage.damage(before)
+        self.assertEqual(sorted(self.region.rects),
+                         [(10, 10, 20, 10), (100, 50, 30, 20)])
+
+    def test_leave(self):
+        self.widgets["hover"] = self.a
+        before = self.damage.snapshot()
+        self.widgets["hover"] = None
+        self.damage.damage(before)
+        self.assertEqual(self.region.rects, [(10, 10, 20, 10)])
+
+    def test_moved(self):
+        self.widgets["focus"] = self.a
+        before = self.damage.snapshot()
+        self.a.AbsoluteRect = Rect(50, 10, 20, 10)
+        self.damage.damage(before)
+        self.assertEqual(sorted(self.region.rects),
+                         [(10, 10, 20, 10), (50, 10, 20, 10)])
+
+    def test_touched(self):
+        self.widgets["focus"] = self.b
+        self.damage.damage(self.damage.snapshot(), ("focus",))
+        self.assertEqual(self.region.rects, [(100, 50, 30, 20)])
+
+
+def _createContext():
+    """
+    Create a hidden GL context with GLUT, e.g. on Xvfb with Mesa. Return
+    False if that is not possible here.
+    """
+    if not os.environ.get("DISPLAY"):
+        return False
+    try:
+        from OpenGL import GLUT
+        GLUT.glutInit()
+        GLUT.glutInitDisplayMode(GLUT.GLUT_RGBA)
+        GLUT.glutInitWindowSize(16, 16)
+        GLUT.glutCreateWindow(b"test_Overlay")
+        GLUT.glutHideWindow()
+    except Exception:
+        return False
+    return True
+
+class UploaderPixelTest(unittest.TestCase):
+    """
+    Checks that the PBO uploader puts the same texels into the texture
+    as the synchronous one. Run under xvfb-run to get a context.
+    """
+
+    width, height = 67, 45
+    rects = [(0, 0, 67, 45), (3, 4, 20, 10), (40, 30, 27, 15)]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.haveContext = _createContext()
+
+    def setUp(self):
+        if not self.haveContext:
+            self.skipTest("no GL context (run under xvfb-run)")
+        import cairo
+        from OpenGL.GL.ARB.pixel_buffer_object import \
+            glInitPixelBufferObjectARB
+        if not glInitPixelBufferObjectARB():
+            self.skipTest("no pixel buffer objects")
+        self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+            self.width, self.height)
+        ctx = cairo.Context(self.surface)
+        for i in range(self.width):
+            ctx.set_source_rgba(i / self.width, 0.5, 1 - i / self.width,
+                                (i % 4 + 1) / 4)
+            ctx.rectangle(i, i % 7, 1, self.height - i % 7)
+            ctx.fill()
+        self.surface.flush()
+
+    def _texels(self, uploader, rects):
+        from OpenGL import GL
+        texture = GL.glGenTextures(1)
+        try:
+            GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA8, self.width,
+                self.height, 0, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, None)
+            uploader.upload(self.surface, rects)
+            uploader.flush()
+            data = GL.glGetTexImage(GL.GL_TEXTURE_2D, 0, GL.GL_BGRA,
+                GL.GL_UNSIGNED_BYTE)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        finally:
+            GL.glDeleteTextures([texture])
+        return np.frombuffer(data, dtype=np.uint8).reshape(
+            self.height, self.width, 4)
+
+    def _surface(self):
+        stride = self.surface.get_stride()
+        return np.frombuffer(self.surface.get_data(), dtype=np.uint8
+            ).reshape(self.height, stride)[:, :self.width*4].reshape(
+                self.height, self.width, 4)
+
+    def test_pboMatchesSync(self):
+        from Client.Overlay import SyncOverlayUploader, PBOOverlayUploader
+        for rects in ([self.rects[0]], self.rects[1:]):
+            sync = self._texels(SyncOverlayUploader(), rects)
+            pbo = self._texels(PBOOverlayUploader(), rects)
+            self.assertTrue(np.array_equal(sync, pbo), rects)
+            expected = self._surface()
+            for x, y, w, h in rects:
+                self.assertTrue(np.array_equal(
+                    pbo[y:y+h, x:x+w], expected[y:y+h, x:x+w]), rects)
+
+    def test_hoverUploadsSubRects(self):
+        from Client.Overlay import SyncOverlayUploader
+        region = DamageRegion(self.width, self.height)
+        hovered = [Widget(3, 4, 20, 10)]
+        damage = WidgetDamage(region, {"hover": lambda: hovered[0]})
+        before = damage.snapshot()
+        hovered[0] = Widget(40, 30, 27, 15)
+        damage.damage(before)
+        self.assertEqual(sorted(region.rects), self.rects[1:])
+        uploader = SyncOverlayUploader()
+        from OpenGL import GL
+        texture = GL.glGenTextures(1)
+        try:
+            GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA8, self.width,
+                self.height, 0, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, None)
+            uploaded = uploader.upload(self.surface, region.rects)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        finally:
+            GL.glDeleteTextures([texture])
+        self.assertEqual(uploaded, (20 * 10 + 27 * 15) * 4)
+        self.assertLess(uploaded, self.width * self.height * 4)
@@ -0,0 +1,138 @@
+# encoding=utf-8
+# File name: test_Pack.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Client.Pack import PackFile, MountPack, packDirectory
+
+FILES = {
+    "ui.css": b"body { color: red; }\n" * 50,
+    "shaders/ui.shader": b"void main() {}\n" * 20,
+    "shaders/common/util.glsl": b"",
+    "textures/ship.png": b"\x89PNG" + bytes(bytearray(range(256))) * 4,
+    "models/ship.obj": b"v 0 0 0\n" * 100,
+}
+
+class PackTestBase(unittest.TestCase):
+    compress = True
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="pyuniverse-test-")
+        source = os.path.join(self.directory, "data")
+        for path, data in FILES.items():
+            filename = os.path.join(source, *path.split("/"))
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, "wb") as f:
+                f.write(data)
+        self.filename = os.path.join(self.directory, "data.pack")
+        packDirectory(self.filename, source, compress=self.compress)
+        self.pack = PackFile(self.filename)
+
+    def tearDown(self):
+        self.pack.close()
+        shutil.rmtree(self.directory)
+
+class PackFileTest(PackTestBase):
+    def test_roundTrip(self):
+        self.assertEqual(len(self.pack), len(FILES))
+        for path, data in FILES.items():
+            self.assertIn(path, self.pack)
+            self.assertEqual(self.pack.size(path), len(data))
+            self.assertEqual(bytes(self.pack.read(path)), data)
+
+    def test_paths(self):
+        self.assertIn("/shaders/ui.shader", self.pack)
+        self.assertIn("shaders//ui.shader", self.pack)
+        self.assertNotIn("shaders/missing.shader", self.pack)
+        self.assertNotIn("shaders", self.pack)
+        self.assertRaises(IOError, self.pack.read, "missing")
+        self.assertRaises(IOError, self.pack.size, "missing")
+
+    def test_listdir(self):
+        self.assertEqual(self.pack.listdir("/"),
+                         ["models", "shaders", "textures", "ui.css"])
+        self.assertEqual(self.pack.listdir("shaders"),
+                         ["common", "ui.shader"])
+        self.assertEqual(self.pack.listdir("/shaders/"),
+                         ["common", "ui.shader"])
+        self.assertEqual(self.pack.listdir("shaders/common"), ["util.glsl"])
+        self.assertEqual(self.pack.listdir("missing"), [])
+
+    def test_isdir(self):
+        self.assertTrue(self.pack.isdir("shaders"))
+        self.assertTrue(self.pack.isdir("/shaders/common/"))
+        self.assertFalse(self.pack.isdir("shaders/ui.shader"))
+        self.assertFalse(self.pack.isdir("shade"))
+
+    def test_notAPack(self):
+        filename = os.path.join(self.directory, "data", "ui.css")
+        self.assertRaises(ValueError, PackFile, filename)
+
+class UncompressedPackFileTest(PackFileTest):
+    compress = False
+
+class MountPackTest(PackTestBase):
+    compress = False
+
+    def setUp(self):
+        super(MountPackTest, self).setUp()
+        self.mount = MountPack(self.filename)
+
+    def tearDown(self):
+        self.mount.pack.close()
+        super(MountPackTest, self).tearDown()
+
+    def test_open(self):
+        for path, data in FILES.items():
+            self.assertTrue(self.mount.fileReadable(path))
+            self.assertFalse(self.mount.fileWritable(path))
+            with self.mount.open(path) as f:
+                self.assertEqual(f.read(), data)
+
+    def test_partialReads(self):
+        data = FILES["ui.css"]
+        with self.mount.open("ui.css", "rb") as f:
+            self.assertEqual(f.read(4), data[:4])
+            self.assertEqual(f.tell(), 4)
+            buf = bytearray(6)
+            self.assertEqual(f.readinto(buf), 6)
+            self.assertEqual(bytes(buf), data[4:10])
+            f.seek(-3, os.SEEK_END)
+            self.assertEqual(f.read(), data[-3:])
+            self.assertEqual(f.read(), b"")
+
+    def test_getbuffer(self):
+        with self.mount.open("models/ship.obj") as f:
+            self.assertEqual(bytes(f.getbuffer()), FILES["models/ship.obj"])
+
+    def test_readOnly(self):
+        self.assertRaises(IOError, self.mount.open, "ui.css", "w")
@@ -0,0 +1,180 @@
+# encoding=utf-8
+# File name: test_ResourceCache.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import unittest
+
+from Client.FrameStats import FrameStats
+import Client.MemoryStats as MemoryStats
+from Client.ResourceCache import ResourceCache
+
+class Resource(object):
+    def __init__(self, name):
+        self.name = name
+
+class Buffer(object):
+    def __init__(self, bufferBytes):
+        self.bufferBytes = bufferBytes
+
+class Texture(object):
+    bound = None
+
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+
+    def bind(self):
+        Texture.bound = self
+
+    @classmethod
+    def unbind(cls):
+        cls.bound = None
+
+def texLevelParameter(target, level, name):
+    texture = Texture.bound
+    if max(texture.width, texture.height) >> level == 0:
+        # no such level
+        return 0
+    if name == MemoryStats.GL_TEXTURE_WIDTH:
+        return max(1, texture.width >> level)
+    return max(1, texture.height >> level)
+
+class ResourceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.stats = FrameStats()
+        self.loads = []
+        self.cache = ResourceCache(self.stats, cpuBudget=250,
+            sizeOf=lambda resource: (100, 0), load=self._load)
+
+    def _load(self, name, resourceType):
+        self.loads.append(name)
+        return Resource(name)
+
+    def _frame(self, *names):
+        self.stats.beginFrame()
+        for name in names:
+            self.cache.require(name)
+        self.cache.frameEnd(self.stats.frames)
+
+    def _cached(self):
+        return sorted(name for name, _ in self.cache._entries)
+
+    def test_hit(self):
+        self._frame("a", "a")
+        self.assertEqual(self.loads, ["a"])
+        self.assertEqual(self.stats.totals["resourceCacheHits"], 1)
+
+    def test_sizedAtFrameEnd(self):
+        self.cache.require("a")
+        self.assertEqual(self.cache.cpuBytes, 0)
+        self.cache.frameEnd(1)
+        self.assertEqual(self.cache.cpuBytes, 100)
+        self.assertEqual(self.stats.gauges["resourceCacheCPUBytes"], 100)
+
+    def test_lruOrder(self):
+        self._frame("a")
+        self._frame("b")
+        self._frame("c")
+        self.assertEqual(self._cached(), ["b", "c"])
+        self._frame("b")
+        self._frame("d")
+        self.assertEqual(self._cached(), ["b", "d"])
+        self.assertEqual(self.stats.totals["resourceCacheEvictions"], 2)
+        self.assertEqual(self.cache.cpuBytes, 200)
+
+    def test_pinned(self):
+        self.stats.beginFrame()
+        self.cache.require("a", pin=True)
+        self._frame("b")
+        self._frame("c")
+        self.assertEqual(self._cached(), ["a", "c"])
+        self.cache.unpin("a")
+        self._frame("d")
+        self.assertEqual(self._cached(), ["c", "d"])
+
+    def test_stillReferenced(self):
+        self.stats.beginFrame()
+        held = self.cache.require("a")
+        self._frame("b")
+        self._frame("c")
+        self.assertEqual(self._cached(), ["a", "c"])
+        del held
+        self._frame("d")
+        self.assertEqual(self._cached(), ["c", "d"])
+
+    def test_reloadAfterEviction(self):
+        self._frame("a")
+        self._frame("b")
+        self._frame("c")
+        self._frame("a")
+        self.assertEqual(self.loads, ["a", "b", "c", "a"])
+
+    def test_forget(self):
+        self._frame("a")
+        self.cache.forget("a")
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.cpuBytes, 0)
+
+
+class DefaultSizeOfTest(unittest.TestCase):
+    def setUp(self):
+        self.stats = FrameStats()
+        self.shared = Buffer(1000)
+        self.resources = {
+            "a": [self.shared, Buffer(10)],
+            "b": [self.shared, Buffer(20)],
+        }
+        self.cache = ResourceCache(self.stats,
+            load=lambda name, resourceType: self.resources[name])
+
+    def test_sharedCountedOnce(self):
+        self.cache.require("a")
+        self.cache.require("b")
+        self.cache.frameEnd(1)
+        self.assertEqual(self.cache.gpuBytes, 1030)
+        self.cache.forget("a")
+        self.assertEqual(self.cache.gpuBytes, 20)
+
+    def test_bounded(self):
+        self.resources["c"] = [[Buffer(1)] for i in range(100)]
+        self.cache.maxObjects = 10
+        self.cache.require("c")
+        self.cache.frameEnd(1)
+        self.assertLess(self.cache.gpuBytes, 10)
+
+    def test_textureLevels(self):
+        getParameter = MemoryStats.glGetTexLevelParameteriv
+        MemoryStats.glGetTexLevelParameteriv = texLevelParameter
+        try:
+            self.cache.textureType = Texture
+            self.resources["t"] = [Texture(4, 2)]
+            self.cache.require("t")
+            self.cache.frameEnd(1)
+        finally:
+            MemoryStats.glGetTexLevelParameteriv = getParameter
+        # 4x2, 2x1 and 1x1 texels
+        self.assertEqual(self.cache.gpuBytes, (8 + 2 + 1) * 4)
+        self.assertIsNone(Texture.bound)
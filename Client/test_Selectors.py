@@ -0,0 +1,96 @@
+# encoding=utf-8
+# File name: test_Selectors.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import unittest
+
+from Client.Selectors import Selector, SelectorIndex, makeNode, benchmark
+
+WINDOW = makeNode("Window", ["main"])
+BOX = makeNode("VBox")
+LABEL = makeNode("Label", ["title"], ["hover"])
+
+class SelectorTest(unittest.TestCase):
+    def test_compound(self):
+        self.assertTrue(Selector("Label.title:hover").matches((LABEL,)))
+        self.assertTrue(Selector("*").matches((LABEL,)))
+        self.assertFalse(Selector("Label:focus").matches((LABEL,)))
+        self.assertFalse(Selector("Label.other").matches((LABEL,)))
+
+    def test_combinators(self):
+        path = (WINDOW, BOX, LABEL)
+        self.assertTrue(Selector("Window Label").matches(path))
+        self.assertTrue(Selector("Window.main > VBox > Label").matches(path))
+        self.assertFalse(Selector("Window > Label").matches(path))
+        self.assertFalse(Selector("Label Window").matches(path))
+
+    def test_invalid(self):
+        for text in ("", ">", "Label >", "Label > > VBox", "La#bel"):
+            self.assertRaises(ValueError, Selector, text)
+
+    def test_specificity(self):
+        self.assertEqual(Selector("Window > Label.title:hover").specificity,
+                         (2, 2))
+
+
+class SelectorIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SelectorIndex()
+        for i, text in enumerate(["Label.title", "*", "Label", ":hover",
+                                  "Window Label", "VBox", ".main"]):
+            self.index.add(text, i)
+
+    def test_cascadeOrder(self):
+        # by specificity, then order of addition
+        self.assertEqual(self.index.match((WINDOW, BOX, LABEL)),
+                         [1, 2, 4, 3, 0])
+
+    def test_candidates(self):
+        found = sorted(entry[3] for entry in self.index.candidates(BOX))
+        self.assertEqual(found, [1, 5])
+
+    def test_candidatesUnknown(self):
+        found = sorted(entry[3]
+                       for entry in self.index.candidatesFor(["Label"]))
+        self.assertEqual(found, [0, 1, 2, 3, 4, 6])
+        found = sorted(entry[3] for entry in
+                       self.index.candidatesFor(["Label"], (), ()))
+        self.assertEqual(found, [1, 2, 4])
+
+    def test_memo(self):
+        path = (WINDOW, LABEL)
+        self.assertEqual(self.index.match(path), [1, 2, 4, 3, 0])
+        self.assertEqual(self.index.match(path), [1, 2, 4, 3, 0])
+        self.assertEqual(self.index.memoHits, 1)
+        # states are part of the path
+        other = (WINDOW, makeNode("Label", ["title"]))
+        self.assertEqual(self.index.match(other), [1, 2, 4, 0])
+        self.index.add("Label", 7)
+        self.assertEqual(self.index.match(path), [1, 2, 7, 4, 3, 0])
+
+    def test_benchmarkAgrees(self):
+        self.assertTrue(benchmark(200, 200)["agree"])
@@ -0,0 +1,109 @@
+# encoding=utf-8
+# File name: test_ShaderPermutations.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+from __future__ import unicode_literals, print_function, division
+from our_future import *
+
+import time
+import unittest
+
+from Client.FrameStats import FrameStats
+from Client.ShaderPermutations import ShaderPermutations
+
+class Shader(object):
+    def __init__(self, name):
+        self.name = name
+        self.compiled = []
+
+    def cacheShaders(self, permutations):
+        for defines in permutations:
+            self.compiled.append(tuple(sorted(defines.items())))
+
+    def bind(self, **defines):
+        return (self.name, tuple(sorted(defines.items())))
+
+TEXTURED = (("texturing", True),)
+PLAIN = (("texturing", False),)
+
+class ShaderPermutationsTest(unittest.TestCase):
+    def setUp(self):
+        self.stats = FrameStats()
+        self.old = Shader("old")
+        self.permutations = ShaderPermutations(self.old, self.stats,
+            defaults={"texturing": False}, fallback={"texturing": True},
+            frameBudget=1.0, minSlack=0.)
+
+    def test_fallback(self):
+        self.assertEqual(self.old.compiled, [TEXTURED])
+        self.assertEqual(self.permutations.bind(), ("old", TEXTURED))
+        self.assertEqual(self.permutations.pending, 1)
+        self.permutations.compileAll()
+        self.assertEqual(self.permutations.bind(), ("old", PLAIN))
+        self.assertEqual(self.stats.totals.get("shaderStalls", 0), 0)
+
+    def test_reload(self):
+        self.permutations.request({})
+        self.permutations.compileAll()
+        new = Shader("new")
+        self.permutations.reload(new)
+        # nothing is compiled right away, the old shader stays in use
+        self.assertEqual(new.compiled, [])
+        self.assertEqual(self.permutations.pending, 2)
+        self.assertEqual(self.permutations.bind(), ("old", PLAIN))
+        self.permutations.afterFrame(time.time())
+        self.assertEqual(self.permutations.bind(), ("old", PLAIN))
+        self.permutations.afterFrame(time.time())
+        self.assertEqual(sorted(new.compiled), [PLAIN, TEXTURED])
+        self.assertEqual(self.permutations.bind(), ("new", PLAIN))
+        self.assertEqual(self.stats.totals["shaderReloads"], 1)
+        self.assertEqual(self.permutations.pending, 0)
+
+    def test_reloadWithoutBudget(self):
+        self.permutations.reload(Shader("new"))
+        # the frame used up its budget long ago
+        self.permutations.afterFrame(0)
+        self.assertEqual(self.permutations.bind(texturing=True),
+                         ("old", TEXTURED))
+
+    def test_reloadAgain(self):
+        self.permutations.reload(Shader("new"))
+        newer = Shader("newer")
+        self.permutations.reload(newer)
+        self.permutations.compileAll()
+        self.assertEqual(self.permutations.bind(texturing=True),
+                         ("newer", TEXTURED))
+
+    def test_directBindStalls(self):
+        # e.g. the engine binding the shader without the wrapper
+        self.assertEqual(self.old.bind(texturing=False), ("old", PLAIN))
+        self.assertEqual(self.stats.totals["shaderStalls"], 1)
+        self.assertEqual(self.permutations.events[-1]["defines"],
+                         dict(PLAIN))
+        self.assertEqual(self.permutations.pending, 0)
+        # compiled now, so neither a stall nor the fallback
+        self.assertEqual(self.permutations.bind(), ("old", PLAIN))
+        self.assertEqual(self.old.bind(texturing=False), ("old", PLAIN))
+        self.assertEqual(self.stats.totals["shaderStalls"], 1)
+        self.assertEqual(self.stats.totals.get("shaderFallbacks", 0), 0)
@@ -35,9 +35,22 @@ import OpenGL
 OpenGL.ERROR_ON_COPY = True
 
 if __name__ == '__main__':
+    import time
+    startTime = time.time()
     import argparse
     import sys
     sys.path.append("PyEngine")
+    importTimer = None
+    # the import timer has to be installed before the heavy imports
+    # below, i.e. before the arguments are parsed; -b is recognized
+    # in all the forms the real parser accepts
+    preParser = argparse.ArgumentParser(add_help=False)
+    preParser.add_argument("-b", "--benchmark", nargs="?", const=True,
+        default=False)
+    if preParser.parse_known_args()[0].benchmark:
+        from Client.ImportTimer import ImportTimer
+        importTimer = ImportTimer()
+        importTimer.install()
     import Engine.CEngine.Window as CWindow
     from Engine.CEngine.Log import server as log, Severity
     from Client.PythonicUniverse import PythonicUniverse
@@ -61,6 +74,57 @@ if __name__ == '__main__':
         help="In profiling mode, drop into a shell after the\
  application terminated. In that shell, the profiling data will be\
  available in a pstats variable called p."
+    )
+    parser.add_argument(
+        "--profiler",
+        dest="profiler",
+        choices=["cprofile", "sampling"],
+        default="cprofile",
+        help="Profiler used by --profile. cprofile (default) traces\
+ every call; sampling samples the Python stack periodically from a\
+ background thread, which costs only a few percent and writes\
+ collapsed stacks for flamegraphs to FILE."
+    )
+    parser.add_argument(
+        "--sample-interval",
+        dest="sampleInterval",
+        type=float,
+        default=0.005,
+        metavar="SECONDS",
+        help="Interval between two samples of the sampling profiler."
+    )
+    parser.add_argument(
+        "--profile-frames",
+        dest="profileWindows",
+        action="append",
+        default=[],
+        metavar="START:END",
+        help="Profile only frames START up to END (exclusive) with the\
+ profiler selected by --profiler. May be given multiple times; each\
+ window is written to its own file (see --profile-prefix)."
+    )
+    parser.add_argument(
+        "--profile-budget",
+        dest="profileBudget",
+        type=float,
+        default=None,
+        metavar="MS",
+        help="Profile the frames following any frame which took longer\
+ than MS milliseconds."
+    )
+    parser.add_argument(
+        "--profile-hotkey",
+        dest="profileHotkey",
+        action="store_true",
+        help="Start and stop profiling windows with F12 at runtime."
+    )
+    parser.add_argument(
+        "--profile-prefix",
+        dest="profilePrefix",
+        default="/tmp/pyuniverse-profile",
+        metavar="PREFIX",
+        help="File name prefix for profiling windows; the frame numbers\
+ and the format are appended. Defaults to /tmp/pyuniverse-profile."
     )
     parser.add_argument(
         "-f", "--frame-count",
@@ -70,11 +134,308 @@ if __name__ == '__main__':
         metavar="N",
         help="Render exactly N frames and stop then."
     )
+    parser.add_argument(
+        "--overlay-upload",
+        dest="overlayUpload",
+        choices=["sync", "pbo"],
+        default="sync",
+        help="How the UI overlay is transferred to the GPU: sync\
+ uploads it directly (default), pbo streams it through pixel buffer\
+ objects with one frame of latency."
+    )
+    parser.add_argument(
+        "--pipeline-overlay",
+        dest="pipelineOverlay",
+        action="store_true",
+        help="Rasterize the UI overlay on a worker thread while the\
+ scene is rendered. The overlay lags one frame behind."
+    )
+    parser.add_argument(
+        "--overlay-tile-size",
+        dest="overlayTileSize",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Split the UI overlay texture into NxN tiles which are\
+ uploaded only when dirty."
+    )
+    parser.add_argument(
+        "--overlay-texture",
+        dest="overlayTextureStrategy",
+        choices=["auto", "pot", "npot"],
+        default="auto",
+        help="Size of the UI overlay texture: npot uses the exact\
+ window size, pot pads to powers of two, auto (default) uses npot if\
+ the context supports it."
+    )
+    parser.add_argument(
+        "-t", "--frame-timings",
+        dest="frameTimings",
+        nargs="?",
+        const=True,
+        default=False,
+        metavar="FILE",
+        help="Record the CPU time spent in each phase of the frame. The\
+ p50/p95/p99 summary is written to FILE (CSV if it ends in .csv, JSON\
+ otherwise) on exit and whenever F11 is pressed, or printed if FILE is\
+ omitted."
+    )
+    parser.add_argument(
+        "--gpu-timings",
+        dest="gpuTimings",
+        action="store_true",
+        help="Measure the GPU time of the scene, overlay upload and\
+ overlay composite with timer queries. The results are reported along\
+ with --frame-timings."
+    )
+    parser.add_argument(
+        "--schedule-gc",
+        dest="scheduleGC",
+        action="store_true",
+        help="Disable automatic garbage collection and run young\
+ generation collections after flip() when the frame is within budget."
+    )
+    parser.add_argument(
+        "--frame-budget",
+        dest="frameBudget",
+        type=float,
+        default=1000/60,
+        metavar="MS",
+        help="Frame time budget used by --schedule-gc. Defaults to 60 Hz."
+    )
+    parser.add_argument(
+        "--track-memory",
+        dest="trackMemory",
+        nargs="?",
+        const=300,
+        default=None,
+        type=int,
+        metavar="FRAMES",
+        help="Take a memory snapshot every FRAMES frames (default 300):\
+ allocation growth (via tracemalloc if available), live textures,\
+ models and scene nodes, and estimated GPU memory. Snapshots are\
+ available as mem in the profiling shell and in benchmark results."
+    )
+    parser.add_argument(
+        "--shader-cache",
+        dest="shaderCache",
+        choices=["on", "off", "cold"],
+        default="on",
+        help="Cache linked shader programs in the XDG cache directory.\
+ cold empties the cache first; compare the startupTime of benchmark\
+ runs with cold and on to measure the effect of the cache."
+    )
+    parser.add_argument(
+        "--lazy-shaders",
+        dest="lazyShaders",
+        action="store_true",
+        help="Compile shader permutations in spare frame time instead of\
+ at startup, drawing with a fallback permutation meanwhile."
+    )
+    parser.add_argument(
+        "--async-loading",
+        dest="asyncLoading",
+        action="store_true",
+        help="Load the ship model and the UI stylesheet in the\
+ background. Loads which create GL objects are finished on the main\
+ thread, a few milliseconds per frame."
+    )
+    parser.add_argument(
+        "--cpu-budget",
+        dest="cpuBudget",
+        type=float,
+        default=None,
+        metavar="MIB",
+        help="Evict least recently used resources when the loaded ones\
+ take more than MIB MiB of main memory. Resources still in the scene\
+ and UI resources are never evicted."
+    )
+    parser.add_argument(
+        "--gpu-budget",
+        dest="gpuBudget",
+        type=float,
+        default=None,
+        metavar="MIB",
+        help="Like --cpu-budget, for the estimated GPU memory of loaded\
+ textures."
+    )
+    parser.add_argument(
+        "--data",
+        dest="dataDirectory",
+        default=None,
+        metavar="PATH",
+        help="Mount PATH as /data instead of ./data, e.g. a tree cooked\
+ by utils/cook/cook.py. Cooked style sheets and textures found there\
+ are used instead of their sources. PATH may also be a pack archive\
+ created with cook.py --pack or python -m Client.Pack create."
+    )
+    parser.add_argument(
+        "--cache-paths",
+        dest="cachePaths",
+        action="store_true",
+        help="Remember which files exist in which mount, so resolving a\
+ path again does no file system I/O. Lookups and cache misses are\
+ counted as vfsLookups and vfsCacheMisses in the frame stats."
+    )
+    parser.add_argument(
+        "--selector-index",
+        dest="selectorIndex",
+        action="store_true",
+        help="Index the style rules by the rightmost part of their\
+ selectors, so styling a widget only tests the rules which can match\
+ it. The time spent applying styles is recorded as styleTime in the\
+ frame stats, for comparison with and without this option. See also\
+ python -m Client.Selectors."
+    )
+    parser.add_argument(
+        "--hot-reload",
+        dest="hotReload",
+        action="store_true",
+        help="Watch the data directory with inotify and reload ui.css,\
+ the UI shader and, with --model-format cooked, the ship mesh in the\
+ background when they change."
+    )
+    parser.add_argument(
+        "--model-format",
+        dest="modelFormat",
+        choices=["obj", "cooked"],
+        default="obj",
+        help="Load the ship from spaceship.obj (default) or from the\
+ cooked spaceship.mesh in the data directory, created by\
+ utils/cook/cook.py or python -m Client.Mesh. The load time is\
+ reported as the modelLoadTime gauge in benchmark results."
+    )
+    parser.add_argument(
+        "-b", "--benchmark",
+        dest="benchmark",
+        nargs="?",
+        const=True,
+        default=False,
+        metavar="FILE",
+        help="Run in benchmark mode: render a fixed number of frames\
+ (see --frame-count, default 1000) with a fixed time delta and write\
+ the results as JSON to FILE, or to stdout if FILE is omitted. For\
+ headless runs, start under xvfb-run with Mesa."
+    )
+    parser.add_argument(
+        "--scenario",
+        dest="scenario",
+        default="default",
+        metavar="NAME[:N]",
+        help="Benchmark scenario: default, empty, ships or heavy-ui.\
+ ships and heavy-ui take an optional number of ships or windows."
+    )
+    parser.add_argument(
+        "--time-delta",
+        dest="timeDelta",
+        type=float,
+        default=1/60,
+        metavar="SECONDS",
+        help="Fixed time delta per frame in benchmark mode."
+    )
     args = parser.parse_args(sys.argv[1:])
+
+    windowed = args.profileWindows or args.profileBudget is not None or \
+        args.profileHotkey
+    if windowed and args.profile:
+        parser.error("--profile cannot be combined with windowed profiling")
+    profileWindows = []
+    for window in args.profileWindows:
+        try:
+            start, end = (int(frame) for frame in window.split(":"))
+        except ValueError:
+            parser.error("Invalid frame window: {0}".format(window))
+        profileWindows.append((start, end))
+
+    appKwargs = {}
+    if args.benchmark:
+        from Client.Benchmark import scenarioArguments, runBenchmark, \
+            writeResult
+        if args.profile:
+            parser.error("--benchmark and --profile are mutually exclusive")
+        appKwargs = scenarioArguments(args.scenario)
+        appKwargs["fixedTimeDelta"] = args.timeDelta
+        if not args.frameTimings:
+            args.frameTimings = True
     
     log.log(Severity.Information, "Python initialized")
-    app = PythonicUniverse(CWindow.display)
-    if args.profile:
+    app = PythonicUniverse(CWindow.display,
+        overlayUpload=args.overlayUpload,
+        pipelineOverlay=args.pipelineOverlay,
+        overlayTileSize=args.overlayTileSize,
+        overlayTextureStrategy=args.overlayTextureStrategy,
+        timePhases=bool(args.frameTimings),
+        timeGPU=args.gpuTimings,
+        scheduleGC=args.scheduleGC,
+        frameBudget=args.frameBudget / 1000,
+        trackMemory=args.trackMemory is not None,
+        memoryInterval=args.trackMemory or 300,
+        shaderCache=args.shaderCache,
+        lazyShaders=args.lazyShaders,
+        asyncLoading=args.asyncLoading,
+        modelFormat=args.modelFormat,
+        dataDirectory=args.dataDirectory,
+        cachePaths=args.cachePaths,
+        selectorIndex=args.selectorIndex,
+        hotReload=args.hotReload,
+        cpuBudget=(args.cpuBudget * 2**20
+                   if args.cpuBudget is not None else None),
+        gpuBudget=(args.gpuBudget * 2**20
+                   if args.gpuBudget is not None else None),
+        frameTimingsFile=(args.frameTimings
+                          if args.frameTimings is not True else None),
+        **appKwargs)
+    if windowed:
+        from Client.Profiling import FrameWindowProfiler
+        app.windowProfiler = FrameWindowProfiler(
+            args.profilePrefix,
+            kind=args.profiler,
+            ranges=profileWindows,
+            budget=(args.profileBudget / 1000
+                    if args.profileBudget is not None else None),
+            sampleInterval=args.sampleInterval)
+    if args.benchmark:
+        if args.profileFrames < 0:
+            raise ValueError("Nice try.")
+        if importTimer is not None:
+            importTimer.uninstall()
+        result = runBenchmark(app, args.scenario,
+            args.profileFrames or 1000, time.time() - startTime,
+            importTimer=importTimer)
+        writeResult(result,
+            args.benchmark if args.benchmark is not True else None)
+    elif args.profile and args.profiler == "sampling":
+        from Client.Profiling import SamplingProfiler
+        log.log(Severity.Warning, "Running in sampling profiler mode")
+        if args.profileFrames:
+            if args.profileFrames < 0:
+                raise ValueError("Nice try.")
+            app._eventLoop.setFrameCount(args.profileFrames)
+            log.log(Severity.Information, "Will terminate after {0} frames.".format(args.profileFrames))
+        profiler = SamplingProfiler(interval=args.sampleInterval)
+        profiler.start()
+        try:
+            app.run()
+        finally:
+            profiler.stop()
+        log.log(Severity.Information, "Collected {0} samples".format(profiler.sampleCount))
+        if args.profile is not True:
+            log.log(Severity.Information, "Collapsed stacks are going to file: {0}".format(args.profile))
+            profiler.writeCollapsed(args.profile)
+        if args.profileShell:
+            import code
+            import readline
+            def topTimes(n=10):
+                for name, count in profiler.topFunctions(n):
+                    print("{0:6.2f}%  {1}".format(
+                        100 * count / max(profiler.sampleCount, 1), name))
+            namespace = {}
+            namespace["s"]          = profiler
+            namespace["app"]        = app
+            namespace["mem"]        = app.memoryStats
+            namespace["topTimes"]   = topTimes
+            code.InteractiveConsole(namespace).interact("Profiling shell. Samples of the current run are available in the s object. Application state is available in the app object.")
+    elif args.profile:
         import cProfile
         log.log(Severity.Warning, "Running in cProfile mode")
         if args.profileShell and args.profile is True:
@@ -100,7 +461,15 @@ if __name__ == '__main__':
             namespace = {}
             namespace["p"]          = p
             namespace["app"]        = app
+            namespace["mem"]        = app.memoryStats
             namespace["topTimes"]   = topTimes
             code.InteractiveConsole(namespace).interact("Profiling shell. Stats of the current run are available in the p object. Application state is available in the app object.")
     else:
+        if windowed and args.profileFrames > 0:
+            app._eventLoop.setFrameCount(args.profileFrames)
         app.run()
+        if app.windowProfiler is not None:
+            # close a window left open by the hotkey
+            app.windowProfiler.stop()
+    if (args.frameTimings or args.gpuTimings) and not args.benchmark:
+        app.dumpFrameTimings()
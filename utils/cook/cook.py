@@ -0,0 +1,316 @@
+#!/usr/bin/python2
+# encoding=utf8
+# File name: cook.py
+# This file is part of: pyuni
+#
+# LICENSE
+#
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+#
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public license (the  "GPL License"), in which case
+# the provisions of GPL License are applicable instead of those above.
+#
+# FEEDBACK & QUESTIONS
+#
+# For feedback and questions about pyuni please e-mail one of the
+# authors named in the AUTHORS file.
+########################################################################
+"""
+Cook the data tree (given as first argument) into an output directory
+which can be mounted in its place (see py-universe.py --data).
+
+All source files are copied, and next to them the cooked forms are
+written (see Client/Mesh.py and Client/Cooked.py):
+
+* OBJ models as binary meshes (.mesh),
+* PNG images as pre-decoded textures with mip chains (.tex),
+* CSS style sheets as rule tables in JSON (.rules), if the engine is
+  available; they are cooked again when the engine modules they refer
+  to change, and
+* shaders with their #include directives expanded, under their own
+  name.
+
+Cooking is incremental: a source is only cooked again if its content
+hash, or that of a file it references, changed since the last run. The
+hashes are kept in the manifest in the output directory.
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import traceback
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, root)
+sys.path.append(os.path.join(root, "PyEngine"))
+
+# bump to invalidate everything cooked by older versions
+COOKER_VERSION = 1
+MANIFEST = ".cook-manifest.json"
+
+includeRe = re.compile(r'^\s*#include\s+"(?P<name>[^"]+)"\s*$')
+mtllibRe = re.compile(r'^\s*mtllib\s+(?P<names>.+?)\s*$')
+
+def dependencies(path, seen=()):
+    """
+    Return the files *path* references, which have to be hashed along
+    with it.
+    """
+    if path in seen:
+        # cooking it fails in expandIncludes, which reports the cycle
+        return []
+    ext = os.path.splitext(path)[1].lower()
+    directory = os.path.dirname(path)
+    result = []
+    if ext == ".obj":
+        with io.open(path, encoding="utf-8") as f:
+            for line in f:
+                match = mtllibRe.match(line)
+                if match:
+                    result.extend(os.path.join(directory, name)
+                                  for name in match.group("names").split())
+    elif ext == ".shader":
+        with io.open(path, encoding="utf-8") as f:
+            for line in f:
+                match = includeRe.match(line)
+                if match:
+                    include = os.path.join(directory, match.group("name"))
+                    result.append(include)
+                    if os.path.isfile(include):
+                        result.extend(dependencies(include, seen + (path,)))
+    return result
+
+def contentHash(path):
+    h = hashlib.sha1(str(COOKER_VERSION).encode("ascii"))
+    for filename in [path] + dependencies(path):
+        h.update(filename.encode("utf-8"))
+        try:
+            with open(filename, "rb") as f:
+                h.update(f.read())
+        except IOError:
+            h.update(b"<missing>")
+    return h.hexdigest()
+
+def expandIncludes(path, seen=()):
+    if path in seen:
+        raise ValueError("Recursive #include of {0}".format(path))
+    directory = os.path.dirname(path)
+    lines = []
+    with io.open(path, encoding="utf-8") as f:
+        for line in f:
+            match = includeRe.match(line)
+            if match:
+                lines.append(expandIncludes(
+                    os.path.join(directory, match.group("name")),
+                    seen + (path,)))
+            else:
+                lines.append(line)
+    return "".join(lines)
+
+def cookTexture(src, dst):
+    import cairo
+    import numpy as np
+    from Client.Cooked import writeTexture
+    surface = cairo.ImageSurface.create_from_png(src)
+    w, h = surface.get_width(), surface.get_height()
+    data = np.frombuffer(surface.get_data(), dtype=np.uint8).reshape(
+        h, surface.get_stride())[:, :w*4].reshape(h, w, 4)
+    # cairo: premultiplied, native endian ARGB32, i.e. BGRA here
+    if sys.byteorder == "little":
+        rgba = data[:, :, [2, 1, 0, 3]].astype(np.uint32)
+    else:
+        rgba = data[:, :, [1, 2, 3, 0]].astype(np.uint32)
+    alpha = rgba[:, :, 3:4]
+    rgba[:, :, :3] = np.where(alpha > 0,
+        (rgba[:, :, :3] * 255 + alpha // 2) // np.maximum(alpha, 1), 0)
+    with open(dst, "wb") as f:
+        writeTexture(f, rgba.astype(np.uint8))
+
+_resourceManager = None
+
+def cookRules(src, dst, dataDir):
+    global _resourceManager
+    from Client.Cooked import writeRules
+    from Engine.Resources.Manager import ResourceManager
+    if _resourceManager is None:
+        from Engine.VFS.FileSystem import XDGFileSystem, MountPriority
+        from Engine.VFS.Mounts import MountDirectory
+        import Engine.Resources.CSSLoader
+        vfs = XDGFileSystem('pyuniverse')
+        vfs.mount('/data', MountDirectory(dataDir), MountPriority.FileSystem)
+        _resourceManager = ResourceManager(vfs)
+    name = "/data/" + os.path.relpath(src, dataDir).replace(os.sep, "/")
+    rules = _resourceManager.require(name)
+    with open(dst, "wb") as f:
+        writeRules(f, rules)
+
+def outputCurrent(path):
+    """
+    Whether the cooked file at *path* is still valid, given that its
+    source did not change.
+    """
+    if not os.path.isfile(path):
+        return False
+    if path.endswith(".rules"):
+        from Client.Cooked import rulesCurrent
+        try:
+            # the classes the rules may contain
+            import Engine.Resources.CSSLoader
+        except ImportError:
+            return False
+        with open(path, "rb") as f:
+            return rulesCurrent(f)
+    return True
+
+def cook(job):
+    """
+    Cook one source file; run in the worker processes. Return
+    ``(relpath, outputs, error)``.
+    """
+    dataDir, outDir, relpath = job
+    src = os.path.join(dataDir, relpath)
+    dst = os.path.join(outDir, relpath)
+    base, ext = os.path.splitext(dst)
+    ext = ext.lower()
+    outputs = [relpath]
+    try:
+        try:
+            os.makedirs(os.path.dirname(dst))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(dst)):
+                raise
+        if ext == ".shader":
+            with io.open(dst, "w", encoding="utf-8") as f:
+                f.write(expandIncludes(src))
+        else:
+            shutil.copyfile(src, dst)
+
+        if ext == ".obj":
+            from Client.Mesh import cookOBJ
+            cookOBJ(src, base + ".mesh")
+            outputs.append(os.path.splitext(relpath)[0] + ".mesh")
+        elif ext == ".png":
+            cookTexture(src, base + ".tex")
+            outputs.append(os.path.splitext(relpath)[0] + ".tex")
+        elif ext == ".css":
+            try:
+                cookRules(src, base + ".rules", dataDir)
+            except ImportError:
+                # without the engine, the style sheet is just copied
+                return relpath, outputs, None
+            outputs.append(os.path.splitext(relpath)[0] + ".rules")
+    except Exception:
+        return relpath, outputs, traceback.format_exc()
+    return relpath, outputs, None
+
+def sources(dataDir):
+    for dirpath, dirnames, filenames in os.walk(dataDir):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        for filename in filenames:
+            if not filename.startswith("."):
+                yield os.path.relpath(os.path.join(dirpath, filename), dataDir)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cook the data tree for faster loading.")
+    parser.add_argument("data", help="The data directory to cook.")
+    parser.add_argument("output", help="Where to write the cooked tree.")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes; defaults to the CPU count."
+    )
+    parser.add_argument(
+        "--pack",
+        default=None,
+        metavar="FILE",
+        help="Also write the cooked tree into the pack archive FILE."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Cook everything, ignoring the manifest."
+    )
+    args = parser.parse_args()
+    dataDir = os.path.abspath(args.data)
+    outDir = os.path.abspath(args.output)
+
+    manifestPath = os.path.join(outDir, MANIFEST)
+    manifest = {}
+    if not args.force and os.path.isfile(manifestPath):
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+
+    newManifest = {}
+    jobs = []
+    for relpath in sources(dataDir):
+        digest = contentHash(os.path.join(dataDir, relpath))
+        entry = manifest.get(relpath)
+        if entry is not None and entry["hash"] == digest and all(
+                outputCurrent(os.path.join(outDir, output))
+                for output in entry["outputs"]):
+            newManifest[relpath] = entry
+            continue
+        newManifest[relpath] = {"hash": digest, "outputs": []}
+        jobs.append((dataDir, outDir, relpath))
+
+    # outputs of sources which are gone
+    for relpath, entry in manifest.items():
+        if relpath not in newManifest:
+            for output in entry["outputs"]:
+                try:
+                    os.unlink(os.path.join(outDir, output))
+                except OSError:
+                    pass
+
+    failed = 0
+    if jobs:
+        pool = multiprocessing.Pool(args.jobs)
+        try:
+            for relpath, outputs, error in pool.imap_unordered(cook, jobs):
+                if error is not None:
+                    print("failed: {0}\n{1}".format(relpath, error),
+                          file=sys.stderr)
+                    failed += 1
+                    # cook it again next time
+                    del newManifest[relpath]
+                    continue
+                newManifest[relpath]["outputs"] = outputs
+                print("cooked: {0}".format(relpath))
+        finally:
+            pool.close()
+            pool.join()
+    print("{0} cooked, {1} up to date, {2} failed".format(
+        len(jobs) - failed, len(newManifest) - len(jobs) + failed, failed))
+
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    with open(manifestPath, "w") as f:
+        json.dump(newManifest, f, indent=2, sort_keys=True)
+    if args.pack is not None:
+        from Client.Pack import writePack
+        writePack(args.pack, dict(
+            (output.replace(os.sep, "/"), os.path.join(outDir, output))
+            for entry in newManifest.values()
+            for output in entry["outputs"]))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())